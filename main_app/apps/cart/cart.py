@@ -1,14 +1,16 @@
-from fastapi import Depends, Request
-from .models import BaseCart, LineItem, SessionId
-from .cart_exceptions import CartAlreadyExist, CartNotExist, NotValidUUID
+from fastapi import Depends, Request, HTTPException
+from .models import BaseCart, LineItem, LineItemUpdate, SessionId, CartOperation, CartOperationTypeEnum
+from .cart_exceptions import CartAlreadyExist, CartNotExist, NotValidUUID, CartWriteConflict, InvalidCartOperation
 import uuid
+import threading
+from typing import Any, Awaitable, Callable, Dict, List
 from config import settings
 
 from .jwt_session import create_session_token, decode_token
 
 from pydantic import UUID4
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
 
 
 def create_session_id():
@@ -28,7 +30,20 @@ def get_cart_by_session_id( session_id: uuid.UUID, silent=False):
         if not silent:
             raise CartNotExist
         return None
-    cart = BaseCart(**cart)
+    cart = BaseCart.from_db(cart)
+    cart.attach_coupons()
+    return cart
+
+async def get_cart_by_session_id_async(session_id: uuid.UUID, silent=False):
+    cart = await async_db_provider.carts_db.find_one(
+        {"session_id": session_id}
+    )
+    if not cart:
+        if not silent:
+            raise CartNotExist
+        return None
+    cart = BaseCart.from_db(cart)
+    await cart.hydrate_async()
     return cart
 
 
@@ -42,14 +57,153 @@ def get_cart_by_id(cart_id: uuid.UUID, link_products: bool = True, silent: bool
         if not silent:
             raise CartNotExist
         return None
-    cart = BaseCart(**cart)
+    cart = BaseCart.from_db(cart)
+    cart.attach_coupons()
     return cart
 
+async def get_cart_by_id_async(cart_id: uuid.UUID, link_products: bool = True, silent: bool = False):
+    cart = await async_db_provider.carts_db.find_one(
+        {"_id": cart_id}
+    )
+    if not cart:
+        if not silent:
+            raise CartNotExist
+        return None
+    cart = BaseCart.from_db(cart)
+    await cart.hydrate_async()
+    return cart
 
-def get_current_cart_active_by_id(cart: BaseCart = Depends(get_cart_by_id)):
+
+def get_current_cart_active_by_id(cart: BaseCart = Depends(get_cart_by_id_async)):
     return cart
 
 def delete_session_cart(session_id: UUID4):
         cart = get_cart_by_session_id(session_id, silent=True)
         if cart:
             cart.delete_db()
+
+async def delete_session_cart_async(session_id: UUID4):
+        cart = await get_cart_by_session_id_async(session_id, silent=True)
+        if cart:
+            await cart.delete_db_async()
+
+
+class CartWriteStats:
+    """ cart compare-and-swap writes metrics (per worker) """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            "writes": 0,
+            "conflicts": 0,
+            "retries": 0,
+            "failures": 0,
+        }
+
+    def add(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+cart_write_stats = CartWriteStats()
+
+async def mutate_cart_async(
+    cart: BaseCart,
+    mutate: Callable[[BaseCart], Awaitable[Any]],
+) -> BaseCart:
+    """
+        Apply [mutate] (changes cart and counts amounts) and save changes.
+        If cart was changed by other request, cart is reloaded and [mutate]
+        is applied again (up to CART_WRITE_RETRIES times).
+        [mutate] can return False, if cart must not be saved
+    """
+    for attempt in range(settings.CART_WRITE_RETRIES + 1):
+        if await mutate(cart) is False:
+            return cart
+        if await cart.save_changes_async():
+            cart_write_stats.add("writes")
+            return cart
+        cart_write_stats.add("conflicts")
+        if attempt == settings.CART_WRITE_RETRIES:
+            break
+        cart_write_stats.add("retries")
+        cart = await get_cart_by_id_async(cart.id)
+    cart_write_stats.add("failures")
+    raise CartWriteConflict
+
+# cart batch operations
+
+MAX_CART_OPERATIONS = 50
+# operations, that need authenticated user
+USER_CART_OPERATIONS = {
+    CartOperationTypeEnum.add_coupon,
+    CartOperationTypeEnum.set_bonuses,
+    CartOperationTypeEnum.remove_bonuses,
+}
+
+def check_cart_operation(index: int, operation: CartOperation):
+    required = {
+        CartOperationTypeEnum.add_items: "line_items",
+        CartOperationTypeEnum.update_item: "item_id",
+        CartOperationTypeEnum.remove_item: "item_id",
+        CartOperationTypeEnum.add_coupon: "coupon_code",
+        CartOperationTypeEnum.set_bonuses: "pay_with_bonuses",
+    }.get(operation.type)
+    if required and getattr(operation, required) is None:
+        raise InvalidCartOperation(index, f"{required} is required for {operation.type.value}")
+    if operation.type == CartOperationTypeEnum.update_item and operation.quantity is None:
+        raise InvalidCartOperation(index, "quantity is required for update_item")
+
+async def apply_cart_operation(
+    cart: BaseCart,
+    operation: CartOperation,
+    coupons: Dict[str, Any],
+):
+    """
+        Apply one batch operation to cart in memory (cart is counted
+        only if operation check depends on cart amount)
+    """
+    if operation.type == CartOperationTypeEnum.add_items:
+        # copies, operations can be applied again, if cart is reloaded
+        await cart.add_line_items_async([line_item.copy() for line_item in operation.line_items])
+    elif operation.type == CartOperationTypeEnum.update_item:
+        cart.update_line_item(operation.item_id, LineItemUpdate(quantity = operation.quantity))
+    elif operation.type == CartOperationTypeEnum.remove_item:
+        cart.remove_line_item(operation.item_id)
+    elif operation.type == CartOperationTypeEnum.add_coupon:
+        cart.coupons = [coupons[operation.coupon_code]]
+        can_apply, msg = cart.check_can_apply_coupons()
+        if not can_apply:
+            raise HTTPException(status_code = 400, detail = msg)
+    elif operation.type == CartOperationTypeEnum.remove_coupon:
+        cart.delete_coupons()
+    elif operation.type == CartOperationTypeEnum.set_bonuses:
+        if cart.bonuses_used:
+            cart.bonuses_used = False
+            cart.pay_with_bonuses = 0
+        # bonuses limit depends on current cart total
+        await cart.count_amount_async()
+        cart.pay_with_bonuses = operation.pay_with_bonuses
+        cart.bonuses_used = True
+        can_pay, msg = cart.check_can_pay_with_bonuses()
+        if not can_pay:
+            raise HTTPException(status_code = 400, detail = msg)
+    elif operation.type == CartOperationTypeEnum.remove_bonuses:
+        cart.bonuses_used = False
+        cart.pay_with_bonuses = 0
+
+async def apply_cart_operations(
+    cart: BaseCart,
+    operations: List[CartOperation],
+    coupons: Dict[str, Any],
+    current_user = None,
+):
+    """ apply operations in order, then count cart once. Any failed operation fails batch """
+    for index, operation in enumerate(operations):
+        try:
+            await apply_cart_operation(cart, operation, coupons)
+        except HTTPException as e:
+            raise InvalidCartOperation(index, e.detail)
+    await cart.count_amount_async(current_user = current_user)
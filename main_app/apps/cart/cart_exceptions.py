@@ -21,3 +21,16 @@ class NotValidUUID(HTTPException):
 	def __init__(self):
 		self.status_code = 400
 		self.detail = "not valid uuid specified"
+
+class CartWriteConflict(HTTPException):
+	def __init__(self):
+		self.status_code = 409
+		self.detail = "Cart was changed concurrently, try again"
+
+class InvalidCartOperation(HTTPException):
+	def __init__(self, index: int, msg):
+		self.status_code = 400
+		self.detail = {
+			"msg": msg,
+			"operation": index,
+		}
@@ -0,0 +1,90 @@
+import bson
+from pymongo import ReplaceOne
+
+from .models import BaseCart
+
+from database.main_db import db_provider
+
+
+# carts, replaced with one bulk_write
+COMPACT_BATCH_SIZE = 500
+
+
+class DocumentsSizeStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, size: int):
+        self.count += 1
+        self.total += size
+        self.max = max(self.max, size)
+
+    def get_stats(self) -> dict:
+        return {
+            "count": self.count,
+            "total_bytes": self.total,
+            "avg_bytes": int(self.total / self.count) if self.count else 0,
+            "max_bytes": self.max,
+        }
+
+
+def get_compact_cart(cart_dict: dict) -> dict:
+    """
+        stored cart -> compact cart document: price snapshot from embedded product,
+        coupons references instead of coupons, without line items pricing
+    """
+    cart = BaseCart.from_db(cart_dict)
+    for line_item in cart.line_items:
+        if line_item.price is None and line_item.product:
+            line_item.price = line_item.product.get_price()
+    return cart.to_db_dict()
+
+def compact_carts(dry_run: bool = False) -> dict:
+    """
+        Rewrite carts into compact documents (see BaseCart.to_db_dict).
+        Cart is replaced only if it was not changed while migration (same version)
+    """
+    codec_options = db_provider.carts_db.codec_options
+    before = DocumentsSizeStats()
+    after = DocumentsSizeStats()
+    result = {"replaced": 0, "skipped": 0, "errors": 0}
+    requests = []
+
+    def write_batch():
+        if not dry_run and requests:
+            write_result = db_provider.carts_db.bulk_write(requests, ordered = False)
+            result["replaced"] += write_result.modified_count
+            result["skipped"] += len(requests) - write_result.matched_count
+        requests.clear()
+
+    for cart_dict in db_provider.carts_db.find({}):
+        before.add(len(bson.encode(cart_dict, codec_options = codec_options)))
+        try:
+            compact_cart = get_compact_cart(cart_dict)
+        except Exception as e:
+            print('cart can not be compacted', cart_dict.get("_id"), e)
+            result["errors"] += 1
+            after.add(len(bson.encode(cart_dict, codec_options = codec_options)))
+            continue
+        after.add(len(bson.encode(compact_cart, codec_options = codec_options)))
+        version_filter = {"$in": [0, None]} if not cart_dict.get("version") else cart_dict["version"]
+        requests.append(ReplaceOne(
+            {"_id": cart_dict["_id"], "version": version_filter},
+            compact_cart,
+        ))
+        if len(requests) >= COMPACT_BATCH_SIZE:
+            write_batch()
+    write_batch()
+    return {
+        **result,
+        "before": before.get_stats(),
+        "after": after.get_stats(),
+    }
+
+
+if __name__ == "__main__":
+    # migration: python -m apps.cart.compact_carts [--dry-run]
+    import sys
+    print(compact_carts(dry_run = "--dry-run" in sys.argv))
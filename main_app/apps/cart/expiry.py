@@ -0,0 +1,111 @@
+import asyncio
+import os
+from collections import deque
+from datetime import datetime
+
+from pymongo.errors import OperationFailure
+
+from config import settings
+
+from database.main_db import db_provider, async_db_provider
+
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# user carts (others are guest carts)
+USER_CARTS_QUERY = {"$or": [
+    {"user_id": {"$ne": None}},
+    {"customer_id": {"$ne": None}},
+]}
+GUEST_CARTS_QUERY = {"user_id": None, "customer_id": None}
+
+
+def set_missing_expires() -> int:
+    """
+        expires for carts, saved before expiry was added (by date_modified).
+        One-off migration (not run by workers): python -m apps.cart.expiry
+    """
+    modified = 0
+    for query, ttl_days in (
+        (GUEST_CARTS_QUERY, settings.CART_GUEST_TTL_DAYS),
+        (USER_CARTS_QUERY, settings.CART_USER_TTL_DAYS),
+    ):
+        result = db_provider.carts_db.update_many(
+            {"expires": {"$exists": False}, **query},
+            [{"$set": {"expires": {
+                "$add": [{"$ifNull": ["$date_modified", "$$NOW"]}, ttl_days * DAY_MS],
+            }}}],
+        )
+        modified += result.modified_count
+    return modified
+
+async def get_carts_collection_stats() -> dict:
+    try:
+        stats = await async_db_provider.db_main.command("collStats", "carts")
+    except OperationFailure:
+        return {"count": 0, "size_bytes": 0, "storage_bytes": 0}
+    return {
+        "count": stats.get("count", 0),
+        "size_bytes": stats.get("size", 0),
+        "storage_bytes": stats.get("storageSize", 0),
+    }
+
+
+class CartsSweeper:
+    """
+        Periodically removes expired carts (TTL index removes them too,
+        sweeper makes expiry countable) and samples carts collection size.
+        Runs in every worker, stats are of current worker sweeps
+    """
+
+    def __init__(self):
+        self.history = deque(maxlen = settings.CART_SWEEP_HISTORY)
+        self.expired_total = 0
+        self._task = None
+
+    async def sweep(self) -> dict:
+        date = datetime.utcnow()
+        result = await async_db_provider.carts_db.delete_many({"expires": {"$lt": date}})
+        self.expired_total += result.deleted_count
+        sample = {
+            "date": date,
+            "expired": result.deleted_count,
+            **await get_carts_collection_stats(),
+        }
+        self.history.append(sample)
+        print('carts sweep, expired', result.deleted_count, 'carts', sample["count"])
+        return sample
+
+    async def watch(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print('carts sweep failed', e)
+            await asyncio.sleep(settings.CART_SWEEP_INTERVAL)
+
+    def start_watch(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.watch())
+
+    def stop_watch(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> dict:
+        return {
+            # stats are per worker process
+            "worker_pid": os.getpid(),
+            "guest_ttl_days": settings.CART_GUEST_TTL_DAYS,
+            "user_ttl_days": settings.CART_USER_TTL_DAYS,
+            "expired_total": self.expired_total,
+            "history": list(self.history),
+        }
+
+carts_sweeper = CartsSweeper()
+
+
+if __name__ == "__main__":
+    # migration: python -m apps.cart.expiry
+    print('carts expires set', set_missing_expires())
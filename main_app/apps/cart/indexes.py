@@ -0,0 +1,10 @@
+from pymongo import IndexModel, ASCENDING
+
+# indexes, that are applied on startup (see database/indexes.py)
+cart_indexes = {
+    "carts_db": [
+        IndexModel([("session_id", ASCENDING)]),
+        # mongo removes carts, when they are expired (see BaseCart.set_modified)
+        IndexModel([("expires", ASCENDING)], expireAfterSeconds = 0),
+    ],
+}
@@ -1,25 +1,26 @@
 from fastapi import FastAPI
 import uuid
-from pymongo import ReturnDocument
 from enum import Enum
 
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
-from pydantic import UUID4, BaseModel, Field
-from datetime import datetime
+from pydantic import UUID4, BaseModel, Field, PrivateAttr
+from datetime import datetime, timedelta
 
 from apps.products.models import BaseProduct
-from apps.products.products import get_product_by_id
+from apps.products.products import get_product_by_id, get_product_by_id_async, get_products_by_ids, get_products_by_ids_async
 
 from apps.site.utils import get_time_now
 # from coupons app
 from apps.coupons.models import BaseCoupon, CouponTypeEnum
+from apps.coupons.coupon import get_coupon_by_id, get_coupon_by_id_async
 
 from apps.bonuses.bonuses import bonuses_levels
 
 from .cart_exceptions import LineItemNotExist
+from .pricing import CartPricing
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
 
 from config import settings
 
@@ -40,6 +41,9 @@ class LineItem(BaseModel):
     product_id: UUID4
     quantity: int = 1
     promo_price: Optional[int]
+    # product price, when cart was priced last time (stored instead of product)
+    price: Optional[int]
+    # not stored in carts, attached from catalog (see BaseCart.hydrate_async)
     product: Optional[BaseProduct]
     # variant_id: UUID4
     def get_base_price(self):
@@ -65,8 +69,35 @@ class LineItem(BaseModel):
         product = get_product_by_id(self.product_id) 
         if product:
             self.product = product
+    async def attach_product_async(self):
+        product = await get_product_by_id_async(self.product_id)
+        if product:
+            self.product = product
+
 
 
+class CartOperationTypeEnum(str, Enum):
+    add_items = "add_items"
+    update_item = "update_item"
+    remove_item = "remove_item"
+    add_coupon = "add_coupon"
+    remove_coupon = "remove_coupon"
+    set_bonuses = "set_bonuses"
+    remove_bonuses = "remove_bonuses"
+
+class CartOperation(BaseModel):
+    """ One operation of cart batch, fields depend on type """
+    type: CartOperationTypeEnum
+    # add_items
+    line_items: Optional[List[LineItem]] = None
+    # update_item, remove_item
+    item_id: Optional[UUID4] = None
+    # update_item
+    quantity: Optional[int] = None
+    # add_coupon
+    coupon_code: Optional[str] = None
+    # set_bonuses
+    pay_with_bonuses: Optional[int] = None
 
 class BaseCart(BaseModel):
     """ Base Cart Model """
@@ -93,12 +124,102 @@ class BaseCart(BaseModel):
     # sum of line-items amount, minus cart-level discounts and coupons.
     # Amount includes taxes, if needed
     total_amount: Optional[int] = None # ? float?
-    # list of coupons objects
+    # list of coupons objects (stored as references, see get_coupons_refs)
     coupons: List[BaseCoupon] = []
-    # gift products
+    # gift products (not stored in carts, counted from coupon)
     coupon_gifts: List[BaseProduct] = []
     # bonuses to apply to the user
     bonuses_to_apply: Optional[int] = None
+    # incremented on every write, writes are applied only to loaded version
+    version: int = 0
+    # date_modified + guest / user carts ttl (TTL index)
+    expires: Optional[datetime] = None
+    # cart, as it is stored in db (set by from_db / after save), to write only changes
+    _stored: Optional[dict] = PrivateAttr(default = None)
+    # line items contributions of previous count_amount (not stored, counted on first count)
+    _pricing: Optional[CartPricing] = PrivateAttr(default = None)
+    # stored coupons references, coupons are not attached yet (see attach_coupons)
+    _coupons_refs: Optional[List[dict]] = PrivateAttr(default = None)
+    # id of coupon, coupon_gifts products were loaded for (by hydrate_async)
+    _gifts_coupon_id: Optional[UUID4] = PrivateAttr(default = None)
+
+    @classmethod
+    def from_db(cls, cart_dict: dict) -> "BaseCart":
+        """ coupons (references or full documents of old carts) are attached by attach_coupons """
+        cart_dict = dict(cart_dict)
+        coupons = cart_dict.pop("coupons", None) or []
+        cart = cls(**cart_dict)
+        cart._coupons_refs = [{"_id": coupon["_id"], "code": coupon["code"]} for coupon in coupons]
+        cart.set_stored()
+        return cart
+
+    def to_db_dict(self) -> dict:
+        """
+            compact cart document: line items without products,
+            coupons references, without coupon gifts
+        """
+        cart_dict = self.dict(
+            by_alias=True,
+            exclude={"line_items": {"__all__": {"product"}}, "coupons": ..., "coupon_gifts": ...},
+        )
+        cart_dict["coupons"] = self.get_coupons_refs()
+        return cart_dict
+
+    def get_coupons_refs(self) -> List[dict]:
+        if self._coupons_refs is not None:
+            return list(self._coupons_refs)
+        return [{"_id": coupon.id, "code": coupon.code} for coupon in self.coupons]
+
+    def set_stored(self, cart_dict: Optional[dict] = None):
+        self._stored = cart_dict if cart_dict is not None else self.to_db_dict()
+
+    def set_coupons(self, coupons: List[Optional[BaseCoupon]]):
+        """ coupons, loaded for stored references. Not existing coupon is removed """
+        refs = self._coupons_refs
+        self._coupons_refs = None
+        if all(
+            coupon is not None and coupon.id == ref["_id"]
+            for ref, coupon in zip(refs, coupons)
+        ):
+            self.coupons = list(coupons)
+        else:
+            self.delete_coupons()
+
+    def attach_coupons(self):
+        if self._coupons_refs is None:
+            return
+        self.set_coupons([
+            get_coupon_by_id(ref["code"], silent = True) for ref in self._coupons_refs
+        ])
+
+    async def attach_coupons_async(self):
+        if self._coupons_refs is None:
+            return
+        self.set_coupons([
+            await get_coupon_by_id_async(ref["code"], silent = True) for ref in self._coupons_refs
+        ])
+
+    async def hydrate_async(self):
+        """
+            Attach coupons, products from catalog to line items (and coupon gifts).
+            Items of not existing products are removed
+        """
+        await self.attach_coupons_async()
+        gifts_ids = []
+        if self.coupons and self.coupons[0].type == CouponTypeEnum.gift and not self.coupon_gifts:
+            gifts_ids = self.coupons[0].products_ids
+        products = await get_products_by_ids_async(
+            [line_item.product_id for line_item in self.line_items] + gifts_ids,
+            silent = True,
+        )
+        self.line_items = [
+            line_item for line_item in self.line_items if line_item.product_id in products
+        ]
+        for line_item in self.line_items:
+            line_item.product = products[line_item.product_id]
+        if gifts_ids:
+            self.coupon_gifts = [products[p_id] for p_id in gifts_ids if p_id in products]
+            self._gifts_coupon_id = self.coupons[0].id
 
     def delete_coupons(self):
         for line_item in self.line_items:
@@ -107,6 +228,8 @@ class BaseCart(BaseModel):
         self.promo_amount = None
         self.coupons = []
         self.coupon_gifts = []
+        self._gifts_coupon_id = None
+        self._coupons_refs = None
 
     def check_can_apply_coupons(self):
         cart_amount = 0
@@ -142,7 +265,7 @@ class BaseCart(BaseModel):
             return False
         return True
 
-    def apply_coupons(self):
+    def apply_coupons(self, gift_products: Optional[List[BaseProduct]] = None):
         can_apply, msg = self.check_can_apply_coupons()
         if not can_apply:
             self.delete_coupons()
@@ -177,10 +300,9 @@ class BaseCart(BaseModel):
             self.promo_discount_amount = promo_discount
         # gift discount 
         if (coupon.type == CouponTypeEnum.gift):
-            gift_products_dict = db_provider.products_db.find(
-                {"_id": {"$in": coupon.products_ids}}
-            )
-            gift_products: List[BaseProduct] = [BaseProduct(**product) for product in gift_products_dict]
+            # gift products can be prefetched by caller (see count_amount_async)
+            if gift_products is None:
+                gift_products = list(get_products_by_ids(coupon.products_ids, silent = True).values())
             self.coupon_gifts.clear()
             self.coupon_gifts += gift_products
 
@@ -203,22 +325,28 @@ class BaseCart(BaseModel):
     def count_amount(
             self,
             current_user = None,
+            gift_products: Optional[List[BaseProduct]] = None,
         ):
-        base = 0
-        discount = 0
-        promo_discount = 0
         total = 0
+        # coupons and bonuses rules depend on cart amount, so with them
+        # cart is recounted fully, without them - only changed line items
+        full_recount = self._pricing is None or self.bonuses_used or len(self.coupons) > 0
+        if self._pricing is None:
+            self._pricing = CartPricing()
         # apply coupons, if they are exists
 
         if self.bonuses_used:
             self.check_can_pay_with_bonuses()
         if len(self.coupons) > 0:
-            self.apply_coupons()
+            self.apply_coupons(gift_products = gift_products)
         # count base and discount amount
-        for line_item in self.line_items:
-            base += line_item.get_base_price()
-            discount += line_item.get_sale_discount()
-            promo_discount += line_item.get_promo_discount()
+        if full_recount:
+            self._pricing.reset(self.line_items)
+        else:
+            self._pricing.update(self.line_items)
+        base = self._pricing.base
+        discount = self._pricing.discount
+        promo_discount = self._pricing.promo_discount
         # count total amount 
         total = base - discount - promo_discount
         if self.bonuses_used and self.pay_with_bonuses:
@@ -233,20 +361,148 @@ class BaseCart(BaseModel):
         # count bonuses to apply
         self.count_bonuses_to_apply(current_user = current_user)
 
+    async def count_amount_async(
+            self,
+            current_user = None,
+        ):
+        gift_products = None
+        if len(self.coupons) > 0 and self.coupons[0].type == CouponTypeEnum.gift:
+            coupon = self.coupons[0]
+            if self._gifts_coupon_id == coupon.id:
+                # already attached by hydrate_async
+                gift_products = list(self.coupon_gifts)
+            else:
+                gift_products = list((await get_products_by_ids_async(coupon.products_ids, silent = True)).values())
+                self._gifts_coupon_id = coupon.id
+        self.count_amount(current_user = current_user, gift_products = gift_products)
+
 
     def delete_db(self):
         db_provider.carts_db.delete_one(
             {"_id": self.id}
         )
 
-    def update_db(self):
-        # maybe need improvement to recast object with updated_cart return info
-        updated_cart = db_provider.carts_db.find_one_and_update(
-            {"_id": self.id},
-            {"$set": self.dict(by_alias=True)},
-            return_document=ReturnDocument.AFTER
+    async def delete_db_async(self):
+        await async_db_provider.carts_db.delete_one(
+            {"_id": self.id}
+        )
+
+    async def update_db_async(self) -> bool:
+        """
+            whole cart $set (use save_changes_async for loaded carts),
+            compare-and-swap by version, as save_changes_async
+        """
+        version_filter = self.get_version_filter()
+        self.set_modified()
+        cart_dict = self.to_db_dict()
+        cart_dict["version"] = self.version + 1
+        result = await async_db_provider.carts_db.update_one(
+            version_filter,
+            {"$set": cart_dict},
+        )
+        if result.matched_count == 0:
+            return False
+        self.version += 1
+        self.set_stored(cart_dict)
+        return True
+
+    def get_update_requests(self, cart_dict: dict) -> List[Tuple[dict, Optional[list]]]:
+        """
+            Minimal updates from stored cart to [cart_dict], as (update, array_filters):
+            $pull removed / $push added line items, $inc changed quantities,
+            $set other changed line item fields and changed cart fields.
+            Operations on line_items conflict in one update, so each is separate,
+            changed cart fields are sent with the first one
+        """
+        stored = self._stored
+        set_fields = {
+            field: value for field, value in cart_dict.items()
+            if field not in ("line_items", "version") and stored.get(field) != value
+        }
+        stored_items = {item["_id"]: item for item in stored.get("line_items") or []}
+        items_ids = {item["_id"] for item in cart_dict["line_items"]}
+        removed_ids = [item_id for item_id in stored_items if item_id not in items_ids]
+        added_items = [item for item in cart_dict["line_items"] if item["_id"] not in stored_items]
+        items_set = {}
+        items_inc = {}
+        array_filters = []
+        for item in cart_dict["line_items"]:
+            stored_item = stored_items.get(item["_id"])
+            if stored_item is None or stored_item == item:
+                continue
+            name = f"item{len(array_filters)}"
+            array_filters.append({f"{name}._id": item["_id"]})
+            for field, value in item.items():
+                if stored_item.get(field) == value:
+                    continue
+                path = f"line_items.$[{name}].{field}"
+                if field == "quantity" and isinstance(stored_item.get(field), int):
+                    items_inc[path] = value - stored_item[field]
+                else:
+                    items_set[path] = value
+        requests = []
+        if removed_ids:
+            requests.append(({"$pull": {"line_items": {"_id": {"$in": removed_ids}}}}, None))
+        if array_filters:
+            update = {}
+            if items_set:
+                update["$set"] = items_set
+            if items_inc:
+                update["$inc"] = items_inc
+            requests.append((update, array_filters))
+        if added_items:
+            requests.append(({"$push": {"line_items": {"$each": added_items}}}, None))
+        if set_fields:
+            if requests:
+                update = requests[0][0]
+                update["$set"] = {**update.get("$set", {}), **set_fields}
+            else:
+                requests.append(({"$set": set_fields}, None))
+        return requests
+
+    def get_version_filter(self) -> dict:
+        # version, the cart was loaded with (own version, if it was not loaded)
+        version = (self._stored.get("version") if self._stored is not None else self.version) or 0
+        if version == 0:
+            # carts, created before version field
+            return {"_id": self.id, "version": {"$in": [0, None]}}
+        return {"_id": self.id, "version": version}
+
+    async def save_changes_async(self) -> bool:
+        """
+            Compare-and-swap write of changed fields of cart, loaded with from_db:
+            applied only if cart version in db is the loaded one.
+            Returns False, if cart was changed by other request (see mutate_cart_async)
+        """
+        if self._stored is None:
+            return await self.update_db_async()
+        cart_dict = self.to_db_dict()
+        requests = self.get_update_requests(cart_dict)
+        if not requests:
+            return True
+        if len(requests) == 1:
+            update, array_filters = requests[0]
+        else:
+            # line items operations can't be in one update, line items are replaced
+            update = {"$set": {
+                field: value for field, value in cart_dict.items()
+                if field != "version" and self._stored.get(field) != value
+            }}
+            array_filters = None
+        self.set_modified()
+        update.setdefault("$set", {}).update({
+            "date_modified": self.date_modified,
+            "expires": self.expires,
+        })
+        update.setdefault("$inc", {})["version"] = 1
+        result = await async_db_provider.carts_db.update_one(
+            self.get_version_filter(), update, array_filters = array_filters
         )
-        return updated_cart
+        if result.matched_count == 0:
+            return False
+        self.version += 1
+        self.set_stored()
+        return True
 
     def check_line_item_exists(self, line_item_id):
         for line_item in self.line_items:
@@ -282,6 +538,54 @@ class BaseCart(BaseModel):
         line_item.product = product
         self.line_items.append(line_item)
 
+    def get_new_products_ids(self, line_items: List[LineItem]):
+        """ ids of products, that are not in cart yet """
+        products_ids = []
+        for line_item in line_items:
+            line_item_exists, _ = self.check_product_in_cart_exists(line_item)
+            if not line_item_exists:
+                products_ids.append(line_item.product_id)
+        return products_ids
+
+    def add_line_items_with_products(self, line_items: List[LineItem], products: dict):
+        for line_item in line_items:
+            line_item_exists, exist_line_item = self.check_product_in_cart_exists(line_item)
+            if line_item_exists and exist_line_item:
+                exist_line_item.quantity += 1
+                continue
+            line_item.product = products.get(line_item.product_id)
+            self.line_items.append(line_item)
+
+    def add_line_items(self, line_items: List[LineItem]):
+        """ add_line_item for many items, products are loaded with one query """
+        products = get_products_by_ids(self.get_new_products_ids(line_items))
+        self.add_line_items_with_products(line_items, products)
+
+    async def add_line_items_async(self, line_items: List[LineItem]):
+        products = await get_products_by_ids_async(self.get_new_products_ids(line_items))
+        self.add_line_items_with_products(line_items, products)
+
+    def attach_products(self):
+        """ attach products to line items without product, with one query """
+        line_items = [line_item for line_item in self.line_items if line_item.product is None]
+        products = get_products_by_ids([line_item.product_id for line_item in line_items])
+        for line_item in line_items:
+            line_item.product = products[line_item.product_id]
+
+    async def attach_products_async(self):
+        line_items = [line_item for line_item in self.line_items if line_item.product is None]
+        products = await get_products_by_ids_async([line_item.product_id for line_item in line_items])
+        for line_item in line_items:
+            line_item.product = products[line_item.product_id]
+
+    async def add_line_item_async(self, line_item):
+        line_item_exists, exist_line_item = self.check_product_in_cart_exists(line_item)
+        if line_item_exists and exist_line_item:
+            exist_line_item.quantity += 1
+            return
+        line_item.product = await get_product_by_id_async(line_item.product_id)
+        self.line_items.append(line_item)
+
     def remove_line_item_quantity(self, line_item_id):
         line_item_exists, line_item = self.check_line_item_exists(line_item_id)
         if line_item_exists and line_item:
@@ -310,6 +614,11 @@ class BaseCart(BaseModel):
             if line_item.quantity < 1:
                 self.line_items.remove(line_item)
 
+    def get_ttl(self) -> timedelta:
+        if self.user_id or self.customer_id:
+            return timedelta(days = settings.CART_USER_TTL_DAYS)
+        return timedelta(days = settings.CART_GUEST_TTL_DAYS)
+
     def set_modified(self):
         self.date_modified = get_time_now()
-
+        self.expires = self.date_modified + self.get_ttl()
@@ -0,0 +1,93 @@
+from typing import Dict, Optional
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class LinePricing(BaseModel):
+    """
+        Contribution of line item to cart amounts,
+        and values it was counted from
+    """
+    quantity: int
+    promo_price: Optional[int]
+    product_price: Optional[int]
+    product_sale_price: Optional[int]
+    base: int = 0
+    sale_discount: int = 0
+    promo_discount: int = 0
+
+    def get_signature(self) -> tuple:
+        return (self.quantity, self.promo_price, self.product_price, self.product_sale_price)
+
+
+def get_line_signature(line_item) -> tuple:
+    """ everything, that line item contribution depends on """
+    product = line_item.product
+    return (
+        line_item.quantity,
+        line_item.promo_price,
+        product.price if product else None,
+        product.sale_price if product else None,
+    )
+
+def get_line_pricing(line_item) -> LinePricing:
+    quantity, promo_price, product_price, product_sale_price = get_line_signature(line_item)
+    return LinePricing(
+        quantity = quantity,
+        promo_price = promo_price,
+        product_price = product_price,
+        product_sale_price = product_sale_price,
+        base = line_item.get_base_price() or 0,
+        sale_discount = line_item.get_sale_discount(),
+        promo_discount = line_item.get_promo_discount(),
+    )
+
+
+class CartPricing:
+    """
+        Per-line contributions of cart object and their sums (not stored,
+        cart, loaded from db, is counted fully on first count_amount).
+        update recounts only lines, that were added, changed or removed
+        since previous count, and applies their deltas to sums
+    """
+
+    def __init__(self):
+        # line item id -> contribution
+        self.lines: Dict[UUID, LinePricing] = {}
+        self.base = 0
+        self.discount = 0
+        self.promo_discount = 0
+
+    def add(self, line_pricing: LinePricing, sign: int):
+        self.base += sign * line_pricing.base
+        self.discount += sign * line_pricing.sale_discount
+        self.promo_discount += sign * line_pricing.promo_discount
+
+    def reset(self, line_items) -> int:
+        """ full recount """
+        self.__init__()
+        return self.update(line_items)
+
+    def update(self, line_items) -> int:
+        """ returns count of recounted lines """
+        recounted = 0
+        line_items_ids = set()
+        for line_item in line_items:
+            line_items_ids.add(line_item.id)
+            cached: Optional[LinePricing] = self.lines.get(line_item.id)
+            if cached is not None and cached.get_signature() == get_line_signature(line_item):
+                continue
+            line_pricing = get_line_pricing(line_item)
+            if cached is not None:
+                self.add(cached, -1)
+            self.add(line_pricing, 1)
+            self.lines[line_item.id] = line_pricing
+            # price snapshot, that is stored in cart
+            if line_item.product:
+                line_item.price = line_item.product.get_price()
+            recounted += 1
+        for line_item_id in [i for i in self.lines if i not in line_items_ids]:
+            self.add(self.lines.pop(line_item_id), -1)
+            recounted += 1
+        return recounted
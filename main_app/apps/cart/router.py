@@ -8,20 +8,23 @@ from pymongo import ReturnDocument
 # import config (env variables)
 from config import settings
 
-from .models import BaseCart, LineItem, LineItemUpdate, SessionId
-from .cart_exceptions import CartAlreadyExist, CartNotExist, NotValidUUID
+from .models import BaseCart, LineItem, LineItemUpdate, SessionId, CartOperation, CartOperationTypeEnum
+from .cart_exceptions import CartAlreadyExist, CartNotExist, NotValidUUID, InvalidCartOperation
 
-from apps.users.user import get_current_user, get_current_user_silent
+from apps.users.user import get_current_user, get_current_user_silent, get_current_admin_user
 from apps.users.models import BaseUser, BaseUserDB
+from apps.users.user_exceptions import InvalidAuthenticationCredentials
 # from coupons app
-from apps.coupons.coupon import get_coupon_by_id
+from apps.coupons.coupon import get_coupon_by_id_async
 from apps.coupons.models import BaseCoupon, BaseCouponDB
 
 from bson import json_util
 
-from .cart import  get_current_cart_active_by_id, get_cart_by_session_id
+from .cart import  get_current_cart_active_by_id, get_cart_by_session_id_async, mutate_cart_async, cart_write_stats
+from .cart import check_cart_operation, apply_cart_operations, USER_CART_OPERATIONS, MAX_CART_OPERATIONS
+from .expiry import carts_sweeper
 
-from database.main_db import db_provider
+from database.main_db import async_db_provider
 
 
 
@@ -43,6 +46,23 @@ def get_or_create_session(request: Request):
             {"session_id": str(uuid.uuid4())}
         )
 
+@router.get("/write-stats")
+async def get_cart_write_stats(
+    admin_user = Depends(get_current_admin_user),
+):
+    """ cart writes, version conflicts and retries of current worker """
+    return cart_write_stats.get_stats()
+
+@router.get("/expiry-stats")
+async def get_carts_expiry_stats(
+    admin_user = Depends(get_current_admin_user),
+):
+    """
+        expired carts and carts collection size, sampled by sweeper of current
+        worker (every worker sweeps, stats are per worker, see worker_pid)
+    """
+    return carts_sweeper.get_stats()
+
 @router.get("/{session_id}")
 async def get_cart(
     session_id: uuid.UUID
@@ -50,7 +70,7 @@ async def get_cart(
 #   print('request session is', request.session)
 #   get_or_create_session(request)
 #   print('session UUID is', uuid.UUID(request.session.get("session_id", None)))
-    cart = get_cart_by_session_id(session_id)
+    cart = await get_cart_by_session_id_async(session_id)
     if cart:
         return cart.dict()
 
@@ -58,9 +78,10 @@ async def get_cart(
 async def delete_cart(
     cart_id: uuid.UUID,
     ):
-    deleted_count = db_provider.carts_db.delete_one(
+    delete_result = await async_db_provider.carts_db.delete_one(
         {"_id": cart_id}
-    ).deleted_count
+    )
+    deleted_count = delete_result.deleted_count
     if deleted_count == 0:
         raise CartNotExist
     return {
@@ -87,7 +108,7 @@ async def create_cart(
     """
     # check, if cart is already exist
     cart = BaseCart()
-    exist_cart_dict = db_provider.carts_db.find_one(
+    exist_cart_dict = await async_db_provider.carts_db.find_one(
         {"session_id": session_id}
     )
     # if cart exist, dont create it and raise excaption
@@ -98,13 +119,13 @@ async def create_cart(
         raise CartAlreadyExist
     # cart not exist, add session_id
     cart.session_id = session_id
-    for line_item in line_items:
-        cart.add_line_item(line_item)
+    await cart.add_line_items_async(line_items)
     # count cart amount 
-    cart.count_amount(current_user = current_user)
+    await cart.count_amount_async(current_user = current_user)
     # add new cart to db
-    db_provider.carts_db.insert_one(
-        cart.dict(by_alias=True)
+    cart.set_modified()
+    await async_db_provider.carts_db.insert_one(
+        cart.to_db_dict()
     )
 #   if token:
 #       current_user = await get_current_user(request, token)
@@ -126,11 +147,11 @@ async def add_cart_items(
     """
         Add line_items to the cart
     """
-
-    for line_item in line_items:
-        cart.add_line_item(line_item)
-    cart.count_amount(current_user = current_user)
-    cart.update_db()
+    async def add_items(cart: BaseCart):
+        # copies, line items can be applied again, if cart is reloaded
+        await cart.add_line_items_async([line_item.copy() for line_item in line_items])
+        await cart.count_amount_async(current_user = current_user)
+    cart = await mutate_cart_async(cart, add_items)
     return cart.dict()
 
 # update line item by id in cart
@@ -145,9 +166,10 @@ async def update_cart_item(
     ):
     print('run update cart item, current user is', current_user)
 
-    cart.update_line_item(item_id, line_item)
-    cart.count_amount(current_user = current_user)
-    cart.update_db()
+    async def update_item(cart: BaseCart):
+        cart.update_line_item(item_id, line_item)
+        await cart.count_amount_async(current_user = current_user)
+    cart = await mutate_cart_async(cart, update_item)
     return cart.dict()
 
 # delete line item by id in cart 
@@ -158,19 +180,20 @@ async def delete_cart_item(
         cart: BaseCart = Depends(get_current_cart_active_by_id),
         current_user = Depends(get_current_user_silent)
     ):
-    cart.remove_line_item(item_id)
-    cart.count_amount(current_user = current_user)
-    cart.update_db()
+    async def remove_item(cart: BaseCart):
+        cart.remove_line_item(item_id)
+        await cart.count_amount_async(current_user = current_user)
+    cart = await mutate_cart_async(cart, remove_item)
     return cart.dict()
 
 # cart coupons
 @router.post("/{cart_id}/coupons/add") # add coupon to cart
-def add_cart_coupon(
+async def add_cart_coupon(
     coupon_code: str = Body(..., embed = True),
     cart: BaseCart = Depends(get_current_cart_active_by_id),
     current_user: BaseUser = Depends(get_current_user),
 ):
-    coupon = get_coupon_by_id(coupon_code = coupon_code, db_model = True)
+    coupon = await get_coupon_by_id_async(coupon_code = coupon_code, db_model = True)
     if not coupon:
         return None
     # check, if user can apply coupon
@@ -181,21 +204,24 @@ def add_cart_coupon(
             "is_success": False,
             "msg": "Промокод не активный",
         }
-    cart.coupons = []
     cart_coupon: BaseCoupon = BaseCoupon(**coupon.dict())
-    # add coupon to current cart
-    cart.coupons.append(cart_coupon)
-    # check, if coupon can be applied
-    can_apply, msg = cart.check_can_apply_coupons()
-    if not can_apply:
+    apply_errors = []
+    async def add_coupon(cart: BaseCart):
+        # add coupon to current cart
+        cart.coupons = [cart_coupon]
+        # check, if coupon can be applied
+        can_apply, msg = cart.check_can_apply_coupons()
+        if not can_apply:
+            apply_errors.append(msg)
+            return False
+        # count cart amount to apply coupon
+        await cart.count_amount_async(current_user = current_user)
+    cart = await mutate_cart_async(cart, add_coupon)
+    if apply_errors:
         return {
             "is_success": False,
-            "msg": msg,
+            "msg": apply_errors[-1],
         }
-    # count cart amount to apply coupon
-    cart.count_amount(current_user = current_user)
-
-    cart.update_db()
     return {
         "is_success": True,
         "msg": "Промокод успешно применен",
@@ -207,10 +233,10 @@ async def remove_cart_coupon(
     cart: BaseCart = Depends(get_current_cart_active_by_id),
     current_user = Depends(get_current_user_silent),
 ):
-
-    cart.delete_coupons()
-    cart.count_amount(current_user = current_user)
-    cart.update_db()
+    async def remove_coupons(cart: BaseCart):
+        cart.delete_coupons()
+        await cart.count_amount_async(current_user = current_user)
+    cart = await mutate_cart_async(cart, remove_coupons)
     return cart.dict()
 
 # pay with bonuses logic
@@ -220,19 +246,20 @@ async def add_pay_bonuses(
     current_user = Depends(get_current_user),
     pay_with_bonuses: int = Body(..., embed = True),
 ):
-    if cart.bonuses_used:
-        cart.bonuses_used = False
-        cart.pay_with_bonuses = 0
-        cart.count_amount()
+    async def set_pay_bonuses(cart: BaseCart):
+        if cart.bonuses_used:
+            cart.bonuses_used = False
+            cart.pay_with_bonuses = 0
+            await cart.count_amount_async()
 
-    cart.pay_with_bonuses = pay_with_bonuses
-    cart.bonuses_used = True
-    can_pay, msg = cart.check_can_pay_with_bonuses()
-    if not can_pay:
-        raise HTTPException(status_code = 400, detail=msg)
+        cart.pay_with_bonuses = pay_with_bonuses
+        cart.bonuses_used = True
+        can_pay, msg = cart.check_can_pay_with_bonuses()
+        if not can_pay:
+            raise HTTPException(status_code = 400, detail=msg)
 
-    cart.count_amount(current_user = current_user)
-    cart.update_db()
+        await cart.count_amount_async(current_user = current_user)
+    cart = await mutate_cart_async(cart, set_pay_bonuses)
 
     print(pay_with_bonuses)
     return cart.dict()
@@ -242,9 +269,49 @@ async def add_pay_bonuses(
     cart: BaseCart = Depends(get_current_cart_active_by_id),
     current_user = Depends(get_current_user),
 ):
-    cart.bonuses_used = False
-    cart.pay_with_bonuses = 0
-    cart.count_amount()
-    cart.update_db()
+    async def remove_pay_bonuses(cart: BaseCart):
+        cart.bonuses_used = False
+        cart.pay_with_bonuses = 0
+        await cart.count_amount_async()
+    cart = await mutate_cart_async(cart, remove_pay_bonuses)
 
     return cart.dict()
+
+# many cart changes in one request
+@router.post("/{cart_id}/batch")
+async def cart_batch(
+    cart_id: uuid.UUID,
+    operations: List[CartOperation] = Body(..., embed = True),
+    cart: BaseCart = Depends(get_current_cart_active_by_id),
+    current_user = Depends(get_current_user_silent),
+):
+    """
+        Apply [operations] in order: add_items (line_items), update_item
+        (item_id, quantity), remove_item (item_id), add_coupon (coupon_code),
+        remove_coupon, set_bonuses (pay_with_bonuses), remove_bonuses.
+        Cart is counted and saved once, if any operation fails - nothing is saved
+        (error detail has operation index). Coupons and bonuses need logged in user
+    """
+    if len(operations) > MAX_CART_OPERATIONS:
+        raise HTTPException(status_code = 400, detail = f"max {MAX_CART_OPERATIONS} operations")
+    for index, operation in enumerate(operations):
+        check_cart_operation(index, operation)
+        if operation.type in USER_CART_OPERATIONS and not current_user:
+            raise InvalidAuthenticationCredentials
+    # coupons are loaded once, operations can be applied again, if cart is reloaded
+    coupons = {}
+    for index, operation in enumerate(operations):
+        if operation.type != CartOperationTypeEnum.add_coupon or operation.coupon_code in coupons:
+            continue
+        try:
+            coupon = await get_coupon_by_id_async(coupon_code = operation.coupon_code, db_model = True)
+        except HTTPException as e:
+            raise InvalidCartOperation(index, e.detail)
+        if not coupon.check_active():
+            raise InvalidCartOperation(index, "Промокод не активный")
+        coupons[operation.coupon_code] = BaseCoupon(**coupon.dict())
+
+    async def apply_operations(cart: BaseCart):
+        await apply_cart_operations(cart, operations, coupons, current_user = current_user)
+    cart = await mutate_cart_async(cart, apply_operations)
+    return cart.dict()
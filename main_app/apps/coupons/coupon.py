@@ -2,7 +2,7 @@ from fastapi import Request
 from .models import BaseCoupon, BaseCouponDB
 from .coupon_exceptions import CouponNotExist 
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
 
 def get_coupon_by_id(
 	coupon_code: str,
@@ -21,3 +21,21 @@ def get_coupon_by_id(
 	else:
 		coupon = BaseCouponDB(**coupon_dict)
 	return coupon
+
+async def get_coupon_by_id_async(
+	coupon_code: str,
+	silent: bool = False,
+	db_model: bool = False,
+):
+	coupon_dict = await async_db_provider.coupons_db.find_one(
+		{"code": coupon_code}
+	)
+	if not coupon_dict:
+		if not silent:
+			raise CouponNotExist
+		return None
+	if not db_model:
+		coupon = BaseCoupon(**coupon_dict)
+	else:
+		coupon = BaseCouponDB(**coupon_dict)
+	return coupon
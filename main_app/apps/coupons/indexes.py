@@ -0,0 +1,8 @@
+from pymongo import IndexModel, ASCENDING
+
+# indexes, that are applied on startup (see database/indexes.py)
+coupons_indexes = {
+	"coupons_db": [
+		IndexModel([("code", ASCENDING)]),
+	],
+}
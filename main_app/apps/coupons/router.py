@@ -11,7 +11,7 @@ from apps.users.models import BaseUser
 # models 
 from .models import BaseCoupon, BaseCouponCreate, BaseCouponDB
 
-from database.main_db import db_provider
+from database.main_db import async_db_provider
 
 router = APIRouter(
 	prefix = "/coupons",
@@ -23,8 +23,8 @@ router = APIRouter(
 async def get_coupons(
 	admin_user: BaseUser = Depends(get_current_admin_user),
 	):
-	coupons_dict = db_provider.coupons_db.find({}) # implement pagination
-	coupons = [BaseCoupon(**coupon).dict() for coupon in coupons_dict]
+	coupons_cursor = async_db_provider.coupons_db.find({}) # implement pagination
+	coupons = [BaseCoupon(**coupon).dict() async for coupon in coupons_cursor]
 	return {
 		"coupons": coupons
 	}
@@ -38,7 +38,7 @@ async def create_coupon(
 	print('coupon is', coupon)
 	# need to check, if coupon with that id exists
 	# add coupon to db
-	db_provider.coupons_db.insert_one(
+	await async_db_provider.coupons_db.insert_one(
 		new_coupon.dict(by_alias=True)
 	)
 	return {
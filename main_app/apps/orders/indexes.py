@@ -0,0 +1,11 @@
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+# indexes, that are applied on startup (see database/indexes.py)
+orders_indexes = {
+    "orders_db": [
+        # user orders list, sorted by date_created
+        IndexModel([("customer_id", ASCENDING), ("date_created", DESCENDING)]),
+        # admin orders list
+        IndexModel([("date_created", DESCENDING)]),
+    ],
+}
@@ -24,7 +24,7 @@ from apps.delivery.models import DeliveryMethod
 from apps.site.models import PickupAddress
 from apps.site.utils import get_time_now
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
 
 
 class OrderStatus(BaseModel):
@@ -189,6 +189,23 @@ class BaseOrder(BaseModel):
         updated_order = BaseOrder(**updated_order_dict)
         return updated_order
 
+    async def save_db_async(self):
+        await async_db_provider.orders_db.insert_one(
+            self.dict(by_alias=True)
+        )
+    async def delete_db_async(self):
+        await async_db_provider.orders_db.delete_one(
+            {"_id": self.id}
+        )
+    async def update_db_async(self):
+        updated_order_dict = await async_db_provider.orders_db.find_one_and_update(
+            {"_id": self.id},
+            {"$set": self.dict(by_alias=True)},
+            return_document=ReturnDocument.AFTER
+        )
+        updated_order = BaseOrder(**updated_order_dict)
+        return updated_order
+
     def set_modified(self):
         self.date_modified = datetime.utcnow()
 
@@ -10,3 +10,8 @@ class OrderNotEditable(HTTPException):
 	def __init__(self):
 		self.status_code = 400
 		self.detail = "Заказ нельзя редактировать"
+
+class InvalidExportDates(HTTPException):
+	def __init__(self):
+		self.status_code = 400
+		self.detail = "date_to must not be earlier than date_from"
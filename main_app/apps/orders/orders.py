@@ -15,7 +15,7 @@ from apps.users.user import get_user_delivery_address_by_id
 from apps.cart.cart import get_cart_by_id, get_cart_by_session_id
 from apps.cart.models import BaseCart
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
 
 
 
@@ -28,6 +28,15 @@ def get_order_by_id(order_id: uuid.UUID, link_products: bool = True) -> BaseOrde
     order = BaseOrder(**order)
     return order
 
+async def get_order_by_id_async(order_id: uuid.UUID) -> BaseOrder:
+    order = await async_db_provider.orders_db.find_one(
+        {"_id": order_id}
+    )
+    if not order:
+        raise OrderNotExist
+    order = BaseOrder(**order)
+    return order
+
 def new_order_object(new_order: BaseOrderCreate):
     exclude_fields = {"delivery_method", "payment_method", "delivery_address", "pickup_address"}
     order = BaseOrder(**new_order.dict(exclude=exclude_fields))
@@ -59,6 +68,13 @@ def get_orders_by_user_id(user_id: UUID4):
     user_orders = [BaseOrder(**order).dict() for order in user_orders_dict]
     return user_orders
 
+async def get_orders_by_user_id_async(user_id: UUID4):
+    user_orders_cursor = async_db_provider.orders_db.find(
+        {"customer_id": user_id}
+    ).sort("date_created", -1)
+    user_orders = [BaseOrder(**order).dict() async for order in user_orders_cursor]
+    return user_orders
+
 def get_user_total_spent_by_user_id(user_id: UUID4):
     aggregate_query = [{
         "$group": {
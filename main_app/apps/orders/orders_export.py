@@ -0,0 +1,142 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Iterator, Optional
+
+import pytz
+from openpyxl import Workbook
+
+from database.main_db import db_provider, async_db_provider
+
+
+# orders are stored in utc, exported dates are in local (site) time
+EXPORT_TIMEZONE = pytz.timezone('Europe/Moscow')
+# rows, fetched from mongo cursor / written to csv chunk at once
+EXPORT_BATCH_SIZE = 500
+FILE_CHUNK_SIZE = 64 * 1024
+
+# only exported fields are loaded
+EXPORT_PROJECTION = {
+    "_id": 1,
+    "date_created": 1,
+    "status.name": 1,
+    "customer_username": 1,
+    "guest_phone_number": 1,
+    "delivery_method.name": 1,
+    "payment_method.name": 1,
+    "cart.line_items.quantity": 1,
+    "cart.line_items.product.name": 1,
+    "cart.base_amount": 1,
+    "cart.discount_amount": 1,
+    "cart.promo_discount_amount": 1,
+    "cart.pay_with_bonuses": 1,
+    "cart.total_amount": 1,
+}
+
+EXPORT_COLUMNS = [
+    "id",
+    "date_created",
+    "status",
+    "customer",
+    "phone",
+    "delivery_method",
+    "payment_method",
+    "items",
+    "base_amount",
+    "discount_amount",
+    "promo_discount_amount",
+    "pay_with_bonuses",
+    "total_amount",
+]
+
+
+def get_export_query(date_from: date, date_to: date) -> dict:
+    """ orders, created from start of [date_from] to end of [date_to] (local dates) """
+    start = EXPORT_TIMEZONE.localize(datetime.combine(date_from, time.min))
+    end = EXPORT_TIMEZONE.localize(datetime.combine(date_to + timedelta(days = 1), time.min))
+    return {"date_created": {"$gte": start, "$lt": end}}
+
+def format_date(value: Optional[datetime]) -> str:
+    if not value:
+        return ""
+    return pytz.utc.localize(value).astimezone(EXPORT_TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+
+def get_order_row(order: dict) -> list:
+    cart = order.get("cart") or {}
+    items = []
+    for line_item in cart.get("line_items") or []:
+        product = line_item.get("product") or {}
+        items.append(f"{product.get('name', '')} x {line_item.get('quantity', 1)}")
+    return [
+        str(order["_id"]),
+        format_date(order.get("date_created")),
+        (order.get("status") or {}).get("name", ""),
+        order.get("customer_username") or "",
+        order.get("guest_phone_number") or "",
+        (order.get("delivery_method") or {}).get("name", ""),
+        (order.get("payment_method") or {}).get("name", ""),
+        "; ".join(items),
+        cart.get("base_amount"),
+        cart.get("discount_amount"),
+        cart.get("promo_discount_amount"),
+        cart.get("pay_with_bonuses"),
+        cart.get("total_amount"),
+    ]
+
+async def iter_orders_csv(date_from: date, date_to: date) -> AsyncIterator[bytes]:
+    """ csv file chunks, orders are read from cursor by batches """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # utf-8 BOM, so excel opens russian text correctly
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUMNS)
+    orders_cursor = async_db_provider.orders_db.find(
+        get_export_query(date_from, date_to), EXPORT_PROJECTION,
+        batch_size = EXPORT_BATCH_SIZE,
+    ).sort("date_created", 1)
+    rows = 0
+    async for order in orders_cursor:
+        writer.writerow(get_order_row(order))
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def write_orders_xlsx(date_from: date, date_to: date) -> str:
+    """
+        write orders to temporary xlsx file (openpyxl write-only mode,
+        rows are not kept in memory), returns file path
+    """
+    workbook = Workbook(write_only = True)
+    sheet = workbook.create_sheet("orders")
+    sheet.append(EXPORT_COLUMNS)
+    orders_cursor = db_provider.orders_db.find(
+        get_export_query(date_from, date_to), EXPORT_PROJECTION,
+        batch_size = EXPORT_BATCH_SIZE,
+    ).sort("date_created", 1)
+    for order in orders_cursor:
+        sheet.append(get_order_row(order))
+    file_descriptor, path = tempfile.mkstemp(suffix = ".xlsx")
+    os.close(file_descriptor)
+    try:
+        workbook.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def iter_file_chunks(path: str, delete: bool = True) -> Iterator[bytes]:
+    try:
+        with open(path, "rb") as file:
+            while True:
+                chunk = file.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if delete:
+            os.remove(path)
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, BackgroundTasks, Depends, Request, Body
+from fastapi import APIRouter, BackgroundTasks, Depends, Request, Body, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Optional, List
 
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 
 from pymongo import ReturnDocument
 
@@ -17,6 +19,7 @@ from apps.users.models import BaseUser
 
 from .models import BaseOrder, BaseOrderCreate, BaseOrderUpdate, OrderStatusEnum
 from .orders import get_order_by_id, new_order_object, get_orders_db
+from .orders_export import iter_orders_csv, write_orders_xlsx, iter_file_chunks
 
 from .events import order_created_event, order_completed_event
 
@@ -32,7 +35,7 @@ import math
 
 
 # order exceptions
-from .order_exceptions import OrderNotEditable
+from .order_exceptions import OrderNotEditable, InvalidExportDates
 
 router = APIRouter(
     prefix = "/orders",
@@ -67,6 +70,36 @@ def get_orders(
         'orders': orders,
     }
 
+@router.get("/export")
+async def export_orders(
+    date_from: date,
+    date_to: date,
+    format: str = Query("csv", regex = "^(csv|xlsx)$"),
+    admin_user = Depends(get_current_admin_user),
+):
+    """
+        export orders, created from [date_from] to [date_to] (inclusive),
+        as csv or xlsx file. Orders are read from cursor, memory usage
+        doesn't depend on orders count
+    """
+    if date_to < date_from:
+        raise InvalidExportDates
+    filename = f"orders_{date_from.isoformat()}_{date_to.isoformat()}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if format == "xlsx":
+        # xlsx is zip, so it is written to temp file first, then streamed
+        path = await run_in_threadpool(write_orders_xlsx, date_from, date_to)
+        return StreamingResponse(
+            iter_file_chunks(path),
+            media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers = headers,
+        )
+    return StreamingResponse(
+        iter_orders_csv(date_from, date_to),
+        media_type = "text/csv; charset=utf-8",
+        headers = headers,
+    )
+
 # creates guest order
 @router.post("/guest")
 def create_guest_order(
@@ -75,9 +108,7 @@ def create_guest_order(
     ):
     order: BaseOrder = new_order_object(new_order)
     if order.cart and order.cart.line_items:
-        for line_item in order.cart.line_items:
-            if line_item.product == None:
-                order.cart.add_line_item(line_item)
+        order.cart.attach_products()
     if order.cart:
         order.cart.count_amount()
         order.save_db()
@@ -99,9 +130,7 @@ def create_admin_order(
     # add products line_items to order
     if not order.cart:
         raise
-    for line_item in order.cart.line_items:
-        if line_item.product == None:
-            order.cart.add_line_item(line_item)
+    order.cart.attach_products()
     # count order amounts
     order.check_set_user()
     order.cart.count_amount()
@@ -166,7 +195,7 @@ def update_order(
     return updated_order.dict()
 
 @router.post("/")
-async def create_order(
+def create_order(
     request: Request,
     new_order: BaseOrderCreate,
     # background task
@@ -177,9 +206,7 @@ async def create_order(
     # add products line_items to order
     if not order.cart:
         raise
-    for line_item in order.cart.line_items:
-        if line_item.product == None:
-            line_item.attach_product()
+    order.cart.attach_products()
     # assign user to order, if user is simple user
     order.customer_id = current_user.id
     order.customer_username = current_user.username
@@ -0,0 +1,144 @@
+import asyncio
+import bisect
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from config import settings
+
+from .models import BaseProduct, BaseCategory
+from .catalog_version import get_catalog_version_async, catalog_change_listeners
+from .category_products import get_category_products_keys_async
+
+from apps.site.static_assets import resolve_imgsrc
+
+from database.main_db import async_db_provider
+
+
+class CatalogSnapshot:
+    """
+        Immutable in-memory copy of products and categories of one catalog version.
+        Objects in snapshot are shared between requests, so they must not be modified
+    """
+
+    def __init__(
+        self,
+        version: int,
+        products: List[BaseProduct],
+        categories: List[BaseCategory],
+        category_products: Optional[Dict[UUID, List[Tuple[int, UUID]]]] = None,
+    ):
+        self.version = version
+        self.products: Dict[UUID, BaseProduct] = {p.id: p for p in products}
+        self.products_by_slug: Dict[str, BaseProduct] = {p.slug: p for p in products if p.slug}
+        self.categories: Dict[UUID, BaseCategory] = {c.id: c for c in categories}
+        self.categories_by_slug: Dict[str, BaseCategory] = {c.slug: c for c in categories}
+        # category id -> (position, product id), ordered (category products mapping),
+        # or by product id with zero positions, if mapping is not built
+        self.category_keys: Dict[UUID, List[Tuple[int, UUID]]] = {}
+        if category_products is not None:
+            for category_id, keys in category_products.items():
+                self.category_keys[category_id] = [
+                    key for key in keys if key[1] in self.products
+                ]
+        else:
+            for product in sorted(products, key = lambda p: p.id):
+                for category in product.categories or []:
+                    if category.id:
+                        self.category_keys.setdefault(category.id, []).append((0, product.id))
+        # category id -> product ids, in the same order
+        self.category_products: Dict[UUID, List[UUID]] = {
+            category_id: [product_id for _, product_id in keys]
+            for category_id, keys in self.category_keys.items()
+        }
+        # stable order for keyset pagination
+        self.products_ids_sorted: List[UUID] = sorted(self.products)
+        # serialized once per version (with hashed static links), for list routes
+        self.products_list: List[dict] = [resolve_imgsrc(p.dict()) for p in products]
+        self.categories_list: List[dict] = [resolve_imgsrc(c.dict()) for c in categories]
+
+    def get_category_products(self, category_id: UUID) -> List[BaseProduct]:
+        return [self.products[p_id] for p_id in self.category_products.get(category_id, [])]
+
+    def get_products_page(
+        self,
+        limit: int,
+        cursor: Optional[UUID] = None,
+    ) -> List[BaseProduct]:
+        """ products with id > cursor, ordered by id """
+        products_ids = self.products_ids_sorted
+        start = bisect.bisect_right(products_ids, cursor) if cursor else 0
+        return [self.products[p_id] for p_id in products_ids[start:start + limit]]
+
+    def get_category_products_page(
+        self,
+        category_id: UUID,
+        limit: int,
+        cursor: Optional[Tuple[int, UUID]] = None,
+    ) -> List[Tuple[Tuple[int, UUID], BaseProduct]]:
+        """ (key, product) of category products after (position, product id) cursor, ordered by key """
+        keys = self.category_keys.get(category_id, [])
+        start = bisect.bisect_right(keys, cursor) if cursor else 0
+        return [(key, self.products[key[1]]) for key in keys[start:start + limit]]
+
+
+class Catalog:
+    """
+        Per-worker catalog snapshot holder.
+        Loaded on startup, reloaded when catalog version in db is changed
+        (by current worker immediately, by other workers with poller)
+    """
+
+    def __init__(self):
+        self.snapshot: Optional[CatalogSnapshot] = None
+        # async callables (snapshot), called after snapshot is reloaded
+        self.reload_listeners: List[Callable[[CatalogSnapshot], Awaitable[None]]] = []
+        self._lock = None
+        self._watch_task = None
+
+    @property
+    def version(self) -> Optional[int]:
+        return self.snapshot.version if self.snapshot else None
+
+    async def load(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # version is read first, so concurrent write will trigger one more reload
+            version = await get_catalog_version_async()
+            products_cursor = async_db_provider.products_db.find({})
+            products = [BaseProduct(**product) async for product in products_cursor]
+            categories_cursor = async_db_provider.categories_db.find({})
+            categories = [BaseCategory(**category) async for category in categories_cursor]
+            category_products = await get_category_products_keys_async()
+            self.snapshot = CatalogSnapshot(version, products, categories, category_products)
+            print('catalog loaded, version', version, 'products', len(products), 'categories', len(categories))
+        for listener in self.reload_listeners:
+            await listener(self.snapshot)
+
+    async def reload_if_changed(self, version: Optional[int] = None):
+        if version is None:
+            version = await get_catalog_version_async()
+        if version != self.version:
+            await self.load()
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(settings.CATALOG_POLL_INTERVAL)
+            try:
+                await self.reload_if_changed()
+            except Exception as e:
+                print('catalog reload failed', e)
+
+    def start_watch(self):
+        if self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(self.watch())
+
+    def stop_watch(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+catalog = Catalog()
+
+# catalog is changed in current worker - reload snapshot right away
+catalog_change_listeners.append(catalog.reload_if_changed)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Set
+
+from pymongo import ReturnDocument
+
+from database.main_db import db_provider, async_db_provider
+
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_ID = "catalog"
+
+# async callables (new_version), called after catalog was changed in current worker
+# (in background, write response doesn't wait for catalog reload)
+catalog_change_listeners: List[Callable[[int], Awaitable[None]]] = []
+# running notifications (referenced, so tasks are not garbage collected)
+_notify_tasks: Set[asyncio.Task] = set()
+
+
+def get_catalog_version() -> int:
+    meta = db_provider.catalog_meta_db.find_one({"_id": CATALOG_VERSION_ID})
+    return meta["version"] if meta else 0
+
+async def get_catalog_version_async() -> int:
+    meta = await async_db_provider.catalog_meta_db.find_one({"_id": CATALOG_VERSION_ID})
+    return meta["version"] if meta else 0
+
+def bump_catalog_version() -> int:
+    """ sync writes: other workers (and current) notice new version with poller """
+    meta = db_provider.catalog_meta_db.find_one_and_update(
+        {"_id": CATALOG_VERSION_ID},
+        {"$inc": {"version": 1}},
+        upsert = True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return meta["version"]
+
+async def bump_catalog_version_async() -> int:
+    meta = await async_db_provider.catalog_meta_db.find_one_and_update(
+        {"_id": CATALOG_VERSION_ID},
+        {"$inc": {"version": 1}},
+        upsert = True,
+        return_document=ReturnDocument.AFTER,
+    )
+    task = asyncio.get_running_loop().create_task(notify_catalog_changed(meta["version"]))
+    _notify_tasks.add(task)
+    task.add_done_callback(_notify_tasks.discard)
+    return meta["version"]
+
+async def notify_catalog_changed(version: int):
+    """ failed listener is logged, other workers (and poller) reload anyway """
+    for listener in catalog_change_listeners:
+        try:
+            await listener(version)
+        except Exception:
+            logger.exception("catalog change listener failed, version %s", version)
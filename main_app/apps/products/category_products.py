@@ -0,0 +1,166 @@
+import time
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from pymongo import UpdateOne, DeleteMany
+from pymongo.errors import BulkWriteError
+
+from database.main_db import db_provider, async_db_provider
+
+
+# Materialized category -> products mapping (category_products collection).
+# One document per (category_id, product_id) with per-category sort position,
+# maintained on product and category writes, so category page is one indexed
+# read instead of $elemMatch over embedded product categories
+
+# duplicate key error code (concurrent upserts of the same mapping document)
+DUPLICATE_KEY_ERROR = 11000
+
+
+def get_new_position() -> int:
+    # new products are added to the end of category
+    return int(time.time() * 1000)
+
+def get_product_categories_requests(product_id: UUID, categories_ids: List[UUID]) -> list:
+    requests = [
+        DeleteMany({
+            "product_id": product_id,
+            "category_id": {"$nin": categories_ids},
+        }),
+    ]
+    for category_id in categories_ids:
+        requests.append(UpdateOne(
+            {"category_id": category_id, "product_id": product_id},
+            {"$setOnInsert": {"position": get_new_position()}},
+            upsert = True,
+        ))
+    return requests
+
+def sync_product_categories(product_id: UUID, categories_ids: List[UUID]):
+    db_provider.category_products_db.bulk_write(
+        get_product_categories_requests(product_id, categories_ids),
+        ordered = False,
+    )
+
+async def sync_product_categories_async(product_id: UUID, categories_ids: List[UUID]):
+    await async_db_provider.category_products_db.bulk_write(
+        get_product_categories_requests(product_id, categories_ids),
+        ordered = False,
+    )
+
+def delete_product_categories(product_id: UUID):
+    db_provider.category_products_db.delete_many({"product_id": product_id})
+
+async def delete_product_categories_async(product_id: UUID):
+    await async_db_provider.category_products_db.delete_many({"product_id": product_id})
+
+def delete_category_products(category_id: UUID):
+    db_provider.category_products_db.delete_many({"category_id": category_id})
+
+async def delete_category_products_async(category_id: UUID):
+    await async_db_provider.category_products_db.delete_many({"category_id": category_id})
+
+def get_category_products_ids(category_id: UUID) -> List[UUID]:
+    """ product ids of category, ordered by position (covered by index) """
+    mapping_cursor = db_provider.category_products_db.find(
+        {"category_id": category_id},
+        {"_id": 0, "product_id": 1, "position": 1},
+    ).sort([("position", 1), ("product_id", 1)])
+    return [item["product_id"] for item in mapping_cursor]
+
+async def get_category_products_ids_async(category_id: UUID) -> List[UUID]:
+    mapping_cursor = async_db_provider.category_products_db.find(
+        {"category_id": category_id},
+        {"_id": 0, "product_id": 1, "position": 1},
+    ).sort([("position", 1), ("product_id", 1)])
+    return [item["product_id"] async for item in mapping_cursor]
+
+def get_category_page_query(category_id: UUID, cursor: Optional[Tuple[int, UUID]] = None) -> dict:
+    """ category products after (position, product_id) cursor """
+    query = {"category_id": category_id}
+    if cursor:
+        position, product_id = cursor
+        query["$or"] = [
+            {"position": {"$gt": position}},
+            {"position": position, "product_id": {"$gt": product_id}},
+        ]
+    return query
+
+async def get_category_products_keys_page_async(
+    category_id: UUID,
+    limit: int,
+    cursor: Optional[Tuple[int, UUID]] = None,
+) -> List[Tuple[int, UUID]]:
+    """ (position, product_id) of category page, ordered by position (covered by index) """
+    mapping_cursor = async_db_provider.category_products_db.find(
+        get_category_page_query(category_id, cursor),
+        {"_id": 0, "product_id": 1, "position": 1},
+    ).sort([("position", 1), ("product_id", 1)]).limit(limit)
+    return [(item["position"], item["product_id"]) async for item in mapping_cursor]
+
+async def get_category_products_keys_async() -> Optional[Dict[UUID, List[Tuple[int, UUID]]]]:
+    """
+        whole mapping {category_id: ordered (position, product_id)},
+        None if mapping is not built yet
+    """
+    mapping: Dict[UUID, List[Tuple[int, UUID]]] = {}
+    mapping_cursor = async_db_provider.category_products_db.find(
+        {}, {"_id": 0, "category_id": 1, "product_id": 1, "position": 1},
+    ).sort([("category_id", 1), ("position", 1), ("product_id", 1)])
+    async for item in mapping_cursor:
+        mapping.setdefault(item["category_id"], []).append((item["position"], item["product_id"]))
+    if not mapping:
+        has_products = await async_db_provider.products_db.find_one({"categories.0": {"$exists": True}})
+        if has_products:
+            return None
+    return mapping
+
+async def get_category_products_mapping_async() -> Optional[Dict[UUID, List[UUID]]]:
+    """ whole mapping {category_id: ordered product ids}, None if mapping is not built yet """
+    mapping = await get_category_products_keys_async()
+    if mapping is None:
+        return None
+    return {
+        category_id: [product_id for _, product_id in keys]
+        for category_id, keys in mapping.items()
+    }
+
+async def set_category_products_order_async(category_id: UUID, products_ids: List[UUID]):
+    """ set positions of category products in passed order """
+    requests = [
+        UpdateOne(
+            {"category_id": category_id, "product_id": product_id},
+            {"$set": {"position": position}},
+        )
+        for position, product_id in enumerate(products_ids)
+    ]
+    if requests:
+        await async_db_provider.category_products_db.bulk_write(requests, ordered = False)
+
+async def rebuild_category_products_async() -> int:
+    """ build mapping from embedded product categories (existing positions are kept) """
+    requests = []
+    products_cursor = async_db_provider.products_db.find({}, {"categories._id": 1})
+    async for product in products_cursor:
+        categories_ids = [c["_id"] for c in product.get("categories") or [] if c.get("_id")]
+        requests += get_product_categories_requests(product["_id"], categories_ids)
+    # mapping of deleted products
+    products_ids = await async_db_provider.products_db.distinct("_id")
+    requests.append(DeleteMany({"product_id": {"$nin": products_ids}}))
+    try:
+        await async_db_provider.category_products_db.bulk_write(requests, ordered = False)
+    except BulkWriteError as e:
+        # every worker rebuilds on startup, documents upserted by other worker
+        # fail on unique (category_id, product_id) index, they are already there
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        print('category products mapping, skipped duplicates', len(errors))
+    return len(products_ids)
+
+async def ensure_category_products_async():
+    """ build mapping on startup, if it is not built yet """
+    mapping = await get_category_products_mapping_async()
+    if mapping is None:
+        count = await rebuild_category_products_async()
+        print('category products mapping built, products', count)
@@ -0,0 +1,78 @@
+from datetime import datetime
+from typing import List
+from uuid import UUID
+
+from pymongo import UpdateMany
+
+from .models import BaseCategory, CategorySyncJob, CategorySyncJobStatusEnum
+from .product_exceptions import CategorySyncJobNotExist
+from .catalog_version import bump_catalog_version_async
+
+from database.main_db import async_db_provider
+
+
+# products, rewritten with one bulk_write (job progress is saved after each batch)
+CATEGORY_SYNC_BATCH_SIZE = 500
+
+
+def is_category_copy_changed(old_category: BaseCategory, new_category: BaseCategory) -> bool:
+    """ fields, that are embedded into products (BaseProductCategory) """
+    return old_category.name != new_category.name or old_category.slug != new_category.slug
+
+async def create_category_sync_job(category_id: UUID) -> CategorySyncJob:
+    job = CategorySyncJob(category_id = category_id)
+    await job.insert_db_async()
+    return job
+
+async def get_category_sync_job_async(job_id: UUID) -> CategorySyncJob:
+    job = await async_db_provider.catalog_jobs_db.find_one({"_id": job_id})
+    if not job:
+        raise CategorySyncJobNotExist
+    return CategorySyncJob(**job)
+
+def get_category_copy_request(category: dict, products_ids: List[UUID]) -> UpdateMany:
+    return UpdateMany(
+        {"_id": {"$in": products_ids}, "categories._id": category["_id"]},
+        {"$set": {
+            "categories.$[category].name": category["name"],
+            "categories.$[category].slug": category["slug"],
+        }},
+        array_filters = [{"category._id": category["_id"]}],
+    )
+
+async def run_category_sync_job(job: CategorySyncJob):
+    """
+        Rewrite embedded copies of category in its products by batches,
+        then bump catalog version, so snapshot and cached responses are rebuilt
+    """
+    job.status = CategorySyncJobStatusEnum.running
+    try:
+        # current category fields, if category was changed again after job was created
+        category = await async_db_provider.categories_db.find_one(
+            {"_id": job.category_id}, {"_id": 1, "name": 1, "slug": 1}
+        )
+        if not category:
+            raise ValueError("category not exists")
+        products_ids = await async_db_provider.products_db.distinct(
+            "_id", {"categories._id": job.category_id}
+        )
+        job.total = len(products_ids)
+        await job.update_db_async()
+        for start in range(0, len(products_ids), CATEGORY_SYNC_BATCH_SIZE):
+            batch = products_ids[start:start + CATEGORY_SYNC_BATCH_SIZE]
+            result = await async_db_provider.products_db.bulk_write(
+                [get_category_copy_request(category, batch)], ordered = False
+            )
+            job.processed += len(batch)
+            job.modified += result.modified_count
+            await job.update_db_async()
+        job.status = CategorySyncJobStatusEnum.completed
+    except Exception as e:
+        print('category sync job failed', job.id, e)
+        job.status = CategorySyncJobStatusEnum.failed
+        job.error = str(e)
+    job.date_finished = datetime.utcnow()
+    await job.update_db_async()
+    if job.modified:
+        await bump_catalog_version_async()
+    print('category sync job finished', job.id, job.status, 'modified products', job.modified)
@@ -0,0 +1,198 @@
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from .models import BaseCategory
+from .catalog import catalog, CatalogSnapshot
+
+
+def get_category_signature(category: BaseCategory, products_ids: List[UUID]) -> Tuple:
+    """ category fields, that are shown in tree, and its products (for counts) """
+    return (
+        category.name,
+        category.slug,
+        tuple(category.imgsrc or []),
+        category.menu_order,
+        category.parent_id,
+        frozenset(products_ids),
+    )
+
+def get_category_node(category: BaseCategory, products_count: int) -> dict:
+    return {
+        "id": category.id,
+        "name": category.name,
+        "slug": category.slug,
+        "imgsrc": category.imgsrc,
+        "menu_order": category.menu_order,
+        "parent_id": category.parent_id,
+        # products of category itself
+        "products_count": products_count,
+        # unique products of category and its subcategories
+        "total_products_count": 0,
+        "children": [],
+    }
+
+def sort_key(node: dict) -> Tuple:
+    return (node["menu_order"], node["name"], node["id"])
+
+def get_parent_id(categories: Dict[UUID, BaseCategory], category: BaseCategory) -> Optional[UUID]:
+    """ parent id, None if parent not exists or parent_id makes a cycle """
+    parent_id = category.parent_id
+    visited = {category.id}
+    while parent_id is not None:
+        if parent_id in visited or parent_id not in categories:
+            return None
+        visited.add(parent_id)
+        parent_id = categories[parent_id].parent_id
+    return category.parent_id
+
+def build_category_tree(
+    categories: Dict[UUID, BaseCategory],
+    category_products: Dict[UUID, List[UUID]],
+) -> List[dict]:
+    """ nested categories, sorted by menu_order (then name, id), with products counts """
+    nodes = {
+        category_id: get_category_node(category, len(category_products.get(category_id, [])))
+        for category_id, category in categories.items()
+    }
+    roots = []
+    for category_id, category in categories.items():
+        parent_id = get_parent_id(categories, category)
+        if parent_id is None:
+            roots.append(nodes[category_id])
+        else:
+            nodes[parent_id]["children"].append(nodes[category_id])
+
+    def complete(node: dict) -> Set[UUID]:
+        node["children"].sort(key = sort_key)
+        products = set(category_products.get(node["id"], []))
+        for child in node["children"]:
+            products |= complete(child)
+        node["total_products_count"] = len(products)
+        return products
+
+    roots.sort(key = sort_key)
+    for root in roots:
+        complete(root)
+    return roots
+
+
+class CategoryTreeIndex:
+    """
+        Category tree of current catalog snapshot.
+        Updated on catalog reload only for categories, that were created,
+        changed (or their products sets) or deleted: their nodes are
+        updated / moved, and products counts are recounted for them and
+        their ancestors. Other products changes keep built tree
+    """
+
+    def __init__(self):
+        self.tree: Optional[List[dict]] = None
+        self.signatures: Dict[UUID, Tuple] = {}
+        self.nodes: Dict[UUID, dict] = {}
+        # category id -> parent id in tree (None for roots)
+        self.parents: Dict[UUID, Optional[UUID]] = {}
+        # category id -> unique products of category and its subcategories
+        self.subtree_products: Dict[UUID, Set[UUID]] = {}
+
+    def get_signatures(self, snapshot: CatalogSnapshot) -> Dict[UUID, Tuple]:
+        return {
+            category_id: get_category_signature(
+                category, snapshot.category_products.get(category_id, [])
+            )
+            for category_id, category in snapshot.categories.items()
+        }
+
+    def get_siblings(self, parent_id: Optional[UUID]) -> List[dict]:
+        return self.tree if parent_id is None else self.nodes[parent_id]["children"]
+
+    def detach(self, parent_id: Optional[UUID], node: dict):
+        siblings = self.get_siblings(parent_id)
+        siblings[:] = [sibling for sibling in siblings if sibling is not node]
+
+    def get_depth(self, category_id: UUID) -> int:
+        depth = 0
+        while self.parents[category_id] is not None:
+            category_id = self.parents[category_id]
+            depth += 1
+        return depth
+
+    def update(
+        self,
+        categories: Dict[UUID, BaseCategory],
+        category_products: Dict[UUID, List[UUID]],
+        signatures: Dict[UUID, Tuple],
+    ) -> int:
+        """ apply changed categories to tree, returns count of updated nodes """
+        if self.tree is None:
+            self.tree = []
+        changed = [c_id for c_id, signature in signatures.items() if self.signatures.get(c_id) != signature]
+        removed = [c_id for c_id in self.signatures if c_id not in signatures]
+        # parent in tree depends on whole parents chain (missing parents / cycles)
+        parents = {c_id: get_parent_id(categories, category) for c_id, category in categories.items()}
+        moved = [c_id for c_id, parent_id in parents.items() if c_id not in self.parents or self.parents[c_id] != parent_id]
+        # parents (None - roots), children of which are resorted, and categories to recount
+        resort: Set[Optional[UUID]] = set()
+        recount: Set[UUID] = set(changed)
+        for category_id in removed:
+            node = self.nodes.pop(category_id)
+            parent_id = self.parents.pop(category_id)
+            if parent_id is None or parent_id in self.nodes:
+                self.detach(parent_id, node)
+            if parent_id is not None:
+                recount.add(parent_id)
+            del self.subtree_products[category_id]
+        for category_id in changed:
+            node = get_category_node(categories[category_id], len(category_products.get(category_id, [])))
+            if category_id in self.nodes:
+                # children and place in tree are kept
+                node["children"] = self.nodes[category_id]["children"]
+                node["total_products_count"] = self.nodes[category_id]["total_products_count"]
+                self.nodes[category_id].update(node)
+            else:
+                self.nodes[category_id] = node
+            if category_id not in moved:
+                resort.add(self.parents[category_id])
+        for category_id in moved:
+            node = self.nodes[category_id]
+            if category_id in self.parents:
+                old_parent_id = self.parents[category_id]
+                if old_parent_id is None or old_parent_id in self.nodes:
+                    self.detach(old_parent_id, node)
+                    if old_parent_id is not None:
+                        recount.add(old_parent_id)
+            self.parents[category_id] = parents[category_id]
+        for category_id in moved:
+            parent_id = parents[category_id]
+            self.get_siblings(parent_id).append(self.nodes[category_id])
+            resort.add(parent_id)
+            if parent_id is not None:
+                recount.add(parent_id)
+        for parent_id in resort:
+            self.get_siblings(parent_id).sort(key = sort_key)
+        # categories and their ancestors, deepest first (children are counted before parents)
+        recount = {category_id for category_id in recount if category_id in self.nodes}
+        for category_id in list(recount):
+            parent_id = self.parents[category_id]
+            while parent_id is not None and parent_id not in recount:
+                recount.add(parent_id)
+                parent_id = self.parents[parent_id]
+        for category_id in sorted(recount, key = self.get_depth, reverse = True):
+            node = self.nodes[category_id]
+            products = set(category_products.get(category_id, []))
+            for child in node["children"]:
+                products |= self.subtree_products[child["id"]]
+            self.subtree_products[category_id] = products
+            node["total_products_count"] = len(products)
+        self.signatures = signatures
+        return len(changed) + len(removed)
+
+    async def update_from_snapshot(self, snapshot: CatalogSnapshot):
+        signatures = self.get_signatures(snapshot)
+        if self.tree is not None and signatures == self.signatures:
+            return
+        updated = self.update(snapshot.categories, snapshot.category_products, signatures)
+        print('category tree updated, categories', updated, 'total', len(signatures))
+
+category_tree_index = CategoryTreeIndex()
+
+catalog.reload_listeners.append(category_tree_index.update_from_snapshot)
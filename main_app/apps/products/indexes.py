@@ -0,0 +1,24 @@
+from pymongo import IndexModel, ASCENDING
+
+# indexes, that are applied on startup (see database/indexes.py)
+products_indexes = {
+    "products_db": [
+        # products with embedded category (category sync jobs)
+        IndexModel([("categories._id", ASCENDING)]),
+        IndexModel([("slug", ASCENDING)]),
+    ],
+    "categories_db": [
+        IndexModel([("slug", ASCENDING)]),
+    ],
+    "category_products_db": [
+        IndexModel([("category_id", ASCENDING), ("product_id", ASCENDING)], unique = True),
+        # category page, ordered by position (covered)
+        IndexModel([("category_id", ASCENDING), ("position", ASCENDING), ("product_id", ASCENDING)]),
+        # product writes
+        IndexModel([("product_id", ASCENDING)]),
+    ],
+    "catalog_jobs_db": [
+        # finished jobs are kept for a week
+        IndexModel([("date_finished", ASCENDING)], expireAfterSeconds = 7 * 24 * 60 * 60),
+    ],
+}
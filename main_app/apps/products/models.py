@@ -1,12 +1,18 @@
 import uuid
+from datetime import datetime
+from enum import Enum
 from fastapi import Request, FastAPI
 from pydantic import BaseModel, UUID4, Field, validator
 from pymongo import ReturnDocument
 #from bson.objectid import ObjectId
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
 
 from typing import Optional, List
 from .product_exceptions import ProductAlreadyExist, ProductNotExist, CategoryAlreadyExist, CategoryNotExist
+from .catalog_version import bump_catalog_version, bump_catalog_version_async
+from .category_products import sync_product_categories, sync_product_categories_async
+from .category_products import delete_product_categories, delete_product_categories_async
+from .category_products import delete_category_products, delete_category_products_async
 
 
 # Category block 
@@ -39,6 +45,21 @@ class BaseProductCategory(BaseModel):
             return True, BaseProductCategory(**category)
         return False, None
 
+    async def exist_get_db_async(self):
+        if self.id:
+            category = await async_db_provider.categories_db.find_one(
+                {"_id": self.id}
+            )
+        elif self.slug.__len__() > 0:
+            category = await async_db_provider.categories_db.find_one(
+                {"slug": self.slug}
+            )
+        else:
+            return False, None
+        if not category:
+            return False, None
+        return True, BaseProductCategory(**category)
+
 
 class BaseCategoryCreate(BaseModel):
     name: str
@@ -90,10 +111,13 @@ class BaseCategory(BaseModel):
         db_provider.categories_db.insert_one(
             self.dict(by_alias=True)
         )
+        bump_catalog_version()
     def delete_db(self):
         db_provider.categories_db.delete_one(
             {"_id": self.id}
         )
+        delete_category_products(self.id)
+        bump_catalog_version()
     def update_db(self):
         updated_category = db_provider.categories_db.find_one_and_update(
             {"_id": self.id},
@@ -102,10 +126,72 @@ class BaseCategory(BaseModel):
         )
         print('udated category is', updated_category)
         if updated_category:
+            bump_catalog_version()
             category = BaseCategory(**updated_category)
             return category
         return None 
 
+    async def insert_db_async(self):
+        category_exist = await async_db_provider.categories_db.find_one(
+            {"slug": self.slug}
+        )
+        if category_exist:
+            raise CategoryAlreadyExist
+        await async_db_provider.categories_db.insert_one(
+            self.dict(by_alias=True)
+        )
+        await bump_catalog_version_async()
+    async def delete_db_async(self):
+        await async_db_provider.categories_db.delete_one(
+            {"_id": self.id}
+        )
+        await delete_category_products_async(self.id)
+        await bump_catalog_version_async()
+    async def update_db_async(self):
+        updated_category = await async_db_provider.categories_db.find_one_and_update(
+            {"_id": self.id},
+            {"$set": self.dict(by_alias=True)},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_category:
+            await bump_catalog_version_async()
+            category = BaseCategory(**updated_category)
+            return category
+        return None
+
+class CategorySyncJobStatusEnum(str, Enum):
+    pending = "pending"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+class CategorySyncJob(BaseModel):
+    """ Background rewrite of category copies, embedded into products """
+    id: UUID4 = Field(default_factory = uuid.uuid4, alias="_id")
+    category_id: UUID4
+    status: CategorySyncJobStatusEnum = CategorySyncJobStatusEnum.pending
+    # products with category
+    total: int = 0
+    processed: int = 0
+    modified: int = 0
+    error: Optional[str] = None
+    date_created: datetime = Field(default_factory = datetime.utcnow)
+    date_finished: Optional[datetime] = None
+
+    class Config:
+        allow_population_by_field_name = True
+        use_enum_values = True
+
+    async def insert_db_async(self):
+        await async_db_provider.catalog_jobs_db.insert_one(
+            self.dict(by_alias=True)
+        )
+    async def update_db_async(self):
+        await async_db_provider.catalog_jobs_db.update_one(
+            {"_id": self.id},
+            {"$set": self.dict(by_alias=True, exclude={"id"})},
+        )
+
 # Product block
 class BaseProductUpdate(BaseModel):
     name: str
@@ -126,6 +212,20 @@ class BaseProductCreate(BaseModel):
     categories: List[BaseProductCategory] = []
 
 
+class BaseProductListItem(BaseModel):
+    """ Lightweight product for paginated lists (without description and categories) """
+    id: UUID4 = Field(alias="_id")
+    slug: str = ""
+    name: Optional[str]
+    imgsrc: Optional[list] = []
+    price: Optional[int]
+    sale_price: Optional[int]
+    weight: Optional[str]
+
+    class Config:
+        allow_population_by_field_name = True
+
+
 class BaseProduct(BaseModel):
 #   id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     id: UUID4 = Field(default_factory = uuid.uuid4, alias="_id")
@@ -143,17 +243,51 @@ class BaseProduct(BaseModel):
             return self.sale_price
         return self.price
 
+    def get_categories_query(self) -> Optional[dict]:
+        """ one query for all product categories (by id, or by slug if id is not set) """
+        ids = [category.id for category in self.categories if category.id]
+        slugs = [category.slug for category in self.categories if not category.id and category.slug]
+        conditions = []
+        if ids:
+            conditions.append({"_id": {"$in": ids}})
+        if slugs:
+            conditions.append({"slug": {"$in": slugs}})
+        if not conditions:
+            return None
+        return {"$or": conditions}
+
+    def set_checked_categories(self, found_categories: List[dict]):
+        """ replace categories with found ones, keeping order, not existing are removed """
+        by_id = {category["_id"]: category for category in found_categories}
+        by_slug = {category["slug"]: category for category in found_categories}
+        checked_categories = {}
+        for category in self.categories:
+            if category.id:
+                found = by_id.get(category.id)
+            else:
+                found = by_slug.get(category.slug)
+            if found and found["_id"] not in checked_categories:
+                checked_categories[found["_id"]] = BaseProductCategory(**found)
+        self.categories = list(checked_categories.values())
+
+    def get_categories_ids(self) -> List[UUID4]:
+        return [category.id for category in self.categories or [] if category.id]
+
     def check_categories(self):
         if not self.categories:
             return
-        for indx, category in enumerate(self.categories, start = 0):
-            print('category is', category)
-            is_exist, cat = category.exist_get_db()
-            print('cat is', cat)
-            if is_exist and cat:
-                self.categories[indx] = cat
-            else:
-                self.categories.remove(category)
+        query = self.get_categories_query()
+        found_categories = list(db_provider.categories_db.find(query)) if query else []
+        self.set_checked_categories(found_categories)
+
+    async def check_categories_async(self):
+        if not self.categories:
+            return
+        query = self.get_categories_query()
+        found_categories = []
+        if query:
+            found_categories = await async_db_provider.categories_db.find(query).to_list(None)
+        self.set_checked_categories(found_categories)
 
     def insert_db(self):
         product_exist = db_provider.products_db.find_one(
@@ -167,6 +301,8 @@ class BaseProduct(BaseModel):
             self.dict(by_alias=True)
         )
         print('insert result is', result)
+        sync_product_categories(self.id, self.get_categories_ids())
+        bump_catalog_version()
 
     def check_exists_slug(self):
         product_exists_dict = db_provider.products_db.find_one(
@@ -180,6 +316,8 @@ class BaseProduct(BaseModel):
         db_provider.products_db.delete_one(
             {"_id": self.id}
         )
+        delete_product_categories(self.id)
+        bump_catalog_version()
     def update_db(self):
         self.check_categories()
 #       print('self dict is', self.dict())
@@ -190,6 +328,40 @@ class BaseProduct(BaseModel):
         )
         print('updated product is', updated_product)
         if updated_product:
+            sync_product_categories(self.id, self.get_categories_ids())
+            bump_catalog_version()
+            product = BaseProduct(**updated_product)
+            return product
+        return None
+
+    async def insert_db_async(self):
+        product_exist = await async_db_provider.products_db.find_one(
+            {"_id": self.id}
+        )
+        if product_exist:
+            raise ProductAlreadyExist
+        await self.check_categories_async()
+        await async_db_provider.products_db.insert_one(
+            self.dict(by_alias=True)
+        )
+        await sync_product_categories_async(self.id, self.get_categories_ids())
+        await bump_catalog_version_async()
+    async def delete_db_async(self):
+        await async_db_provider.products_db.delete_one(
+            {"_id": self.id}
+        )
+        await delete_product_categories_async(self.id)
+        await bump_catalog_version_async()
+    async def update_db_async(self):
+        await self.check_categories_async()
+        updated_product = await async_db_provider.products_db.find_one_and_update(
+            {"_id": self.id},
+            {"$set": self.dict(by_alias=True)},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_product:
+            await sync_product_categories_async(self.id, self.get_categories_ids())
+            await bump_catalog_version_async()
             product = BaseProduct(**updated_product)
             return product
         return None
@@ -6,6 +6,27 @@ class ProductNotExist(HTTPException):
 		self.status_code = 400
 		self.detail = "Product not exist"
 
+class ProductsNotExist(HTTPException):
+	def __init__(self, products_ids: list):
+		self.status_code = 400
+		self.detail = {
+			"msg": "Products not exist",
+			"products_ids": [str(product_id) for product_id in products_ids],
+		}
+
+class InvalidProductFields(HTTPException):
+	def __init__(self, fields: list):
+		self.status_code = 400
+		self.detail = {
+			"msg": "Invalid product fields",
+			"fields": fields,
+		}
+
+class InvalidProductsCursor(HTTPException):
+	def __init__(self):
+		self.status_code = 400
+		self.detail = "Invalid products cursor"
+
 class CategoryNotExist(HTTPException):
 	def __init__(self):
 		self.status_code = 400
@@ -22,3 +43,16 @@ class CategoryAlreadyExist(HTTPException):
 		self.detail = "Category already exist"
 
 
+
+class InvalidImportFile(HTTPException):
+	def __init__(self, msg: str):
+		self.status_code = 400
+		self.detail = {
+			"msg": "Invalid import file",
+			"reason": msg,
+		}
+
+class CategorySyncJobNotExist(HTTPException):
+	def __init__(self):
+		self.status_code = 400
+		self.detail = "Category sync job not exist"
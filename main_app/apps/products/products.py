@@ -1,17 +1,24 @@
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
 
-from .models import BaseProduct
+from .models import BaseProduct, BaseProductListItem
 from .models import BaseCategory
-from .product_exceptions import ProductNotExist, CategoryNotExist
+from .product_exceptions import ProductNotExist, ProductsNotExist, CategoryNotExist, InvalidProductFields, InvalidProductsCursor
+from .catalog import catalog
+from .search import product_search_index
+from .category_products import get_category_products_ids, get_category_products_ids_async, get_category_products_keys_page_async
+
+import re
+import uuid
 
 from pydantic import UUID4
-from typing import List
+from typing import List, Dict, Iterable, Optional, Tuple
 
 def search_products_by_name(search_string):
     products_dict = db_provider.products_db.find(
         {
             "name": {
-                "$regex": search_string
+                "$regex": re.escape(search_string),
+                "$options": "i",
             }
         }
     ).limit(10)
@@ -19,6 +26,8 @@ def search_products_by_name(search_string):
     return products
 
 def get_product_by_id(product_id: UUID4, silent: bool = False) -> BaseProduct:
+    if catalog.snapshot and product_id in catalog.snapshot.products:
+        return catalog.snapshot.products[product_id].copy()
     product = db_provider.products_db.find_one(
         {"_id": product_id}
     )
@@ -29,6 +38,35 @@ def get_product_by_id(product_id: UUID4, silent: bool = False) -> BaseProduct:
     product = BaseProduct(**product)
     return product
 
+def split_catalog_products(product_ids: Iterable[UUID4]):
+    """ resolve products from catalog snapshot, return (found, not_found_ids) """
+    found: Dict[UUID4, BaseProduct] = {}
+    not_found = []
+    for product_id in dict.fromkeys(product_ids):
+        if catalog.snapshot and product_id in catalog.snapshot.products:
+            found[product_id] = catalog.snapshot.products[product_id].copy()
+        else:
+            not_found.append(product_id)
+    return found, not_found
+
+def get_products_by_ids(product_ids: Iterable[UUID4], silent: bool = False) -> Dict[UUID4, BaseProduct]:
+    """
+        Batch loader: catalog snapshot first, other products with one $in query.
+        If some products not exist, they are reported together
+    """
+    products, not_found = split_catalog_products(product_ids)
+    if not_found:
+        products_dict = db_provider.products_db.find(
+            {"_id": {"$in": not_found}}
+        )
+        for product in products_dict:
+            product = BaseProduct(**product)
+            products[product.id] = product
+    missing = [product_id for product_id in not_found if product_id not in products]
+    if missing and not silent:
+        raise ProductsNotExist(missing)
+    return products
+
 def get_category_by_id(category_id: UUID4, silent: bool = False) -> BaseCategory:
     category = db_provider.categories_db.find_one(
         {"_id": category_id }
@@ -42,12 +80,192 @@ def get_category_by_id(category_id: UUID4, silent: bool = False) -> BaseCategory
         return category
 
 def get_category_products_by_id(category_id: UUID4) -> list:
-    category_products_raw = db_provider.products_db.find(
-        {"categories": {
-            "$elemMatch": {
-                "_id": category_id
+    # ordered ids from category products mapping, then products by ids
+    products_ids = get_category_products_ids(category_id)
+    products = get_products_by_ids(products_ids, silent = True)
+    return [products[p_id].dict() for p_id in products_ids if p_id in products]
+
+# async counterparts (motor), for usage inside async route handlers
+
+async def search_products_by_name_async(search_string, limit: int = 10):
+    """ ranked search with in-memory index, escaped regex if index is not loaded """
+    if catalog.snapshot and product_search_index.ready:
+        products_ids = product_search_index.search(search_string, limit = limit)
+        return [
+            catalog.snapshot.products[product_id].dict()
+            for product_id in products_ids if product_id in catalog.snapshot.products
+        ]
+    products_cursor = async_db_provider.products_db.find(
+        {
+            "name": {
+                "$regex": re.escape(search_string),
+                "$options": "i",
             }
-        }}
+        }
+    ).limit(limit)
+    products = [BaseProduct(**product).dict() async for product in products_cursor]
+    return products
+
+async def get_product_by_id_async(product_id: UUID4, silent: bool = False) -> BaseProduct:
+    # catalog snapshot first, db only if product is not in snapshot yet
+    if catalog.snapshot and product_id in catalog.snapshot.products:
+        return catalog.snapshot.products[product_id].copy()
+    product = await async_db_provider.products_db.find_one(
+        {"_id": product_id}
+    )
+    if not product:
+        if not silent:
+            raise ProductNotExist
+        return None
+    product = BaseProduct(**product)
+    return product
+
+async def get_products_by_ids_async(product_ids: Iterable[UUID4], silent: bool = False) -> Dict[UUID4, BaseProduct]:
+    products, not_found = split_catalog_products(product_ids)
+    if not_found:
+        products_cursor = async_db_provider.products_db.find(
+            {"_id": {"$in": not_found}}
+        )
+        async for product in products_cursor:
+            product = BaseProduct(**product)
+            products[product.id] = product
+    missing = [product_id for product_id in not_found if product_id not in products]
+    if missing and not silent:
+        raise ProductsNotExist(missing)
+    return products
+
+async def get_category_by_id_async(category_id: UUID4, silent: bool = False) -> BaseCategory:
+    if catalog.snapshot and category_id in catalog.snapshot.categories:
+        return catalog.snapshot.categories[category_id].copy()
+    category = await async_db_provider.categories_db.find_one(
+        {"_id": category_id }
     )
-    category_products = [BaseProduct(**product).dict() for product in category_products_raw]
-    return category_products
+    if not category:
+        if not silent:
+            raise CategoryNotExist
+        return None
+    category = BaseCategory(**category)
+    return category
+
+async def get_category_products_by_id_async(category_id: UUID4) -> list:
+    if catalog.snapshot:
+        return [product.dict() for product in catalog.snapshot.get_category_products(category_id)]
+    products_ids = await get_category_products_ids_async(category_id)
+    products = await get_products_by_ids_async(products_ids, silent = True)
+    return [products[p_id].dict() for p_id in products_ids if p_id in products]
+
+async def get_product_by_slug_async(slug: str, silent: bool = False) -> BaseProduct:
+    if catalog.snapshot and slug in catalog.snapshot.products_by_slug:
+        return catalog.snapshot.products_by_slug[slug].copy()
+    product = await async_db_provider.products_db.find_one(
+        {"slug": slug}
+    )
+    if not product:
+        if not silent:
+            raise ProductNotExist
+        return None
+    return BaseProduct(**product)
+
+async def get_category_by_slug_async(slug: str, silent: bool = False) -> BaseCategory:
+    if catalog.snapshot and slug in catalog.snapshot.categories_by_slug:
+        return catalog.snapshot.categories_by_slug[slug].copy()
+    category = await async_db_provider.categories_db.find_one(
+        {"slug": slug}
+    )
+    if not category:
+        if not silent:
+            raise CategoryNotExist
+        return None
+    return BaseCategory(**category)
+
+def parse_product_list_fields(fields: Optional[str]) -> List[str]:
+    """ fields query param ("name,price") -> list of BaseProductListItem fields """
+    allowed = list(BaseProductListItem.__fields__)
+    if not fields:
+        return allowed
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    invalid = [field for field in requested if field not in allowed]
+    if invalid:
+        raise InvalidProductFields(invalid)
+    if "id" not in requested:
+        requested.insert(0, "id")
+    return requested
+
+async def get_products_page_async(
+    limit: int,
+    cursor: Optional[UUID4] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+        Keyset pagination by product id (stable sort key),
+        returns (products with [fields] only, next cursor)
+    """
+    fields = fields or list(BaseProductListItem.__fields__)
+    if catalog.snapshot:
+        products = catalog.snapshot.get_products_page(limit + 1, cursor = cursor)
+        items = [{field: getattr(product, field) for field in fields} for product in products]
+    else:
+        query = {}
+        if cursor:
+            query["_id"] = {"$gt": cursor}
+        # projection is pushed down to mongo, so description / categories are not loaded
+        projection = {("_id" if field == "id" else field): 1 for field in fields}
+        products_cursor = async_db_provider.products_db.find(
+            query, projection
+        ).sort("_id", 1).limit(limit + 1)
+        items = [
+            BaseProductListItem(**product).dict(include = set(fields))
+            async for product in products_cursor
+        ]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = str(items[-1]["id"])
+    return items, next_cursor
+
+def get_category_cursor(key: Tuple[int, UUID4]) -> str:
+    position, product_id = key
+    return f"{position}:{product_id}"
+
+def parse_category_cursor(cursor: Optional[str]) -> Optional[Tuple[int, uuid.UUID]]:
+    """ "position:product_id" cursor of category page -> (position, product_id) """
+    if not cursor:
+        return None
+    try:
+        position, product_id = cursor.split(":", 1)
+        return int(position), uuid.UUID(product_id)
+    except ValueError:
+        raise InvalidProductsCursor
+
+async def get_category_products_page_async(
+    category_id: UUID4,
+    limit: int,
+    cursor: Optional[Tuple[int, UUID4]] = None,
+    fields: Optional[List[str]] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+        Keyset pagination of category products by (position, product id),
+        same order as unpaginated category products.
+        Returns (products with [fields] only, next cursor)
+    """
+    fields = fields or list(BaseProductListItem.__fields__)
+    if catalog.snapshot:
+        page = catalog.snapshot.get_category_products_page(category_id, limit + 1, cursor = cursor)
+        keys = [key for key, _ in page]
+        items = [{field: getattr(product, field) for field in fields} for _, product in page]
+    else:
+        keys = await get_category_products_keys_page_async(category_id, limit + 1, cursor = cursor)
+        projection = {("_id" if field == "id" else field): 1 for field in fields}
+        products_cursor = async_db_provider.products_db.find(
+            {"_id": {"$in": [product_id for _, product_id in keys]}}, projection
+        )
+        products = {}
+        async for product in products_cursor:
+            products[product["_id"]] = BaseProductListItem(**product).dict(include = set(fields))
+        keys = [key for key in keys if key[1] in products]
+        items = [products[product_id] for _, product_id in keys]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = get_category_cursor(keys[limit - 1])
+    return items, next_cursor
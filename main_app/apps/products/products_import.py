@@ -0,0 +1,273 @@
+import codecs
+import csv
+import uuid
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+from openpyxl import load_workbook
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config import settings
+
+from .models import BaseProduct, BaseProductCreate, BaseProductCategory
+from .category_products import get_product_categories_requests
+from .product_exceptions import InvalidImportFile
+
+from database.main_db import db_provider
+
+
+# spreadsheet columns (first row), other columns are ignored.
+# Products are matched by slug, or by name, if slug is empty
+IMPORT_COLUMNS = ["slug", "name", "description", "price", "sale_price", "weight", "imgsrc", "categories"]
+REQUIRED_COLUMNS = ["name", "price"]
+# comma separated values (categories - by slug)
+LIST_COLUMNS = ["imgsrc", "categories"]
+CSV_DELIMITERS = ",;\t"
+
+
+def iter_xlsx_rows(file: IO) -> Iterator[tuple]:
+    # read-only mode: rows are read lazily, sheet is not loaded into memory
+    try:
+        workbook = load_workbook(file, read_only = True, data_only = True)
+    except Exception as e:
+        raise InvalidImportFile(f"can't read xlsx file: {e}")
+    try:
+        for row in workbook.active.iter_rows(values_only = True):
+            yield row
+    finally:
+        workbook.close()
+
+def iter_csv_rows(file: IO) -> Iterator[list]:
+    # upload file is SpooledTemporaryFile, which is not a full io object
+    # before python 3.11 (no readable / seekable), so it can't be wrapped
+    # with TextIOWrapper. Stream reader only needs read
+    reader = codecs.getreader("utf-8-sig")
+    try:
+        sample = reader(file).read(8192)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters = CSV_DELIMITERS)
+        except csv.Error:
+            dialect = csv.excel
+        file.seek(0)
+        for row in csv.reader(reader(file), dialect):
+            yield row
+    except UnicodeDecodeError:
+        raise InvalidImportFile("csv file must be in utf-8")
+
+def iter_file_rows(file: IO, filename: str) -> Iterator:
+    filename = (filename or "").lower()
+    if filename.endswith(".xlsx"):
+        return iter_xlsx_rows(file)
+    if filename.endswith(".csv"):
+        return iter_csv_rows(file)
+    raise InvalidImportFile("only .xlsx and .csv files are supported")
+
+def parse_header(row) -> Dict[int, str]:
+    """ column index -> import column """
+    header = {}
+    for index, value in enumerate(row or []):
+        column = str(value).strip().lower() if value is not None else ""
+        if column in IMPORT_COLUMNS:
+            header[index] = column
+    missing = [column for column in REQUIRED_COLUMNS if column not in header.values()]
+    if missing:
+        raise InvalidImportFile(f"missing columns: {', '.join(missing)}")
+    return header
+
+def parse_row(header: Dict[int, str], row) -> dict:
+    """ row -> not empty values by column """
+    data = {}
+    for index, column in header.items():
+        value = row[index] if index < len(row) else None
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            continue
+        if column in LIST_COLUMNS:
+            value = [item.strip() for item in str(value).split(",") if item.strip()]
+        elif isinstance(value, float) and value.is_integer():
+            # xlsx numbers are floats
+            value = int(value)
+        if column in ("slug", "name", "weight", "description"):
+            value = str(value)
+        data[column] = value
+    return data
+
+
+class ProductsImport:
+    """
+        Streaming products import: rows are read lazily and processed by batches,
+        each batch - one categories query, one products query and one bulk_write
+    """
+
+    def __init__(self, batch_size: int = settings.PRODUCTS_IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        # category slug -> category dict (None if category not exists)
+        self.categories: Dict[str, Optional[dict]] = {}
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors: List[dict] = []
+
+    def add_error(self, row_number: int, errors: List[str]):
+        self.errors.append({"row": row_number, "errors": errors})
+
+    def get_report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "updated": self.updated,
+            "errors": self.errors,
+        }
+
+    def load_categories(self, slugs: set):
+        slugs = [slug for slug in slugs if slug not in self.categories]
+        if not slugs:
+            return
+        for slug in slugs:
+            self.categories[slug] = None
+        categories_cursor = db_provider.categories_db.find(
+            {"slug": {"$in": slugs}},
+            {"_id": 1, "name": 1, "slug": 1},
+        )
+        for category in categories_cursor:
+            self.categories[category["slug"]] = category
+
+    def validate_batch(self, batch: List[Tuple[int, dict]]) -> List[Tuple[int, dict]]:
+        """ valid rows as (row number, product fields to set) """
+        self.load_categories({
+            slug for _, data in batch for slug in data.get("categories", [])
+        })
+        valid = []
+        for row_number, data in batch:
+            categories_slugs = data.pop("categories", None)
+            slug = data.pop("slug", None)
+            try:
+                product = BaseProductCreate(**data)
+            except ValidationError as e:
+                self.add_error(row_number, [
+                    f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+                    for error in e.errors()
+                ])
+                continue
+            fields = product.dict(exclude_unset = True)
+            if slug:
+                fields["slug"] = slug
+            if categories_slugs is not None:
+                missing = [s for s in categories_slugs if not self.categories.get(s)]
+                if missing:
+                    self.add_error(row_number, [f"categories not exist: {', '.join(missing)}"])
+                    continue
+                fields["categories"] = [
+                    BaseProductCategory(**self.categories[s]).dict(by_alias = True)
+                    for s in dict.fromkeys(categories_slugs)
+                ]
+            valid.append((row_number, fields))
+        return valid
+
+    def get_existing_ids(self, products: List[Tuple[int, dict]]) -> Tuple[Dict[str, uuid.UUID], Dict[str, uuid.UUID]]:
+        """ existing products ids by slug and by name """
+        slugs = [fields["slug"] for _, fields in products if fields.get("slug")]
+        names = [fields["name"] for _, fields in products if not fields.get("slug")]
+        conditions = []
+        if slugs:
+            conditions.append({"slug": {"$in": slugs}})
+        if names:
+            conditions.append({"name": {"$in": names}, "slug": {"$in": ["", None]}})
+        by_slug, by_name = {}, {}
+        products_cursor = db_provider.products_db.find(
+            {"$or": conditions},
+            {"_id": 1, "slug": 1, "name": 1},
+        )
+        for product in products_cursor:
+            if product.get("slug"):
+                by_slug[product["slug"]] = product["_id"]
+            else:
+                by_name[product["name"]] = product["_id"]
+        return by_slug, by_name
+
+    def write_batch(self, products: List[Tuple[int, dict]]):
+        by_slug, by_name = self.get_existing_ids(products)
+        # product id -> (row number, fields), later row with the same product wins
+        batch_products: Dict[uuid.UUID, Tuple[int, dict]] = {}
+        for row_number, fields in products:
+            if fields.get("slug"):
+                product_id = by_slug.setdefault(fields["slug"], uuid.uuid4())
+            else:
+                product_id = by_name.setdefault(fields["name"], uuid.uuid4())
+            batch_products[product_id] = (row_number, fields)
+        defaults = BaseProduct(name = "", price = 0).dict(by_alias = True)
+        requests = []
+        requests_products = []
+        for product_id, (row_number, fields) in batch_products.items():
+            set_on_insert = {
+                key: value for key, value in defaults.items()
+                if key not in fields and key != "_id"
+            }
+            update = {"$set": fields}
+            if set_on_insert:
+                update["$setOnInsert"] = set_on_insert
+            requests.append(UpdateOne({"_id": product_id}, update, upsert = True))
+            requests_products.append((product_id, row_number, fields))
+        failed = set()
+        try:
+            result = db_provider.products_db.bulk_write(requests, ordered = False)
+            self.created += result.upserted_count
+            self.updated += result.matched_count
+        except BulkWriteError as e:
+            details = e.details
+            self.created += details.get("nUpserted", 0)
+            self.updated += details.get("nMatched", 0)
+            for error in details.get("writeErrors", []):
+                failed.add(error["index"])
+                self.add_error(requests_products[error["index"]][1], [error.get("errmsg", "write error")])
+        # category products mapping of written products
+        mapping_requests = []
+        mapping_rows = []
+        for index, (product_id, row_number, fields) in enumerate(requests_products):
+            if index in failed or "categories" not in fields:
+                continue
+            product_requests = get_product_categories_requests(
+                product_id, [category["_id"] for category in fields["categories"]]
+            )
+            mapping_requests += product_requests
+            mapping_rows += [row_number] * len(product_requests)
+        if not mapping_requests:
+            return
+        try:
+            db_provider.category_products_db.bulk_write(mapping_requests, ordered = False)
+        except BulkWriteError as e:
+            # products are written, only their category products mapping is not
+            # (e.g. duplicate key of concurrent upsert)
+            for error in e.details.get("writeErrors", []):
+                self.add_error(
+                    mapping_rows[error["index"]],
+                    [f"categories mapping: {error.get('errmsg', 'write error')}"],
+                )
+
+    def process_batch(self, batch: List[Tuple[int, dict]]):
+        products = self.validate_batch(batch)
+        if products:
+            self.write_batch(products)
+
+    def run(self, rows: Iterator) -> dict:
+        header = parse_header(next(rows, None))
+        batch = []
+        # first row is header
+        for row_number, row in enumerate(rows, start = 2):
+            data = parse_row(header, row)
+            if not data:
+                continue
+            self.rows += 1
+            batch.append((row_number, data))
+            if len(batch) >= self.batch_size:
+                self.process_batch(batch)
+                batch = []
+        if batch:
+            self.process_batch(batch)
+        return self.get_report()
+
+def import_products_file(file: IO, filename: str) -> dict:
+    """ sync (blocking) import, returns report with per-row errors """
+    return ProductsImport().run(iter_file_rows(file, filename))
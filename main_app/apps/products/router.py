@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi import APIRouter, Request, HTTPException, Depends, Query, File, UploadFile, BackgroundTasks
+from starlette.concurrency import run_in_threadpool
 from bson.json_util import loads, dumps
 import json
 
 import datetime
 
-from typing import List
+from typing import List, Optional
 
 from pydantic import UUID4
 
@@ -15,11 +16,26 @@ from .models import BaseCategory, BaseCategoryCreate, BaseCategoryUpdate
 # product exceptions
 from .product_exceptions import ProductNotExist, CategoryNotExist
 # products methods
-from .products import get_product_by_id, get_category_by_id, get_category_products_by_id, search_products_by_name
+from .products import get_product_by_id_async, get_category_by_id_async, get_category_products_by_id_async, search_products_by_name_async, get_product_by_slug_async, get_category_by_slug_async, get_products_page_async, parse_product_list_fields
+from .products import get_category_products_page_async, parse_category_cursor
+from .catalog import catalog
+from .catalog_version import bump_catalog_version_async
+from .category_products import set_category_products_order_async
+from .suggest import suggest_index
+from .category_tree import category_tree_index, build_category_tree
+from .category_products import get_category_products_mapping_async
+from .category_sync import is_category_copy_changed, create_category_sync_job, run_category_sync_job, get_category_sync_job_async
+from .products_import import import_products_file
 
 from apps.users.user import get_current_admin_user
 
-from database.main_db import db_provider
+from config import settings
+
+from apps.site.http_cache import conditional_json_response, CATALOG_CACHE_CONTROL
+from apps.site.static_assets import resolve_imgsrc
+from database.cache import TTLCache
+
+from database.main_db import async_db_provider
 
 router = APIRouter(
     prefix = "/products",
@@ -27,34 +43,120 @@ router = APIRouter(
     # responses ? 
 )
 
+# encoded catalog responses with etags, valid for one catalog version
+catalog_responses_cache = TTLCache(maxsize = 256, ttl = 24 * 60 * 60)
+
+def get_catalog_cache():
+    # without snapshot there is no version to validate cached responses
+    return catalog_responses_cache if catalog.snapshot else None
+
 # categories
 @router.get("/categories")
 async def get_categories(request: Request):
-    categories_dict = db_provider.categories_db.find({})
-    categories = [BaseCategory(**category).dict() for category in categories_dict]
-    return {
-        "status": "success",
-        "categories": categories,
-    }
+    async def build():
+        if catalog.snapshot:
+            categories = catalog.snapshot.categories_list
+        else:
+            categories_cursor = async_db_provider.categories_db.find({})
+            categories = [resolve_imgsrc(BaseCategory(**category).dict()) async for category in categories_cursor]
+        return {
+            "status": "success",
+            "categories": categories,
+        }
+    return await conditional_json_response(
+        request,
+        build,
+        cache_control = CATALOG_CACHE_CONTROL,
+        cache = get_catalog_cache(),
+        version = catalog.version,
+    )
+
+@router.get("/categories/tree")
+async def get_categories_tree(request: Request):
+    """
+        categories tree: root categories sorted by menu_order, each
+        with nested children and products counts
+    """
+    async def build():
+        if catalog.snapshot and category_tree_index.tree is not None:
+            tree = category_tree_index.tree
+        else:
+            categories_cursor = async_db_provider.categories_db.find({})
+            categories = {}
+            async for category in categories_cursor:
+                category = BaseCategory(**category)
+                categories[category.id] = category
+            category_products = await get_category_products_mapping_async() or {}
+            tree = build_category_tree(categories, category_products)
+        return {
+            "status": "success",
+            "categories": tree,
+        }
+    return await conditional_json_response(
+        request,
+        build,
+        cache_control = CATALOG_CACHE_CONTROL,
+        cache = get_catalog_cache(),
+        version = catalog.version,
+    )
+
+@router.get("/categories/by-slug/{slug}")
+async def get_category_by_slug(
+    slug: str,
+):
+    category = await get_category_by_slug_async(slug)
+    return resolve_imgsrc(category.dict())
 
 @router.get("/categories/{category_id}")
 async def get_category(
     category_id: UUID4,
 ):
-    category = get_category_by_id(category_id)
+    category = await get_category_by_id_async(category_id)
     if category:
-        return category.dict()
+        return resolve_imgsrc(category.dict())
 
 @router.get("/categories/{category_id}/products")
 async def get_category_products(
     category_id: UUID4,
+    limit: Optional[int] = Query(None, ge = 1, le = 100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
 ):
     """
-        get products for category with [category_id]
+        get products for category with [category_id], in category order.
+        If [limit] is passed - returns page of products with
+        [fields] only (comma separated) and next_cursor
     """
-    category_products = get_category_products_by_id(category_id)    
-    return category_products;
+    if limit:
+        products, next_cursor = await get_category_products_page_async(
+            category_id,
+            limit = limit,
+            cursor = parse_category_cursor(cursor),
+            fields = parse_product_list_fields(fields),
+        )
+        return {
+            "products": [resolve_imgsrc(product) for product in products],
+            "next_cursor": next_cursor,
+        }
+    category_products = await get_category_products_by_id_async(category_id)
+    return [resolve_imgsrc(product) for product in category_products]
+
 
+@router.put("/categories/{category_id}/products/order")
+async def set_category_products_order(
+    category_id: UUID4,
+    products_ids: List[UUID4],
+    admin_user = Depends(get_current_admin_user),
+):
+    """
+        set order of category products, [products_ids] - ids in new order
+    """
+    await get_category_by_id_async(category_id)
+    await set_category_products_order_async(category_id, products_ids)
+    await bump_catalog_version_async()
+    return {
+        "status": "success"
+    }
 
 @router.post("/categories")
 async def create_category(
@@ -63,7 +165,7 @@ async def create_category(
     admin_user = Depends(get_current_admin_user),
 ):
     new_category = BaseCategory(**category.dict())
-    new_category.insert_db()
+    await new_category.insert_db_async()
     return new_category.dict()
 
 @router.patch("/categories/{category_id}")
@@ -71,76 +173,161 @@ async def update_category(
     request: Request,
     category_id: UUID4,
     new_category: BaseCategoryUpdate,
+    background_tasks: BackgroundTasks,
 ):
-    category_to_update = get_category_by_id(category_id)
+    """
+        If category name or slug is changed, its copies in products are
+        rewritten in background, job status: /categories/sync-jobs/{sync_job_id}
+    """
+    category_to_update = await get_category_by_id_async(category_id)
     updated_model = category_to_update.copy(update = {**new_category.dict(exclude_unset=True)})
-    updated_category = updated_model.update_db()
-    return updated_category.dict()
+    updated_category = await updated_model.update_db_async()
+    response = updated_category.dict()
+    if is_category_copy_changed(category_to_update, updated_category):
+        job = await create_category_sync_job(category_id)
+        background_tasks.add_task(run_category_sync_job, job)
+        response["sync_job_id"] = job.id
+    return response
+
+@router.get("/categories/sync-jobs/{job_id}")
+async def get_category_sync_job(
+    job_id: UUID4,
+    admin_user = Depends(get_current_admin_user),
+):
+    job = await get_category_sync_job_async(job_id)
+    return job.dict()
 
 @router.delete("/categories/{category_id}")
 async def delete_category(
     request: Request,
     category_id: UUID4,
 ):
-    category = get_category_by_id(category_id)
+    category = await get_category_by_id_async(category_id)
     if not category:
         return {
             "status": "failure",
             "msg": "category not exists"
         }
-    category.delete_db()
+    await category.delete_db_async()
     return {
         "status": "success"
     }
 
 # products
 @router.get("/")
-async def get_products():
-    products_dict = db_provider.products_db.find({})
-    products = [BaseProduct(**product).dict() for product in products_dict]
-    return {
-        "status": "success",
-        "products": products,
-    }
+async def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge = 1, le = 100),
+    cursor: Optional[UUID4] = None,
+    fields: Optional[str] = None,
+):
+    """
+        All products, or, if [limit] is passed, page of products
+        after [cursor] with [fields] only (comma separated)
+    """
+    async def build():
+        if limit:
+            products, next_cursor = await get_products_page_async(
+                limit = limit,
+                cursor = cursor,
+                fields = parse_product_list_fields(fields),
+            )
+            return {
+                "status": "success",
+                "products": [resolve_imgsrc(product) for product in products],
+                "next_cursor": next_cursor,
+            }
+        if catalog.snapshot:
+            products = catalog.snapshot.products_list
+        else:
+            products_cursor = async_db_provider.products_db.find({})
+            products = [resolve_imgsrc(BaseProduct(**product).dict()) async for product in products_cursor]
+        return {
+            "status": "success",
+            "products": products,
+        }
+    return await conditional_json_response(
+        request,
+        build,
+        cache_control = CATALOG_CACHE_CONTROL,
+        cache = get_catalog_cache(),
+        version = catalog.version,
+    )
 
 @router.get("/search")
 async def search_products(
     request: Request,
-    search: str
+    search: str,
+    limit: int = Query(10, ge = 1, le = 50),
 ):
     if not search:
         return []
-    products = search_products_by_name(search)
-    return products
+    products = await search_products_by_name_async(search, limit = limit)
+    return [resolve_imgsrc(product) for product in products]
+
+@router.get("/suggest")
+async def suggest_products(
+    search: str,
+    limit: int = Query(settings.SUGGEST_TOP_K, ge = 1, le = settings.SUGGEST_TOP_K),
+):
+    """
+        Autocomplete for search box: products and categories, that have
+        word starting with [search], ordered by popularity (id, name, slug, type)
+    """
+    return suggest_index.suggest(search, limit = limit)
+
+@router.get("/by-slug/{slug}")
+async def get_product_by_slug(
+    slug: str,
+):
+    product = await get_product_by_slug_async(slug)
+    return resolve_imgsrc(product.dict())
 
 @router.get("/{product_id}")
 async def get_product(
     product_id: UUID4,
 ):
-    product = get_product_by_id(product_id)
+    product = await get_product_by_id_async(product_id)
     if product:
-        return product.dict()
+        return resolve_imgsrc(product.dict())
 
 @router.post("/")
 async def create_product(
     product: BaseProductCreate,
 ):
     new_product = BaseProduct(**product.dict())
-    new_product.insert_db()
+    await new_product.insert_db_async()
     return new_product.dict()
 
+@router.post("/import")
+async def import_products(
+    file: UploadFile = File(...),
+    admin_user = Depends(get_current_admin_user),
+):
+    """
+        create or update products from .xlsx or .csv file.
+        First row - columns: slug, name, description, price, sale_price,
+        weight, imgsrc, categories (comma separated category slugs).
+        Products are matched by slug (by name, if slug is empty).
+        Returns counts and per-row errors
+    """
+    report = await run_in_threadpool(import_products_file, file.file, file.filename)
+    if report["created"] or report["updated"]:
+        await bump_catalog_version_async()
+    return report
+
 @router.patch("/{product_id}")
 async def update_product(
     request: Request,
     product_id: UUID4,
     new_product: BaseProductUpdate,
 ):
-    product_to_update = get_product_by_id(product_id)
+    product_to_update = await get_product_by_id_async(product_id)
 #   print('new product is', new_p:roduct)
     updated = product_to_update.copy(update = {**new_product.dict(exclude_unset=True)})
     updated_model = BaseProduct(**updated.dict(by_alias=True))
 #   print('updated model is', updated_model)
-    updated_product = updated_model.update_db(request)
+    updated_product = await updated_model.update_db_async()
 #   print('updated product is', updated_product)
     if updated_product:
         return updated_product.dict()
@@ -152,8 +339,8 @@ async def delete_product(
     request: Request,
     product_id: UUID4,
 ):
-    product = get_product_by_id(product_id)
-    product.delete_db()
+    product = await get_product_by_id_async(product_id)
+    await product.delete_db_async()
     return {
         "status": "success"
     }
@@ -0,0 +1,206 @@
+import bisect
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from .models import BaseProduct, BaseCategory
+from .catalog import catalog, CatalogSnapshot
+
+
+_non_word_re = re.compile(r"[^\w]+")
+
+# field weights, used to rank products
+NAME_WEIGHT = 3.0
+CATEGORY_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+# bonus, if product name starts with search query
+NAME_PREFIX_BONUS = 2.0
+# match weights of query token
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+SIMILAR_MATCH = 0.6
+# min trigrams similarity of query token and index token (typos)
+MIN_SIMILARITY = 0.4
+MAX_PREFIX_TOKENS = 50
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """ lowercase (russian too), ё -> е, punctuation -> spaces """
+    if not text:
+        return ""
+    text = text.lower().replace("ё", "е")
+    return _non_word_re.sub(" ", text).strip()
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return normalize_text(text).split()
+
+def get_trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductSearchIndex:
+    """
+        In-memory inverted index over product names, descriptions and category names.
+        Updated incrementally from catalog snapshot: only changed products are reindexed
+    """
+
+    def __init__(self):
+        # product id -> indexed (name, description, category names)
+        self.signatures: Dict[UUID, Tuple] = {}
+        # product id -> normalized name
+        self.names: Dict[UUID, str] = {}
+        # token -> {product id: weight}
+        self.postings: Dict[str, Dict[UUID, float]] = {}
+        # product id -> tokens, to remove product from postings
+        self.product_tokens: Dict[UUID, Set[str]] = {}
+        # trigram -> tokens
+        self.trigram_tokens: Dict[str, Set[str]] = defaultdict(set)
+        self._sorted_tokens: Optional[List[str]] = None
+        self.ready = False
+
+    # indexing
+
+    def get_signature(self, product: BaseProduct, categories: Dict[UUID, BaseCategory]) -> Tuple:
+        category_names = []
+        for category in product.categories or []:
+            # current category name from catalog, embedded copy can be stale
+            if category.id and category.id in categories:
+                category_names.append(categories[category.id].name)
+            else:
+                category_names.append(category.name)
+        return (product.name, product.description or "", tuple(category_names))
+
+    def add_token(self, token: str, product_id: UUID, weight: float):
+        if token not in self.postings:
+            self.postings[token] = {}
+            for trigram in get_trigrams(token):
+                self.trigram_tokens[trigram].add(token)
+            self._sorted_tokens = None
+        postings = self.postings[token]
+        postings[product_id] = postings.get(product_id, 0) + weight
+        self.product_tokens.setdefault(product_id, set()).add(token)
+
+    def add_product(self, product_id: UUID, signature: Tuple):
+        name, description, category_names = signature
+        self.signatures[product_id] = signature
+        self.names[product_id] = normalize_text(name)
+        for token in tokenize(name):
+            self.add_token(token, product_id, NAME_WEIGHT)
+        for category_name in category_names:
+            for token in tokenize(category_name):
+                self.add_token(token, product_id, CATEGORY_WEIGHT)
+        for token in tokenize(description):
+            self.add_token(token, product_id, DESCRIPTION_WEIGHT)
+
+    def remove_product(self, product_id: UUID):
+        self.signatures.pop(product_id, None)
+        self.names.pop(product_id, None)
+        for token in self.product_tokens.pop(product_id, set()):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[token]
+                for trigram in get_trigrams(token):
+                    self.trigram_tokens[trigram].discard(token)
+                    if not self.trigram_tokens[trigram]:
+                        del self.trigram_tokens[trigram]
+                self._sorted_tokens = None
+
+    def update_products(self, products: Dict[UUID, BaseProduct], categories: Dict[UUID, BaseCategory]) -> int:
+        """ reindex only added, changed and removed products, returns changed count """
+        changed = 0
+        for product_id in list(self.signatures):
+            if product_id not in products:
+                self.remove_product(product_id)
+                changed += 1
+        for product_id, product in products.items():
+            signature = self.get_signature(product, categories)
+            if self.signatures.get(product_id) == signature:
+                continue
+            self.remove_product(product_id)
+            self.add_product(product_id, signature)
+            changed += 1
+        self.ready = True
+        return changed
+
+    async def update_from_snapshot(self, snapshot: CatalogSnapshot):
+        changed = self.update_products(snapshot.products, snapshot.categories)
+        print('product search index updated, changed products', changed)
+
+    # search
+
+    @property
+    def sorted_tokens(self) -> List[str]:
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self.postings)
+        return self._sorted_tokens
+
+    def get_prefix_tokens(self, prefix: str) -> List[str]:
+        tokens = self.sorted_tokens
+        result = []
+        index = bisect.bisect_left(tokens, prefix)
+        while index < len(tokens) and tokens[index].startswith(prefix) and len(result) < MAX_PREFIX_TOKENS:
+            result.append(tokens[index])
+            index += 1
+        return result
+
+    def get_similar_tokens(self, query_token: str) -> Dict[str, float]:
+        query_trigrams = get_trigrams(query_token)
+        common_counts: Dict[str, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for token in self.trigram_tokens.get(trigram, ()):
+                common_counts[token] += 1
+        similar = {}
+        for token, common in common_counts.items():
+            similarity = common / len(query_trigrams | get_trigrams(token))
+            if similarity >= MIN_SIMILARITY:
+                similar[token] = similarity
+        return similar
+
+    def match_tokens(self, query_token: str) -> Dict[str, float]:
+        """ index tokens, that match query token, with match weight """
+        matches = {}
+        for token in self.get_prefix_tokens(query_token):
+            matches[token] = EXACT_MATCH if token == query_token else PREFIX_MATCH
+        # typos fallback
+        if not matches and len(query_token) >= 3:
+            for token, similarity in self.get_similar_tokens(query_token).items():
+                matches[token] = SIMILAR_MATCH * similarity
+        return matches
+
+    def search(self, query: str, limit: int = 10) -> List[UUID]:
+        """ product ids, ranked by relevance, all query words must match """
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        scores: Optional[Dict[UUID, float]] = None
+        for query_token in query_tokens:
+            token_scores: Dict[UUID, float] = {}
+            for token, match_weight in self.match_tokens(query_token).items():
+                for product_id, weight in self.postings[token].items():
+                    score = weight * match_weight
+                    if score > token_scores.get(product_id, 0):
+                        token_scores[product_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {
+                    product_id: scores[product_id] + score
+                    for product_id, score in token_scores.items() if product_id in scores
+                }
+            if not scores:
+                return []
+        normalized_query = " ".join(query_tokens)
+        for product_id in scores:
+            if self.names.get(product_id, "").startswith(normalized_query):
+                scores[product_id] += NAME_PREFIX_BONUS
+        ranked = sorted(scores.items(), key = lambda item: (-item[1], self.names.get(item[0], "")))
+        return [product_id for product_id, _ in ranked[:limit]]
+
+product_search_index = ProductSearchIndex()
+
+catalog.reload_listeners.append(product_search_index.update_from_snapshot)
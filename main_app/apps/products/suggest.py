@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from config import settings
+
+from .catalog import catalog, CatalogSnapshot
+from .search import normalize_text
+
+from database.main_db import async_db_provider
+
+
+logger = logging.getLogger(__name__)
+
+# max indexed prefix length, longer queries are cut
+MAX_PREFIX_LENGTH = 32
+
+
+class TrieNode:
+    __slots__ = ("children", "entries", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "TrieNode"] = {}
+        # entries indexes, passing through node (only while building)
+        self.entries = set()
+        # precomputed top-k payloads
+        self.top: List[dict] = []
+
+
+class SuggestTrie:
+    """
+        Prefix trie over product and category names (every word start is indexed),
+        with top-k suggestions precomputed for every prefix
+    """
+
+    def __init__(self, top_k: int):
+        self.top_k = top_k
+        self.root = TrieNode()
+        self.size = 0
+
+    @staticmethod
+    def get_keys(name: str) -> List[str]:
+        """ name and its suffixes from every word start """
+        words = normalize_text(name).split()
+        return [" ".join(words[i:])[:MAX_PREFIX_LENGTH] for i in range(len(words))]
+
+    def build(self, entries: List[dict], weights: List[float]):
+        for index, entry in enumerate(entries):
+            for key in self.get_keys(entry["name"]):
+                node = self.root
+                for char in key:
+                    node = node.children.setdefault(char, TrieNode())
+                    node.entries.add(index)
+        # precompute top-k for every node
+        order = lambda index: (-weights[index], entries[index]["name"])
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.top = [entries[index] for index in sorted(node.entries, key = order)[:self.top_k]]
+            node.entries = set()
+            self.size += 1
+            stack.extend(node.children.values())
+
+    def suggest(self, query: str, limit: int) -> List[dict]:
+        prefix = normalize_text(query)[:MAX_PREFIX_LENGTH]
+        if not prefix:
+            return []
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top[:limit]
+
+
+async def get_products_popularity() -> Dict[UUID, float]:
+    """ ordered quantity of products for last SUGGEST_POPULARITY_DAYS """
+    date_from = datetime.utcnow() - timedelta(days = settings.SUGGEST_POPULARITY_DAYS)
+    pipeline = [
+        {"$match": {"date_created": {"$gte": date_from}}},
+        {"$unwind": "$cart.line_items"},
+        {"$group": {
+            "_id": "$cart.line_items.product_id",
+            "count": {"$sum": "$cart.line_items.quantity"},
+        }},
+    ]
+    popularity = {}
+    async for item in async_db_provider.orders_db.aggregate(pipeline):
+        popularity[item["_id"]] = item["count"]
+    return popularity
+
+
+class SuggestIndex:
+    """
+        Trie is rebuilt from catalog snapshot on every reload, with cached products popularity.
+        Popularity (orders aggregation) is refreshed separately, every SUGGEST_POPULARITY_TTL
+    """
+
+    def __init__(self):
+        self.trie = SuggestTrie(top_k = settings.SUGGEST_TOP_K)
+        self.popularity: Dict[UUID, float] = {}
+        self.popularity_updated: Optional[datetime] = None
+        self._watch_task = None
+
+    async def refresh_popularity(self):
+        """ on failure previous popularity is kept """
+        try:
+            popularity = await get_products_popularity()
+        except Exception:
+            logger.exception("suggest popularity refresh failed")
+            return
+        self.popularity = popularity
+        self.popularity_updated = datetime.utcnow()
+        if catalog.snapshot is not None:
+            self.rebuild(catalog.snapshot)
+
+    async def rebuild_from_snapshot(self, snapshot: CatalogSnapshot):
+        """ catalog reload listener """
+        self.rebuild(snapshot)
+
+    def rebuild(self, snapshot: CatalogSnapshot):
+        popularity = self.popularity
+        entries = []
+        weights = []
+        for product in snapshot.products.values():
+            entries.append({
+                "id": str(product.id),
+                "name": product.name,
+                "slug": product.slug,
+                "type": "product",
+            })
+            weights.append(popularity.get(product.id, 0))
+        for category in snapshot.categories.values():
+            entries.append({
+                "id": str(category.id),
+                "name": category.name,
+                "slug": category.slug,
+                "type": "category",
+            })
+            # categories are weighted by popularity of their products,
+            # and are shown before products with the same weight
+            category_weight = sum(
+                popularity.get(product_id, 0)
+                for product_id in snapshot.category_products.get(category.id, [])
+            )
+            weights.append(category_weight + 0.5)
+        trie = SuggestTrie(top_k = settings.SUGGEST_TOP_K)
+        trie.build(entries, weights)
+        self.trie = trie
+        print('suggest trie rebuilt, nodes', trie.size)
+
+    def suggest(self, query: str, limit: int = 10) -> List[dict]:
+        return self.trie.suggest(query, limit)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(settings.SUGGEST_POPULARITY_TTL)
+            await self.refresh_popularity()
+
+    def start_watch(self):
+        if self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(self.watch())
+
+    def stop_watch(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+suggest_index = SuggestIndex()
+
+catalog.reload_listeners.append(suggest_index.rebuild_from_snapshot)
@@ -0,0 +1,79 @@
+import hashlib
+import inspect
+import json
+from typing import Any, Callable, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from database.cache import TTLCache
+
+
+# Cache-Control policies
+# catalog: revalidate on every app open, etag check is cheap (catalog version)
+CATALOG_CACHE_CONTROL = "private, no-cache"
+# site data: changes rarely, can be used without revalidation for some time
+SITE_CACHE_CONTROL = "private, max-age=300"
+
+
+def make_etag(body: bytes) -> str:
+    """ strong etag from encoded response body """
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*":
+            return True
+        if value.startswith("W/"):
+            value = value[2:]
+        if value == etag:
+            return True
+    return False
+
+def encode_json(content: Any) -> bytes:
+    # same encoding, as starlette JSONResponse
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+async def conditional_json_response(
+    request: Request,
+    build: Callable[[], Any],
+    cache_control: str,
+    cache: Optional[TTLCache] = None,
+    version: Any = None,
+) -> Response:
+    """
+        JSON response with ETag and Cache-Control, 304 if If-None-Match matches.
+        Encoded body and etag are kept in [cache] by request url, while [version]
+        of data is the same, so unchanged data is not loaded and encoded again.
+        [build] can be sync (runs in threadpool) or async function.
+    """
+    key = request.url.path + "?" + request.url.query
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None and cached[0] == version:
+        _, etag, body = cached
+    else:
+        if inspect.iscoroutinefunction(build):
+            content = await build()
+        else:
+            content = await run_in_threadpool(build)
+        body = encode_json(content)
+        etag = make_etag(body)
+        if cache is not None:
+            cache.set(key, (version, etag, body))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code = 304, headers = headers)
+    return Response(content = body, media_type = "application/json", headers = headers)
@@ -0,0 +1,12 @@
+from pymongo import IndexModel, ASCENDING
+
+# indexes, that are applied on startup (see database/indexes.py)
+site_indexes = {
+    # global App-Token dependency lookup
+    "app_clients_db": [
+        IndexModel([("access_token", ASCENDING)]),
+    ],
+    "menu_links_db": [
+        IndexModel([("display_order", ASCENDING)]),
+    ],
+}
@@ -22,7 +22,14 @@ from apps.orders.models import order_statuses
 
 from apps.notifications.call_request import send_call_request_admin_notification
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider, get_pool_stats
+from database.indexes import get_indexes_usage_stats
+
+from dependencies import revoke_app_client, app_clients_cache
+
+from database.cache import TTLCache
+from .http_cache import conditional_json_response, SITE_CACHE_CONTROL
+from .static_assets import static_url, resolve_imgsrc
 # order exceptions
 
 router = APIRouter(
@@ -30,12 +37,48 @@ router = APIRouter(
     tags = ["site"],
 )
 
+# encoded site responses with etags. Cleared on local writes,
+# changes from other workers (or made in db directly) are visible after ttl
+site_responses_cache = TTLCache(maxsize = 64, ttl = settings.SITE_RESPONSES_CACHE_TTL)
+
 @router.get("/order-statusses")
 def get_order_statusses(
     admin_user = Depends(get_current_admin_user)
 ):
     return order_statuses
 
+# db indexes usage stats (admin)
+@router.get("/db-indexes")
+async def get_db_indexes(
+    admin_user = Depends(get_current_admin_user)
+):
+    stats = await get_indexes_usage_stats(async_db_provider)
+    return stats
+
+# mongo connection pool metrics of the worker, that handles request (admin)
+@router.get("/db-pool-stats")
+def get_db_pool_stats(
+    admin_user = Depends(get_current_admin_user)
+):
+    return get_pool_stats()
+
+# revoke App-Token client (admin)
+@router.post("/app-clients/revoke")
+async def revoke_app_client_token(
+    access_token: str = Body(..., embed = True),
+    admin_user = Depends(get_current_admin_user)
+):
+    is_revoked = await revoke_app_client(access_token)
+    return {
+        "status": "success" if is_revoked else "failure",
+    }
+
+@router.get("/app-clients/cache-stats")
+def get_app_clients_cache_stats(
+    admin_user = Depends(get_current_admin_user)
+):
+    return app_clients_cache.get_stats()
+
 @router.get("/pickup-addresses",
 # response_model = List[PickupAddress]
 )
@@ -49,12 +92,11 @@ def add_pickup_address(
     pickup_address: PickupAddress,
 ):
     pickup_address.save_db()
+    site_responses_cache.clear()
     return pickup_address.dict()
 
 
-@router.get("/checkout-common-info")
-def get_checkout_common_info(
-):
+def build_checkout_common_info():
     delivery_methods = get_delivery_methods()
     payment_methods = get_payment_methods()
     pickup_addresses = get_pickup_addresses()
@@ -65,16 +107,25 @@ def get_checkout_common_info(
         "pickup_addresses": pickup_addresses,
     }
 
-@router.get('/common-info')
-def get_common_info(
+@router.get("/checkout-common-info")
+async def get_checkout_common_info(
+    request: Request,
 ):
+    return await conditional_json_response(
+        request,
+        build_checkout_common_info,
+        cache_control = SITE_CACHE_CONTROL,
+        cache = site_responses_cache,
+    )
+
+def build_common_info():
     menu_links_cursor = db_provider.menu_links_db.find({}).sort("display_order", 1)
     menu_links = [MenuLink(**menu_link).dict() for menu_link in menu_links_cursor]
     #print('menu links are', menu_links)
     location_address = "Здесь будет адрес доставки"
     delivery_phone = "+79781111111"
     delivery_phone_display = "7 978 111 11 11"
-    main_logo_link = settings.base_static_url + "logo_variant.png"
+    main_logo_link = static_url("logo_variant.png")
     map_delivery_location_link = "https://yandex.ru/map-widget/v1/?um=constructor%3A9b116676061cfe4fdf22efc726567c5f21c243f18367e2b8a207accdae7e4786&amp;source=constructor"
     return {
         "main_logo_link": main_logo_link,
@@ -85,30 +136,60 @@ def get_common_info(
         "map_delivery_location_link": map_delivery_location_link,
     }
 
-# get main sliders
-@router.get("/main-sliders")
-def get_main_sliders(
+@router.get('/common-info')
+async def get_common_info(
+    request: Request,
 ):
+    return await conditional_json_response(
+        request,
+        build_common_info,
+        cache_control = SITE_CACHE_CONTROL,
+        cache = site_responses_cache,
+    )
+
+def build_main_sliders():
     main_sliders_cursor = db_provider.main_sliders_db.find({})
-    main_sliders = [MainSliderItem(**slider).dict() for slider in main_sliders_cursor]
+    main_sliders = [resolve_imgsrc(MainSliderItem(**slider).dict()) for slider in main_sliders_cursor]
     return main_sliders
 
-
-# get stocks
-@router.get("/stocks")
-def get_stocks(
+# get main sliders
+@router.get("/main-sliders")
+async def get_main_sliders(
+    request: Request,
 ):
+    return await conditional_json_response(
+        request,
+        build_main_sliders,
+        cache_control = SITE_CACHE_CONTROL,
+        cache = site_responses_cache,
+    )
+
+
+def build_stocks():
     stocks_dict = db_provider.stocks_db.find({})
-    stocks = [StockItem(**stock).dict() for stock in stocks_dict]
+    stocks = [resolve_imgsrc(StockItem(**stock).dict()) for stock in stocks_dict]
     return {
         "stocks": stocks,
     }
+
+# get stocks
+@router.get("/stocks")
+async def get_stocks(
+    request: Request,
+):
+    return await conditional_json_response(
+        request,
+        build_stocks,
+        cache_control = SITE_CACHE_CONTROL,
+        cache = site_responses_cache,
+    )
 # add stock
 @router.post("/stocks")
 def create_stock(
     stock: StockItem,
 ):
     stock.save_db()
+    site_responses_cache.clear()
     return stock.dict()
 
 @router.post("/request-call")
@@ -0,0 +1,236 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+from typing import Dict, List, Optional, Union
+
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:
+    # only gzip variants are built
+    brotli = None
+
+from config import settings
+
+
+# build output (hashed names manifest and precompressed files), inside static dir
+BUILD_DIR = ".build"
+MANIFEST_FILE = "manifest.json"
+HASH_LENGTH = 12
+# text assets, images / fonts are already compressed
+COMPRESSIBLE_EXTENSIONS = {
+    ".css", ".js", ".mjs", ".json", ".map", ".svg", ".html", ".txt", ".xml", ".ico", ".ttf", ".eot",
+}
+MIN_COMPRESS_SIZE = 1024
+# variant is kept only if it is smaller than original * ratio
+MAX_COMPRESS_RATIO = 0.9
+# preferred encoding first
+ENCODINGS_EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def get_hashed_name(path: str, content_hash: str) -> str:
+    """ img/logo.png -> img/logo.<hash>.png """
+    root, extension = os.path.splitext(path)
+    return f"{root}.{content_hash}{extension}"
+
+def get_file_hash(full_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(full_path, "rb") as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()[:HASH_LENGTH]
+
+def write_file_atomic(full_path: str, content: bytes):
+    # several workers can build on startup at the same time
+    os.makedirs(os.path.dirname(full_path), exist_ok = True)
+    tmp_path = f"{full_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    os.replace(tmp_path, full_path)
+
+def compress_file(full_path: str, build_path: str) -> List[str]:
+    """ write precompressed variants of file, returns their encodings """
+    with open(full_path, "rb") as file:
+        content = file.read()
+    variants = {"gzip": gzip.compress(content, compresslevel = 9, mtime = 0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content, quality = 11)
+    encodings = []
+    for encoding, extension in ENCODINGS_EXTENSIONS.items():
+        compressed = variants.get(encoding)
+        if compressed is None or len(compressed) > len(content) * MAX_COMPRESS_RATIO:
+            continue
+        write_file_atomic(build_path + extension, compressed)
+        encodings.append(encoding)
+    return encodings
+
+
+class StaticManifest:
+    """
+        Content-hashed names of static files and their precompressed variants.
+        files: path (relative to static dir) -> {hashed, size, mtime, encodings}
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files: Dict[str, dict] = {}
+        # hashed path -> path
+        self.hashed: Dict[str, str] = {}
+
+    @property
+    def build_directory(self) -> str:
+        return os.path.join(self.directory, BUILD_DIR)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.build_directory, MANIFEST_FILE)
+
+    def set_files(self, files: Dict[str, dict]):
+        self.files = files
+        self.hashed = {entry["hashed"]: path for path, entry in files.items()}
+
+    def load(self) -> bool:
+        try:
+            with open(self.manifest_path) as file:
+                self.set_files(json.load(file)["files"])
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def iter_files(self):
+        for root, dirs, filenames in os.walk(self.directory):
+            # build output and hidden dirs are skipped
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in filenames:
+                if filename.startswith("."):
+                    continue
+                full_path = os.path.join(root, filename)
+                yield os.path.relpath(full_path, self.directory).replace(os.sep, "/"), full_path
+
+    def build(self) -> int:
+        """ hash and compress new and changed files, returns count of processed files """
+        if not os.path.isdir(self.directory):
+            return 0
+        self.load()
+        files = {}
+        processed = 0
+        for path, full_path in self.iter_files():
+            stat_result = os.stat(full_path)
+            entry = self.files.get(path)
+            if (
+                entry and entry["size"] == stat_result.st_size
+                and entry["mtime"] == stat_result.st_mtime
+                and all(
+                    os.path.exists(self.get_variant_path(entry, encoding))
+                    for encoding in entry["encodings"]
+                )
+            ):
+                files[path] = entry
+                continue
+            hashed = get_hashed_name(path, get_file_hash(full_path))
+            encodings = []
+            if (
+                os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS
+                and stat_result.st_size >= MIN_COMPRESS_SIZE
+            ):
+                encodings = compress_file(full_path, os.path.join(self.build_directory, hashed))
+            files[path] = {
+                "hashed": hashed,
+                "size": stat_result.st_size,
+                "mtime": stat_result.st_mtime,
+                "encodings": encodings,
+            }
+            processed += 1
+        self.set_files(files)
+        write_file_atomic(self.manifest_path, json.dumps({"files": files}).encode("utf-8"))
+        return processed
+
+    def get_variant_path(self, entry: dict, encoding: str) -> str:
+        return os.path.join(self.build_directory, entry["hashed"] + ENCODINGS_EXTENSIONS[encoding])
+
+    def get_url(self, path: str) -> str:
+        """ hashed path (relative to static dir), path itself if it is not in manifest """
+        entry = self.files.get(path)
+        return entry["hashed"] if entry else path
+
+static_manifest = StaticManifest(settings.STATIC_DIR)
+
+
+def static_url(path: str) -> str:
+    return settings.base_static_url + static_manifest.get_url(path)
+
+def resolve_static_url(url: Optional[str]) -> Optional[str]:
+    """ static file link (absolute with base_static_url, or relative) -> hashed link """
+    if not url:
+        return url
+    base = settings.base_static_url
+    if base and url.startswith(base):
+        return base + static_manifest.get_url(url[len(base):])
+    return static_manifest.get_url(url)
+
+def resolve_imgsrc(item: dict) -> dict:
+    """ rewrite imgsrc (list or single link) of serialized item to hashed links """
+    imgsrc: Union[list, str, None] = item.get("imgsrc")
+    if isinstance(imgsrc, list):
+        item["imgsrc"] = [resolve_static_url(url) if isinstance(url, str) else url for url in imgsrc]
+    elif isinstance(imgsrc, str):
+        item["imgsrc"] = resolve_static_url(imgsrc)
+    return item
+
+def get_accepted_encodings(scope: Scope) -> List[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"accept-encoding":
+            encodings = value.decode("latin-1").lower()
+            return [
+                encoding.split(";")[0].strip() for encoding in encodings.split(",")
+                if not encoding.strip().endswith(";q=0")
+            ]
+    return []
+
+
+class HashedStaticFiles(StaticFiles):
+    """
+        Serves hashed paths from manifest with immutable caching and
+        precompressed variant, accepted by client. Other paths - as StaticFiles
+    """
+
+    def __init__(self, *args, manifest: StaticManifest, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        original_path = self.manifest.hashed.get(path.replace(os.sep, "/"))
+        if original_path is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+        entry = self.manifest.files[original_path]
+        media_type = mimetypes.guess_type(original_path)[0] or "application/octet-stream"
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        if entry["encodings"]:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = get_accepted_encodings(scope)
+            for encoding in entry["encodings"]:
+                if encoding in accepted:
+                    headers["Content-Encoding"] = encoding
+                    return FileResponse(
+                        self.manifest.get_variant_path(entry, encoding),
+                        media_type = media_type,
+                        headers = headers,
+                    )
+        return FileResponse(
+            os.path.join(self.manifest.directory, original_path),
+            media_type = media_type,
+            headers = headers,
+        )
+
+
+if __name__ == "__main__":
+    # build step: python -m apps.site.static_assets [static dir]
+    manifest = StaticManifest(sys.argv[1] if len(sys.argv) > 1 else settings.STATIC_DIR)
+    print('static files processed', manifest.build(), 'total', len(manifest.files))
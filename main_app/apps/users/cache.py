@@ -0,0 +1,16 @@
+from typing import Optional
+
+from config import settings
+from database.cache import TTLCache
+
+
+# username -> BaseUserDB, used by get_current_user / get_current_user_silent.
+# cache is per worker, so changes made by other workers are visible after ttl
+users_cache = TTLCache(
+    maxsize = settings.USERS_CACHE_MAXSIZE,
+    ttl = settings.USERS_CACHE_TTL,
+)
+
+def invalidate_user_cache(username: Optional[str]):
+    if username:
+        users_cache.delete(username)
@@ -0,0 +1,17 @@
+from pymongo import IndexModel, ASCENDING
+
+# indexes, that are applied on startup (see database/indexes.py)
+users_indexes = {
+    "users_db": [
+        IndexModel([("username", ASCENDING)]),
+    ],
+    "users_addresses_db": [
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    "refresh_tokens_db": [
+        # mongo removes refresh tokens, when they are expired
+        IndexModel([("expires", ASCENDING)], expireAfterSeconds = 0),
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("family_id", ASCENDING)]),
+    ],
+}
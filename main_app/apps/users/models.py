@@ -7,12 +7,36 @@ from datetime import datetime, date
 
 from pymongo import ReturnDocument
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
+
+from .cache import users_cache, invalidate_user_cache
 
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
+class RefreshToken(BaseModel):
+    """
+        Issued refresh token (jti of refresh jwt).
+        Used token is marked as revoked and replaced by new one (rotation),
+        tokens of one login share family_id.
+    """
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex, alias="_id")
+    family_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    user_id: UUID4
+    username: str
+    date_created: datetime = Field(default_factory=datetime.utcnow)
+    expires: datetime
+    revoked: bool = False
+    replaced_by: Optional[str] = None
+
+    class Config:
+        allow_population_by_field_name = True
 
 class TokenData(BaseModel):
     username: Optional[str] = None
@@ -69,14 +93,33 @@ class BaseUser(BaseModel):
     class Config:
         allow_population_by_field_name = True
 
+    def set_cached(self, updated_user: Optional[dict]):
+        """
+            after write: cache written user, so authentication sees it right away
+            (invalidation before write lets concurrent request cache old user)
+        """
+        invalidate_user_cache(self.username)
+        if updated_user:
+            users_cache.set(updated_user["username"], BaseUserDB(**updated_user))
+
     def update_db(self):
         updated_user = db_provider.users_db.find_one_and_update(
             {"_id": self.id},
             {"$set": self.dict(by_alias=True)},
             return_document=ReturnDocument.AFTER
         )
+        self.set_cached(updated_user)
         return updated_user 
 
+    async def update_db_async(self):
+        updated_user = await async_db_provider.users_db.find_one_and_update(
+            {"_id": self.id},
+            {"$set": self.dict(by_alias=True)},
+            return_document=ReturnDocument.AFTER
+        )
+        self.set_cached(updated_user)
+        return updated_user
+
 class BaseUserCreate(BaseModel):
     username: str
     password: str
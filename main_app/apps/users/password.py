@@ -1,6 +1,13 @@
 #passlib package
 from passlib.context import CryptContext
 
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import settings
+
 
 # passlib context and verify and hash logic
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -11,3 +18,86 @@ def verify_password(plain_password, hashed_password):
 # create hashed_password from passed password
 def get_password_hash(password):
 	return pwd_context.hash(password)
+
+
+# bcrypt is cpu bound, so async routes run it in dedicated executor,
+# to not block event loop. Concurrency is limited per worker, so login
+# storms can't take all cpu from other requests
+password_executor = ThreadPoolExecutor(
+	max_workers = settings.PASSWORD_HASH_WORKERS,
+	thread_name_prefix = "password",
+)
+# semaphore is created lazily, inside running event loop
+_password_semaphore = None
+
+class PasswordTimings:
+	""" hash / verify timing metrics (per worker) """
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.stats = {}
+
+	def add(self, operation: str, wait_ms: float, run_ms: float):
+		with self._lock:
+			stat = self.stats.setdefault(operation, {
+				"count": 0,
+				"wait_total_ms": 0.0,
+				"wait_max_ms": 0.0,
+				"run_total_ms": 0.0,
+				"run_max_ms": 0.0,
+			})
+			stat["count"] += 1
+			stat["wait_total_ms"] += wait_ms
+			stat["wait_max_ms"] = max(stat["wait_max_ms"], wait_ms)
+			stat["run_total_ms"] += run_ms
+			stat["run_max_ms"] = max(stat["run_max_ms"], run_ms)
+
+	def get_stats(self) -> dict:
+		with self._lock:
+			result = {}
+			for operation, stat in self.stats.items():
+				count = stat["count"]
+				result[operation] = {
+					"count": count,
+					"wait_avg_ms": round(stat["wait_total_ms"] / count, 3),
+					"wait_max_ms": round(stat["wait_max_ms"], 3),
+					"run_avg_ms": round(stat["run_total_ms"] / count, 3),
+					"run_max_ms": round(stat["run_max_ms"], 3),
+				}
+			return result
+
+password_timings = PasswordTimings()
+
+def get_password_semaphore() -> asyncio.Semaphore:
+	global _password_semaphore
+	if _password_semaphore is None:
+		_password_semaphore = asyncio.Semaphore(
+			settings.PASSWORD_HASH_CONCURRENCY or settings.PASSWORD_HASH_WORKERS
+		)
+	return _password_semaphore
+
+def run_timed(func, *args):
+	""" runs in executor thread, so run time doesn't include executor queue """
+	started = time.perf_counter()
+	result = func(*args)
+	return result, (time.perf_counter() - started) * 1000
+
+async def run_password_operation(operation: str, func, *args):
+	started = time.perf_counter()
+	async with get_password_semaphore():
+		loop = asyncio.get_running_loop()
+		result, run_ms = await loop.run_in_executor(password_executor, run_timed, func, *args)
+	finished = time.perf_counter()
+	password_timings.add(
+		operation,
+		# semaphore and executor queue
+		wait_ms = (finished - started) * 1000 - run_ms,
+		run_ms = run_ms,
+	)
+	return result
+
+# verify password, off the event loop
+async def verify_password_async(plain_password, hashed_password):
+	return await run_password_operation("verify", verify_password, plain_password, hashed_password)
+# create hashed_password, off the event loop
+async def get_password_hash_async(password):
+	return await run_password_operation("hash", get_password_hash, password)
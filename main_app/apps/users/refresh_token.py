@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from jose import JWTError
+from pydantic import UUID4
+from pymongo import ReturnDocument
+
+from config import settings
+
+from .models import BaseUser, RefreshToken
+from .jwt import create_access_token, decode_token
+from .user_exceptions import InvalidRefreshToken
+
+from database.main_db import async_db_provider
+
+
+REFRESH_TOKEN_TYPE = "refresh"
+
+
+def create_user_access_token(username: str) -> str:
+    access_token_expires = timedelta(minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data = {"sub": username}, expires_delta=access_token_expires,
+        JWT_SECRET_KEY = settings.JWT_SECRET_KEY, JWT_ALGORITHM = settings.JWT_ALGORITHM
+    )
+    return access_token
+
+def encode_refresh_token(refresh_token: RefreshToken) -> str:
+    return create_access_token(
+        data = {
+            "sub": refresh_token.username,
+            "type": REFRESH_TOKEN_TYPE,
+            "jti": refresh_token.id,
+        },
+        expires_delta = refresh_token.expires - datetime.utcnow(),
+        JWT_SECRET_KEY = settings.JWT_SECRET_KEY, JWT_ALGORITHM = settings.JWT_ALGORITHM
+    )
+
+def decode_refresh_token(token: str) -> dict:
+    """ signature and expiration check only, without db """
+    try:
+        payload = decode_token(token, settings.JWT_SECRET_KEY, [settings.JWT_ALGORITHM])
+    except JWTError:
+        raise InvalidRefreshToken
+    if payload.get("type") != REFRESH_TOKEN_TYPE or not payload.get("jti"):
+        raise InvalidRefreshToken
+    return payload
+
+async def create_refresh_token(
+    user: BaseUser,
+    family_id: Optional[str] = None,
+) -> Tuple[RefreshToken, str]:
+    refresh_token = RefreshToken(
+        user_id = user.id,
+        username = user.username,
+        expires = datetime.utcnow() + timedelta(days = settings.JWT_REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    if family_id:
+        refresh_token.family_id = family_id
+    await async_db_provider.refresh_tokens_db.insert_one(
+        refresh_token.dict(by_alias=True)
+    )
+    return refresh_token, encode_refresh_token(refresh_token)
+
+async def rotate_refresh_token(token: str) -> Tuple[str, str]:
+    """
+        Mark passed refresh token as used and issue new access and refresh tokens.
+        If already used token is passed again, whole token family is revoked
+        (token was probably stolen).
+        Returns (access_token, refresh_token)
+    """
+    payload = decode_refresh_token(token)
+    used_token_dict = await async_db_provider.refresh_tokens_db.find_one_and_update(
+        {"_id": payload["jti"], "revoked": False},
+        {"$set": {"revoked": True}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not used_token_dict:
+        reused_token_dict = await async_db_provider.refresh_tokens_db.find_one(
+            {"_id": payload["jti"]}
+        )
+        if reused_token_dict:
+            await revoke_refresh_token_family(reused_token_dict["family_id"])
+        raise InvalidRefreshToken
+    used_token = RefreshToken(**used_token_dict)
+    user = BaseUser(_id = used_token.user_id, username = used_token.username)
+    new_token, encoded_token = await create_refresh_token(user, family_id = used_token.family_id)
+    await async_db_provider.refresh_tokens_db.update_one(
+        {"_id": used_token.id},
+        {"$set": {"replaced_by": new_token.id}},
+    )
+    access_token = create_user_access_token(used_token.username)
+    return access_token, encoded_token
+
+async def revoke_refresh_token_family(family_id: str):
+    await async_db_provider.refresh_tokens_db.update_many(
+        {"family_id": family_id, "revoked": False},
+        {"$set": {"revoked": True}},
+    )
+
+async def revoke_refresh_token(token: str):
+    """ logout: revoke refresh token and all tokens rotated from it """
+    payload = decode_refresh_token(token)
+    token_dict = await async_db_provider.refresh_tokens_db.find_one(
+        {"_id": payload["jti"]}
+    )
+    if not token_dict:
+        raise InvalidRefreshToken
+    await revoke_refresh_token_family(token_dict["family_id"])
+
+async def revoke_user_refresh_tokens(user_id: UUID4):
+    await async_db_provider.refresh_tokens_db.update_many(
+        {"user_id": user_id, "revoked": False},
+        {"$set": {"revoked": True}},
+    )
@@ -11,29 +11,30 @@ from pymongo import ReturnDocument
 # import config (env variables)
 from config import settings
 
-from .models import BaseUser, BaseUserDB, BaseUserCreate, BaseUserVerify, BaseUserUpdate, BaseUserUpdatePassword, Token, TokenData, BaseUserExistVerified, BaseUserRestore, BaseUserRestoreVerify, UserDeliveryAddress, UserDeleteDeliveryAddress
+from .models import BaseUser, BaseUserDB, BaseUserCreate, BaseUserVerify, BaseUserUpdate, BaseUserUpdatePassword, Token, TokenData, BaseUserExistVerified, BaseUserRestore, BaseUserRestoreVerify, UserDeliveryAddress, UserDeleteDeliveryAddress, TokenRefresh
 # models 
-from .user import get_current_active_user, get_current_user, get_user, authenticate_user, get_user_register, get_user_verify, get_user_restore, get_user_restore_verify, get_current_admin_user, search_users_by_username, get_user_delivery_addresses
+from .user import get_current_active_user, get_current_user, get_user, authenticate_user_async, get_user_register, get_user_verify, get_user_restore, get_user_restore_verify, get_current_admin_user, search_users_by_username_async, get_user_delivery_addresses_async
 
-from .password import get_password_hash
+from .password import get_password_hash_async, password_timings
 
 from .jwt import create_access_token
 
+from .refresh_token import create_refresh_token, rotate_refresh_token, revoke_refresh_token, revoke_user_refresh_tokens
+
 # user exceptions
 from .user_exceptions import IncorrectUsernameOrPassword, NotSendVerificationCode
 
-# user password hash and decode methods
-from .password import get_password_hash
-
 # verification send sms methods
 # from .verification import send_verification_sms_code
 from apps.sms.smsc import smsc_send_call_code
 
-from apps.orders.orders import get_orders_by_user_id
+from apps.orders.orders import get_orders_by_user_id_async
+
+from .user import get_current_admin_user, get_user_by_id_async
 
-from .user import get_current_admin_user, get_user_by_id
+from database.main_db import async_db_provider
 
-from database.main_db import db_provider
+from .cache import users_cache, invalidate_user_cache
 
 # https://fastapi.tiangolo.com/tutorial/bigger-applications/
 
@@ -49,7 +50,7 @@ async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     print('get token request')
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user_async(form_data.username, form_data.password)
     if not user:
         raise IncorrectUsernameOrPassword
     access_token_expires = timedelta(minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -57,9 +58,38 @@ async def login_for_access_token(
         data = {"sub": user.username}, expires_delta=access_token_expires,
         JWT_SECRET_KEY = settings.JWT_SECRET_KEY, JWT_ALGORITHM = settings.JWT_ALGORITHM
     )
+    _, refresh_token = await create_refresh_token(user)
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+@router.post("/token/refresh")
+async def refresh_access_token(
+    token_info: TokenRefresh,
+):
+    """
+        Exchange refresh token for new access and refresh tokens
+        (passed refresh token can't be used again).
+        No password check and user query, only jwt signature check
+        and refresh token rotation in db
+    """
+    access_token, refresh_token = await rotate_refresh_token(token_info.refresh_token)
     return {
         "access_token": access_token,
         "token_type": "bearer",
+        "refresh_token": refresh_token,
+    }
+
+@router.post("/token/revoke")
+async def revoke_token(
+    token_info: TokenRefresh,
+):
+    """ Revoke refresh token (logout) """
+    await revoke_refresh_token(token_info.refresh_token)
+    return {
+        "status": "success",
     }
 
 
@@ -69,7 +99,7 @@ async def check_exist_verified_user(
     ):
     exist_verified = False
     print('user info is', user_info)
-    user = db_provider.users_db.find_one({"username": user_info.username})
+    user = await async_db_provider.users_db.find_one({"username": user_info.username})
     if user and user["is_verified"]:
         exist_verified = True
     return {
@@ -106,7 +136,8 @@ async def register_user(
     # code = 1234
     user_to_register.otp = str(code)
     # db logic to insert user
-    db_provider.users_db.insert_one(user_to_register.dict(by_alias=True))
+    await async_db_provider.users_db.insert_one(user_to_register.dict(by_alias=True))
+    invalidate_user_cache(user_to_register.username)
     # eof db logic to insert user
     return {
         "status": "success",
@@ -138,10 +169,11 @@ async def restore_user(
     # save otp code to user model
     user_to_restore.otp = code  
     # db logic to insert user
-    db_provider.users_db.update_one(
+    await async_db_provider.users_db.update_one(
         {"_id": user_to_restore.id},
         {"$set": user_to_restore.dict(by_alias=True)}
     )
+    invalidate_user_cache(user_to_restore.username)
     # eof db logic to insert user
     return {
         "status": "success",
@@ -167,9 +199,11 @@ async def verify_register_user(
         data = {"sub": verified_user.username}, expires_delta=access_token_expires,
         JWT_SECRET_KEY = settings.JWT_SECRET_KEY, JWT_ALGORITHM = settings.JWT_ALGORITHM
     )
+    _, refresh_token = await create_refresh_token(verified_user)
     return {
         "user": verified_user,
         "access_token": access_token,
+        "refresh_token": refresh_token,
     }
 
 @router.post("/restore-verify")
@@ -186,17 +220,21 @@ async def verify_restore_user(
         - Passed otp code dont match
         -------------
         - set user otp code to None if validate verified_user success
+        - revoke user refresh tokens (account is being restored)
         - generate access_token and return it
     """
-
+    # sessions, opened before restore (maybe with stolen tokens), can't be refreshed
+    await revoke_user_refresh_tokens(verified_user.id)
     access_token_expires = timedelta(minutes=settings.JWT_ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data = {"sub": verified_user.username}, expires_delta=access_token_expires,
         JWT_SECRET_KEY = settings.JWT_SECRET_KEY, JWT_ALGORITHM = settings.JWT_ALGORITHM
     )
+    _, refresh_token = await create_refresh_token(verified_user)
     return {
         "access_token": access_token,
         "token_type": "bearer",
+        "refresh_token": refresh_token,
     }
 
 
@@ -205,13 +243,16 @@ async def update_user_password(
     update_user_info: BaseUserUpdatePassword,
     current_user: BaseUser = Depends(get_current_active_user),
     ):
-    new_password = get_password_hash(update_user_info.password)
+    new_password = await get_password_hash_async(update_user_info.password)
     # update user in db
-    updated_user = db_provider.users_db.find_one_and_update({"_id": current_user.id}, {
+    updated_user = await async_db_provider.users_db.find_one_and_update({"_id": current_user.id}, {
         "$set": {
             "hashed_password": new_password,
         }
     })
+    invalidate_user_cache(current_user.username)
+    # sessions with old password can't be refreshed anymore
+    await revoke_user_refresh_tokens(current_user.id)
     # check if updated info 'updatedExisting' = true ? 
     return updated_user
 # update user info route
@@ -222,9 +263,10 @@ async def update_user(
     ):
     update_data = update_user_info.dict(exclude_unset = True, by_alias=True)
     # update user in db
-    updated_user = db_provider.users_db.find_one_and_update({"_id": current_user.id}, {
+    updated_user = await async_db_provider.users_db.find_one_and_update({"_id": current_user.id}, {
         "$set": update_data,
     }, return_document=ReturnDocument.AFTER)
+    invalidate_user_cache(current_user.username)
     # check if updated info 'updatedExisting' = true ? 
     return updated_user
 
@@ -233,7 +275,7 @@ async def user_delivery_addresses(
         request: Request,
         current_user: BaseUserDB = Depends(get_current_active_user)
     ):
-    addresses = get_user_delivery_addresses(current_user.id)
+    addresses = await get_user_delivery_addresses_async(current_user.id)
     return addresses
 
 
@@ -245,27 +287,27 @@ async def create_user_delivery_address(
     print('current user is', current_user)
     new_address.user_id = current_user.id
     print('new address is', new_address)
-    db_provider.users_addresses_db.insert_one(
+    await async_db_provider.users_addresses_db.insert_one(
         new_address.dict(by_alias=True)
     )
     print('added new address')
-    return get_user_delivery_addresses(current_user.id)
+    return await get_user_delivery_addresses_async(current_user.id)
 
 @router.delete("/me/delivery-address")
 async def delete_user_delivery_address(
     delete_address: UserDeleteDeliveryAddress,
     current_user: BaseUserDB = Depends(get_current_active_user)
     ):
-    db_provider.users_addresses_db.delete_one(
+    await async_db_provider.users_addresses_db.delete_one(
         {"_id": delete_address.id}
     )
-    return get_user_delivery_addresses(current_user.id)
+    return await get_user_delivery_addresses_async(current_user.id)
 
 @router.get("/me/orders/")
 async def user_orders(
     current_user: BaseUserDB = Depends(get_current_active_user),
 ):
-    user_orders = get_orders_by_user_id(current_user.id)
+    user_orders = await get_orders_by_user_id_async(current_user.id)
     return {
         "orders": user_orders,
     }
@@ -277,6 +319,20 @@ async def auth_admin(
 ):
     return current_admin_user.dict(exclude={"hashed_password"})
 
+# authenticated users cache hit/miss stats (admin)
+@router.get("/cache-stats")
+async def users_cache_stats(
+    current_admin_user: BaseUserDB = Depends(get_current_admin_user)
+):
+    return users_cache.get_stats()
+
+# password hash / verify timings (admin)
+@router.get("/password-stats")
+async def password_stats(
+    current_admin_user: BaseUserDB = Depends(get_current_admin_user)
+):
+    return password_timings.get_stats()
+
 # search user by username
 @router.get("/search")
 async def search_users(
@@ -284,7 +340,7 @@ async def search_users(
 ):
     if not search:
         return []
-    users = search_users_by_username(search)
+    users = await search_users_by_username_async(search)
     return users
 
 # admin get user delivery addresses
@@ -293,7 +349,7 @@ async def admin_get_user_delivery_addresses(
         user_id: UUID4,
         admin_user = Depends(get_current_admin_user),
     ):
-    addresses = get_user_delivery_addresses(user_id)
+    addresses = await get_user_delivery_addresses_async(user_id)
     return addresses
 
 @router.post("/{user_id}/delivery-address")
@@ -302,16 +358,13 @@ async def admin_create_user_delivery_address(
     new_address: UserDeliveryAddress,
     admin_user = Depends(get_current_admin_user)
     ):
-    current_user = get_user_by_id(user_id)
+    current_user = await get_user_by_id_async(user_id, silent = True)
     if not current_user:
         return None
     new_address.user_id = current_user.id
-    db_provider.users_addresses_db.insert_one(
+    await async_db_provider.users_addresses_db.insert_one(
         new_address.dict(by_alias=True)
     )
-    delivery_addresses = db_provider.users_addresses_db.find(
-        {"user_id": current_user.id}
-    )
-    addresses = [UserDeliveryAddress(**address).dict() for address in delivery_addresses]
+    addresses = await get_user_delivery_addresses_async(current_user.id)
     return addresses
 
@@ -1,5 +1,6 @@
 from fastapi import Depends, Request, FastAPI
 from pydantic import UUID4
+from typing import Optional
 from jose import JWTError, jwt
 
 
@@ -9,11 +10,13 @@ from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 from .jwt import decode_token, create_access_token
 
-from .password import verify_password, get_password_hash
+from .password import verify_password, get_password_hash, verify_password_async, get_password_hash_async
 
 from .user_exceptions import InvalidAuthenticationCredentials, IncorrectVerificationCode, InactiveUser, UserAlreadyExist, UserNotExist, UserDeliveryAddressNotExist, UserNotAdmin
 
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
+
+from .cache import users_cache, invalidate_user_cache
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/token", auto_error = False)
@@ -29,6 +32,14 @@ def authenticate_user(username: str, password: str):
         return False
     return user
 
+async def authenticate_user_async(username: str, password: str):
+    user = await get_user_async(username)
+    if not user:
+        return False
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+    return user
+
 def get_user(username: str) -> BaseUserDB:
     user_dict = db_provider.users_db.find_one({"username": username})
     #print('user dict is', user_dict)
@@ -36,6 +47,12 @@ def get_user(username: str) -> BaseUserDB:
         raise
     return BaseUserDB(**user_dict)
 
+async def get_user_async(username: str) -> Optional[BaseUserDB]:
+    user_dict = await async_db_provider.users_db.find_one({"username": username})
+    if not user_dict:
+        return None
+    return BaseUserDB(**user_dict)
+
 
 def get_user_by_id(
     user_id: UUID4, 
@@ -50,10 +67,37 @@ def get_user_by_id(
         raise
     return BaseUser(**user_dict)
 
+async def get_user_cached(username: str) -> Optional[BaseUserDB]:
+    """ get_user_async with per-worker cache, for authentication dependencies """
+    user = users_cache.get(username)
+    if user is None:
+        user = await get_user_async(username)
+        if user is None:
+            return None
+        users_cache.set(username, user)
+    # copy, so handlers can't modify cached object
+    return user.copy()
+
+async def get_user_by_id_async(
+    user_id: UUID4,
+    silent: bool = False,
+    ):
+    user_dict = await async_db_provider.users_db.find_one(
+        {"_id": user_id}
+    )
+    if not user_dict:
+        if silent:
+            return None
+        raise UserNotExist
+    return BaseUser(**user_dict)
+
 async def get_current_user_silent(token: str = Depends(oauth2_scheme)):
     print('get current user silent, token is', token)
     try:
         payload = decode_token(token, settings.JWT_SECRET_KEY, [settings.JWT_ALGORITHM])
+        # refresh tokens can only be used in /users/token/refresh
+        if payload.get("type") == "refresh":
+            raise JWTError
         username = payload.get("sub")
         if username is None:
             return None
@@ -67,7 +111,7 @@ async def get_current_user_silent(token: str = Depends(oauth2_scheme)):
     if not token_data.username:
         return None
         # raise InvalidAuthenticationCredentials
-    user = get_user(username = token_data.username)
+    user = await get_user_cached(username = token_data.username)
     if user is None:
         return None
         # raise InvalidAuthenticationCredentials
@@ -76,6 +120,9 @@ async def get_current_user_silent(token: str = Depends(oauth2_scheme)):
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = decode_token(token, settings.JWT_SECRET_KEY, [settings.JWT_ALGORITHM])
+        # refresh tokens can only be used in /users/token/refresh
+        if payload.get("type") == "refresh":
+            raise JWTError
         username = payload.get("sub")
         if username is None:
             raise InvalidAuthenticationCredentials
@@ -84,7 +131,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise InvalidAuthenticationCredentials
     if not token_data.username:
         raise InvalidAuthenticationCredentials
-    user = get_user(username = token_data.username)
+    user = await get_user_cached(username = token_data.username)
     if user is None:
         raise InvalidAuthenticationCredentials
     return user
@@ -101,8 +148,8 @@ def get_current_admin_user(current_user: BaseUser = Depends(get_current_user)):
     return current_user
 
 
-def get_user_register(user_info: BaseUserCreate):
-    user = db_provider.users_db.find_one({"username": user_info.username})
+async def get_user_register(user_info: BaseUserCreate):
+    user = await async_db_provider.users_db.find_one({"username": user_info.username})
     # if user exist and verified, we raise exist exception
     if user:
         user = BaseUser(**user)
@@ -112,9 +159,10 @@ def get_user_register(user_info: BaseUserCreate):
         # to recreate in future
         else:
             #print('found user when register, but it is not verified, so, delete it')
-            db_provider.users_db.delete_one({"_id": user.id})
+            await async_db_provider.users_db.delete_one({"_id": user.id})
+            invalidate_user_cache(user.username)
 
-    hashed_password = get_password_hash(user_info.password)
+    hashed_password = await get_password_hash_async(user_info.password)
     user_to_register = BaseUserDB(**user_info.dict(), hashed_password = hashed_password)
     return user_to_register
 
@@ -141,6 +189,7 @@ def get_user_verify(user_info: BaseUserVerify):
     user.is_active = True
     user.otp = None
     db_provider.users_db.update_one({"_id": user.id}, {"$set": user.dict(by_alias=True)})
+    invalidate_user_cache(user.username)
 
     return BaseUser(**user.dict())
 #   if user.is_verified:
@@ -155,6 +204,7 @@ def get_user_restore_verify(user_info: BaseUserRestoreVerify) -> BaseUser:
     # set user otp code to None 
     user.otp = None
     db_provider.users_db.update_one({"_id": user.id}, {"$set": user.dict(by_alias=True)})
+    invalidate_user_cache(user.username)
     return BaseUser(**user.dict())
 
 def get_user_delivery_addresses(user_id: UUID4):
@@ -164,6 +214,13 @@ def get_user_delivery_addresses(user_id: UUID4):
     addresses = [UserDeliveryAddress(**address).dict() for address in addresses_dict]
     return addresses
 
+async def get_user_delivery_addresses_async(user_id: UUID4):
+    addresses_cursor = async_db_provider.users_addresses_db.find(
+        {"user_id": user_id}
+    )
+    addresses = [UserDeliveryAddress(**address).dict() async for address in addresses_cursor]
+    return addresses
+
 def get_user_delivery_address_by_id(delivery_address_id) -> UserDeliveryAddress:
     address_dict = db_provider.users_addresses_db.find_one(
         { "_id": delivery_address_id }
@@ -185,3 +242,13 @@ def search_users_by_username(search_string: str):
     users = [BaseUser(**user).dict() for user in users_dict]
     return users
 
+async def search_users_by_username_async(search_string: str):
+    users_cursor = async_db_provider.users_db.find(
+        {
+            "username": {
+                "$regex": search_string
+            }
+        }
+    ).limit(10)
+    users = [BaseUser(**user).dict() async for user in users_cursor]
+    return users
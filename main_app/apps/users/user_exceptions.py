@@ -46,4 +46,7 @@ class UserNotAdmin(HTTPException):
 		self.status_code = 400
 		self.detail = "User is not admin user"
 
-
+class InvalidRefreshToken(HTTPException):
+	def __init__(self):
+		self.status_code = status.HTTP_401_UNAUTHORIZED
+		self.detail = "Invalid refresh token"
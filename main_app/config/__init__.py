@@ -1,5 +1,6 @@
 from pydantic import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 import os
 import sys
@@ -8,11 +9,53 @@ class Settings(BaseSettings):
     app_name: str = "Some app name"
     JWT_SECRET_KEY: str = ''
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 1
+    JWT_REFRESH_TOKEN_EXPIRE_DAYS: int = 30
     JWT_SESSION_KEY: str = ''
     JWT_SESSION_TOKEN_EXPIRE_MINUTES: int = 1
     JWT_ALGORITHM: str = "HS256"
     DB_URL: str = ''
     DB_NAME: str = ''
+    # create declared indexes on startup (database/indexes.py)
+    DB_ENSURE_INDEXES: bool = True
+    # mongo client pool (per gunicorn worker, for each of sync and async clients)
+    DB_MAX_POOL_SIZE: int = 100
+    DB_MIN_POOL_SIZE: int = 0
+    DB_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = None
+    DB_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    # App-Token clients cache (seconds)
+    APP_CLIENT_CACHE_TTL: int = 60
+    APP_CLIENT_NEGATIVE_CACHE_TTL: int = 10
+    APP_CLIENT_CACHE_MAXSIZE: int = 1024
+    # authenticated users cache (seconds)
+    USERS_CACHE_TTL: int = 30
+    USERS_CACHE_MAXSIZE: int = 10000
+    # bcrypt executor threads and max concurrent hash/verify per worker
+    # (concurrency defaults to executor threads, so admitted jobs don't queue)
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_CONCURRENCY: Optional[int] = None
+    # how often worker checks catalog version, changed by other workers (seconds)
+    CATALOG_POLL_INTERVAL: float = 5
+    # products suggest (autocomplete)
+    SUGGEST_TOP_K: int = 10
+    SUGGEST_POPULARITY_DAYS: int = 90
+    # how often worker refreshes products popularity for suggest (seconds)
+    SUGGEST_POPULARITY_TTL: int = 60 * 60
+    # cart write retries (reload and reapply), if cart was changed concurrently
+    CART_WRITE_RETRIES: int = 5
+    # carts are removed, if they were not modified for (days)
+    CART_GUEST_TTL_DAYS: int = 7
+    CART_USER_TTL_DAYS: int = 30
+    # expired carts sweeper interval (seconds) and count of kept sweep results
+    CART_SWEEP_INTERVAL: int = 60 * 60
+    CART_SWEEP_HISTORY: int = 48
+    # static files dir, its hashed names manifest and precompressed variants
+    # are built on startup (or with: python -m apps.site.static_assets)
+    STATIC_DIR: str = "static"
+    STATIC_BUILD_ON_STARTUP: bool = True
+    # products import: rows, validated and written with one bulk_write
+    PRODUCTS_IMPORT_BATCH_SIZE: int = 500
+    # site responses (common info, sliders, stocks) cache (seconds)
+    SITE_RESPONSES_CACHE_TTL: int = 60
     DEBUG_MODE: bool = True
     send_order_notifications: bool = False
     # telegram section
@@ -0,0 +1,95 @@
+from typing import Dict, List
+
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+from .main_db import AsyncDbProvider, db_collections
+
+# per-app index declarations
+from apps.products.indexes import products_indexes
+from apps.users.indexes import users_indexes
+from apps.cart.indexes import cart_indexes
+from apps.orders.indexes import orders_indexes
+from apps.coupons.indexes import coupons_indexes
+from apps.site.indexes import site_indexes
+
+
+def get_indexes_registry() -> Dict[str, List[IndexModel]]:
+    """ Merge per-app declarations into {provider collection attr: [IndexModel]} """
+    registry: Dict[str, List[IndexModel]] = {}
+    apps_indexes = [
+        products_indexes,
+        users_indexes,
+        cart_indexes,
+        orders_indexes,
+        coupons_indexes,
+        site_indexes,
+    ]
+    for app_indexes in apps_indexes:
+        for collection_attr, indexes in app_indexes.items():
+            registry.setdefault(collection_attr, []).extend(indexes)
+    return registry
+
+indexes_registry = get_indexes_registry()
+
+
+async def get_existing_index_names(collection) -> set:
+    index_names = set()
+    async for index in collection.list_indexes():
+        if index["name"] != "_id_":
+            index_names.add(index["name"])
+    return index_names
+
+async def ensure_indexes(provider: AsyncDbProvider) -> dict:
+    """
+        Create all declared indexes (create_index is idempotent)
+        and print report about missing (created now) and extra
+        (existing in db, but not declared) indexes
+    """
+    report = {}
+    for collection_attr in db_collections:
+        collection = getattr(provider, collection_attr)
+        indexes = indexes_registry.get(collection_attr, [])
+        declared = {index.document["name"] for index in indexes}
+        existing = await get_existing_index_names(collection)
+        error = None
+        if indexes:
+            try:
+                await collection.create_indexes(indexes)
+            except OperationFailure as e:
+                error = str(e)
+        report[collection.name] = {
+            "missing": sorted(declared - existing),
+            "extra": sorted(existing - declared),
+            "error": error,
+        }
+    print_indexes_report(report)
+    return report
+
+def print_indexes_report(report: dict):
+    print('db indexes report:')
+    for collection_name, info in report.items():
+        if info["missing"]:
+            print(f'  {collection_name}: created missing indexes {info["missing"]}')
+        if info["extra"]:
+            print(f'  {collection_name}: extra (not declared) indexes {info["extra"]}')
+        if info["error"]:
+            print(f'  {collection_name}: failed to create indexes, {info["error"]}')
+
+async def get_indexes_usage_stats(provider: AsyncDbProvider) -> dict:
+    """ $indexStats for every collection: index key and usage count since server start """
+    stats = {}
+    for collection_attr in db_collections:
+        collection = getattr(provider, collection_attr)
+        declared = {index.document["name"] for index in indexes_registry.get(collection_attr, [])}
+        collection_stats = []
+        async for index_stats in collection.aggregate([{"$indexStats": {}}]):
+            collection_stats.append({
+                "name": index_stats["name"],
+                "key": index_stats["key"],
+                "declared": index_stats["name"] in declared,
+                "ops": index_stats["accesses"]["ops"],
+                "since": index_stats["accesses"]["since"],
+            })
+        stats[collection.name] = collection_stats
+    return stats
@@ -1,12 +1,16 @@
 # from fastapi import FastAPI from functools import lru_cache
-from functools import lru_cache
+import os
 
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
 
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+
 from config import settings
 
+from .pool_metrics import PoolMetricsListener
+
 from pydantic import BaseModel
 
 
@@ -32,41 +36,151 @@ class DbProvider(BaseModel):
     menu_links_db: Collection
     main_sliders_db: Collection
     bonuses_levels_db: Collection
+    refresh_tokens_db: Collection
+    catalog_meta_db: Collection
+    category_products_db: Collection
+    catalog_jobs_db: Collection
 
     class Config:
         arbitrary_types_allowed = True
 
-      
+class AsyncDbProvider(BaseModel):
+    """ Same collections as DbProvider, but backed by motor (awaitable) """
+    db_client: AsyncIOMotorClient
+    db_main: AsyncIOMotorDatabase
+
+    users_db: AsyncIOMotorCollection
+    users_addresses_db: AsyncIOMotorCollection
+    products_db: AsyncIOMotorCollection
+    categories_db: AsyncIOMotorCollection
+    carts_db: AsyncIOMotorCollection
+    coupons_db: AsyncIOMotorCollection
+    orders_db: AsyncIOMotorCollection
+    payment_methods_db: AsyncIOMotorCollection
+    delivery_methods_db: AsyncIOMotorCollection
+    pickup_addresses_db: AsyncIOMotorCollection
+    order_statuses_db: AsyncIOMotorCollection
+    stocks_db: AsyncIOMotorCollection
+    app_clients_db: AsyncIOMotorCollection
+    menu_links_db: AsyncIOMotorCollection
+    main_sliders_db: AsyncIOMotorCollection
+    bonuses_levels_db: AsyncIOMotorCollection
+    refresh_tokens_db: AsyncIOMotorCollection
+    catalog_meta_db: AsyncIOMotorCollection
+    category_products_db: AsyncIOMotorCollection
+    catalog_jobs_db: AsyncIOMotorCollection
+
+    class Config:
+        arbitrary_types_allowed = True
 
+# provider attribute -> mongo collection name
+db_collections = {
+    "users_db": "users",
+    "users_addresses_db": "users_addresses",
+    "products_db": "products",
+    "categories_db": "categories",
+    "carts_db": "carts",
+    "coupons_db": "coupons",
+    "orders_db": "orders",
+    "payment_methods_db": "payment_methods",
+    "delivery_methods_db": "delivery_methods",
+    "pickup_addresses_db": "pickup_addresses",
+    "order_statuses_db": "order_statuses",
+    "stocks_db": "stocks",
+    "app_clients_db": "app_clients",
+    "menu_links_db": "menu_links",
+    "main_sliders_db": "main_sliders",
+    "bonuses_levels_db": "bonuses_levels",
+    "refresh_tokens_db": "refresh_tokens",
+    "catalog_meta_db": "catalog_meta",
+    "category_products_db": "category_products",
+    "catalog_jobs_db": "catalog_jobs",
+}
+
+
+
+def get_client_pool_options() -> dict:
+    """ MongoClient / AsyncIOMotorClient pool options from settings """
+    return {
+        "maxPoolSize": settings.DB_MAX_POOL_SIZE,
+        "minPoolSize": settings.DB_MIN_POOL_SIZE,
+        "waitQueueTimeoutMS": settings.DB_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.DB_SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+# pool metrics of current worker process
+sync_pool_metrics = PoolMetricsListener("sync")
+async_pool_metrics = PoolMetricsListener("async")
 
-@lru_cache
 def setup_db_main() -> DbProvider:
-    print('call setup db_main function')
-    db_client  = MongoClient(settings.DB_URL)
+    print('call setup db_main function, pid', os.getpid())
+    sync_pool_metrics.reset()
+    db_client  = MongoClient(
+        settings.DB_URL,
+        event_listeners = [sync_pool_metrics],
+        **get_client_pool_options()
+    )
     db_main = db_client[settings.DB_NAME]
     db_provider = DbProvider(
                 db_client = db_client,
                 db_main = db_main,
-                users_db = db_main["users"],
-                users_addresses_db = db_main["users_addresses"],
-                products_db = db_main["products"],
-                categories_db = db_main["categories"],
-                carts_db = db_main["carts"],
-                coupons_db = db_main["coupons"],
-                orders_db = db_main["orders"],
-                payment_methods_db = db_main["payment_methods"],
-                delivery_methods_db = db_main["delivery_methods"],
-                pickup_addresses_db = db_main["pickup_addresses"],
-                order_statuses_db = db_main["order_statuses"],
-                stocks_db = db_main["stocks"],
-                app_clients_db = db_main["app_clients"],
-                menu_links_db = db_main["menu_links"],
-                main_sliders_db = db_main["main_sliders"],
-                bonuses_levels_db = db_main["bonuses_levels"],
+                **{attr: db_main[name] for attr, name in db_collections.items()}
             )
     return db_provider
 
-db_provider = setup_db_main()
+def setup_db_main_async() -> AsyncDbProvider:
+    print('call setup async db_main function, pid', os.getpid())
+    async_pool_metrics.reset()
+    db_client = AsyncIOMotorClient(
+        settings.DB_URL,
+        event_listeners = [async_pool_metrics],
+        **get_client_pool_options()
+    )
+    db_main = db_client[settings.DB_NAME]
+    async_db_provider = AsyncDbProvider(
+                db_client = db_client,
+                db_main = db_main,
+                **{attr: db_main[name] for attr, name in db_collections.items()}
+            )
+    return async_db_provider
+
+
+class LazyDbProvider:
+    """
+        Per-process handle to DbProvider / AsyncDbProvider.
+        Mongo client is created on first usage (normally in app startup hook,
+        see main.py), so it is never created in gunicorn master before
+        workers fork. If process was forked after connect, new client is created.
+    """
+
+    def __init__(self, setup_func):
+        self._setup_func = setup_func
+        self._provider = None
+        self._pid = None
+
+    def connect(self):
+        if self._provider is None or self._pid != os.getpid():
+            self._provider = self._setup_func()
+            self._pid = os.getpid()
+        return self._provider
+
+    def close(self):
+        if self._provider is not None and self._pid == os.getpid():
+            self._provider.db_client.close()
+        self._provider = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.connect(), name)
+
+db_provider = LazyDbProvider(setup_db_main)
+async_db_provider = LazyDbProvider(setup_db_main_async)
+
+def get_pool_stats() -> list:
+    return [
+        sync_pool_metrics.get_stats(),
+        async_pool_metrics.get_stats(),
+    ]
 
 
 
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+        Per-worker connection pool metrics (checkouts, waits, in-use),
+        used to size DB_MAX_POOL_SIZE against gunicorn workers count
+    """
+
+    def __init__(self, client_name: str):
+        self.client_name = client_name
+        self._lock = threading.Lock()
+        # checkout started and checked out are fired in the same thread
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.checked_in = 0
+            self.waiting = 0
+            self.max_waiting = 0
+            self.wait_time_total_ms = 0.0
+            self.wait_time_max_ms = 0.0
+            self.pool_cleared = 0
+
+    # checkout events
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def _checkout_done(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        wait_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        self.waiting = max(self.waiting - 1, 0)
+        self.wait_time_total_ms += wait_ms
+        self.wait_time_max_ms = max(self.wait_time_max_ms, wait_ms)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self._checkout_done()
+            self.checkouts += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._checkout_done()
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_in += 1
+
+    # connection events
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    # pool events
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            finished = self.checkouts + self.checkout_failures
+            return {
+                "client": self.client_name,
+                "pid": os.getpid(),
+                "connections_open": self.connections_created - self.connections_closed,
+                "connections_created": self.connections_created,
+                "in_use": self.checkouts - self.checked_in,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "wait_time_avg_ms": round(self.wait_time_total_ms / finished, 3) if finished else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max_ms, 3),
+                "pool_cleared": self.pool_cleared,
+            }
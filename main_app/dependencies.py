@@ -2,23 +2,47 @@ from fastapi import Security
 from fastapi.security.api_key import APIKeyHeader
 from fastapi import HTTPException
 
-from database.main_db import db_provider
+from config import settings
+from database.main_db import async_db_provider
+from database.cache import TTLCache
 
-import sys
 
-def get_api_app_client(
+# access_token -> True (valid client) / False (unknown token, negative cache)
+# cache is per worker, so revoked client can live in other workers up to ttl
+app_clients_cache = TTLCache(
+    maxsize = settings.APP_CLIENT_CACHE_MAXSIZE,
+    ttl = settings.APP_CLIENT_CACHE_TTL,
+)
+
+async def get_api_app_client(
     api_key_header:str = Security(APIKeyHeader(name="App-Token", auto_error=False))
     # api_key_header: str = "another_access_token_here"
 ):
-    sys.stdout.flush()
-    app_client_dict = db_provider.app_clients_db.find_one(
-        {"access_token": api_key_header}
-    )
-    sys.stdout.flush()
+    is_valid = app_clients_cache.get(api_key_header)
+    if is_valid is None:
+        app_client_dict = await async_db_provider.app_clients_db.find_one(
+            {"access_token": api_key_header}
+        )
+        is_valid = bool(app_client_dict)
+        if is_valid:
+            app_clients_cache.set(api_key_header, True)
+        else:
+            app_clients_cache.set(
+                api_key_header, False, ttl = settings.APP_CLIENT_NEGATIVE_CACHE_TTL
+            )
 
-    if not app_client_dict:
+    if not is_valid:
         raise HTTPException(
             status_code = 400,
             detail = "Incorrect auth credentials",
         )
 
+def invalidate_app_client(access_token: str):
+    app_clients_cache.delete(access_token)
+
+async def revoke_app_client(access_token: str) -> bool:
+    delete_result = await async_db_provider.app_clients_db.delete_one(
+        {"access_token": access_token}
+    )
+    invalidate_app_client(access_token)
+    return delete_result.deleted_count > 0
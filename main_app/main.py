@@ -1,8 +1,7 @@
 import uvicorn
 from fastapi import FastAPI, Depends, Request
 from starlette.middleware.cors import CORSMiddleware
-# import staticfiles
-from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
 # app config (env variables)
 from config import settings
@@ -15,18 +14,29 @@ from apps.cart import router as cart_router
 from apps.coupons import router as coupons_router
 from apps.site import router as site_router
 from apps.cart.cart import create_session_id
+from apps.cart.expiry import carts_sweeper
+from apps.site.static_assets import HashedStaticFiles, static_manifest
 # eof routes importing
 from dependencies import get_api_app_client
+from apps.users.password import password_executor
+from apps.products.catalog import catalog
+from apps.products.suggest import suggest_index
+from apps.products.category_products import ensure_category_products_async
 
 # import database
-from database.main_db import db_provider
+from database.main_db import db_provider, async_db_provider
+from database.indexes import ensure_indexes
 
 # include all necessary routes
 app = FastAPI(
     dependencies=[Depends(get_api_app_client)]
 )
-# mount static files folder
-app.mount("/static", StaticFiles(directory="static"), name = "static")
+# mount static files folder (hashed files from manifest are served with immutable caching)
+app.mount(
+    "/static",
+    HashedStaticFiles(directory = settings.STATIC_DIR, manifest = static_manifest),
+    name = "static",
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,12 +61,34 @@ app.include_router(site_router.router)
 async def startup_db_client():
     print("startup db client")
     print('setting are', settings)
-    pass
+    # create mongo clients inside worker process (after gunicorn fork)
+    db_provider.connect()
+    async_db_provider.connect()
+    if settings.DB_ENSURE_INDEXES:
+        await ensure_indexes(async_db_provider)
+    if settings.STATIC_BUILD_ON_STARTUP:
+        processed = await run_in_threadpool(static_manifest.build)
+        print('static files processed', processed)
+    else:
+        static_manifest.load()
+    await ensure_category_products_async()
+    # suggest weights are cached, before catalog load builds suggest trie
+    await suggest_index.refresh_popularity()
+    # per-worker catalog snapshot
+    await catalog.load()
+    catalog.start_watch()
+    suggest_index.start_watch()
+    carts_sweeper.start_watch()
 
 
 @app.on_event('shutdown')
 async def shutdown_db_client():
-    db_provider.db_client.close()
+    catalog.stop_watch()
+    suggest_index.stop_watch()
+    carts_sweeper.stop_watch()
+    db_provider.close()
+    async_db_provider.close()
+    password_executor.shutdown(wait = False)
 
 
 
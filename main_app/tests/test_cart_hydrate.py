@@ -0,0 +1,47 @@
+import asyncio
+import uuid
+
+from apps.cart import models as cart_models
+from apps.cart.models import BaseCart, LineItem
+from apps.coupons.models import BaseCoupon, CouponTypeEnum
+from apps.products.models import BaseProduct
+
+
+def test_gift_products_are_loaded_once(monkeypatch):
+    product = BaseProduct(name = "product", price = 500)
+    gifts = [BaseProduct(name = "gift 1", price = 0), BaseProduct(name = "gift 2", price = 10)]
+    catalog = {p.id: p for p in [product] + gifts}
+    calls = []
+
+    async def get_products_by_ids_async(products_ids, silent = False):
+        calls.append(list(products_ids))
+        return {p_id: catalog[p_id] for p_id in products_ids if p_id in catalog}
+
+    coupon = BaseCoupon(
+        name = "gift", code = "gift", type = CouponTypeEnum.gift, amount = 0,
+        products_ids = [gift.id for gift in gifts],
+    )
+
+    async def get_coupon_by_id_async(coupon_code, silent = False):
+        return coupon if coupon_code == coupon.code else None
+
+    monkeypatch.setattr(cart_models, "get_products_by_ids_async", get_products_by_ids_async)
+    monkeypatch.setattr(cart_models, "get_coupon_by_id_async", get_coupon_by_id_async)
+    cart = BaseCart(line_items = [LineItem(product_id = product.id)], coupons = [coupon])
+    cart = BaseCart.from_db(cart.to_db_dict())
+
+    async def request():
+        await cart.hydrate_async()
+        await cart.count_amount_async()
+
+    asyncio.run(request())
+    assert len(calls) == 1
+    assert [gift.id for gift in cart.coupon_gifts] == [gift.id for gift in gifts]
+    assert cart.total_amount == 500
+
+    # other gift coupon, applied in the same request, loads its products
+    other_coupon = coupon.copy(update = {"id": uuid.uuid4(), "products_ids": [gifts[0].id]})
+    cart.coupons = [other_coupon]
+    asyncio.run(cart.count_amount_async())
+    assert len(calls) == 2
+    assert [gift.id for gift in cart.coupon_gifts] == [gifts[0].id]
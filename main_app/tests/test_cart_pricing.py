@@ -0,0 +1,234 @@
+import uuid
+from typing import Dict, List, Optional
+
+import pytest
+
+from apps.cart.compact_carts import get_compact_cart
+from apps.cart.models import BaseCart, LineItem
+from apps.coupons.models import BaseCoupon, CouponTypeEnum
+from apps.products.models import BaseProduct
+
+
+def make_product(price: int, sale_price: Optional[int] = None) -> BaseProduct:
+    return BaseProduct(name = f"product {price}", price = price, sale_price = sale_price)
+
+def make_coupon(type: CouponTypeEnum, amount: int, products: List[BaseProduct]) -> BaseCoupon:
+    return BaseCoupon(
+        name = type.value,
+        code = type.value,
+        type = type,
+        amount = amount,
+        exclude_sale_items = False,
+        products_ids = [product.id for product in products],
+    )
+
+def count_amount_reference(cart: BaseCart, gift_products: Optional[List[BaseProduct]] = None):
+    """ count_amount before incremental pricing: every line item is summed """
+    base = 0
+    discount = 0
+    promo_discount = 0
+    if cart.bonuses_used:
+        cart.check_can_pay_with_bonuses()
+    if len(cart.coupons) > 0:
+        cart.apply_coupons(gift_products = gift_products)
+    for line_item in cart.line_items:
+        base += line_item.get_base_price()
+        discount += line_item.get_sale_discount()
+        promo_discount += line_item.get_promo_discount()
+    total = base - discount - promo_discount
+    if cart.bonuses_used and cart.pay_with_bonuses:
+        total -= cart.pay_with_bonuses
+    if cart.promo_amount and cart.promo_amount > 0:
+        total -= cart.promo_amount
+    cart.base_amount = base
+    cart.discount_amount = discount
+    cart.total_amount = total
+    cart.count_bonuses_to_apply()
+
+def get_amounts(cart: BaseCart) -> dict:
+    return {
+        "base_amount": cart.base_amount,
+        "discount_amount": cart.discount_amount,
+        "promo_discount_amount": cart.promo_discount_amount,
+        "promo_amount": cart.promo_amount,
+        "total_amount": cart.total_amount,
+        "pay_with_bonuses": cart.pay_with_bonuses,
+        "bonuses_used": cart.bonuses_used,
+        "bonuses_to_apply": cart.bonuses_to_apply,
+        "promo_prices": [line_item.promo_price for line_item in cart.line_items],
+        "coupon_gifts": [product.id for product in cart.coupon_gifts],
+    }
+
+def reload(cart: BaseCart, products: Dict[uuid.UUID, BaseProduct]) -> BaseCart:
+    """ cart, as next request loads it: stored document + coupons + products from catalog """
+    coupons = list(cart.coupons)
+    cart = BaseCart.from_db(cart.to_db_dict())
+    cart.set_coupons(coupons)
+    for line_item in cart.line_items:
+        line_item.product = products[line_item.product_id]
+    return cart
+
+
+PRODUCTS = {
+    "plain": make_product(500),
+    "other": make_product(320),
+    "sale": make_product(1000, sale_price = 800),
+    "sale_other": make_product(250, sale_price = 199),
+}
+PRODUCTS_BY_ID = {product.id: product for product in PRODUCTS.values()}
+GIFTS = [make_product(0), make_product(10)]
+
+
+def add_line(cart: BaseCart, name: str):
+    cart.line_items.append(LineItem(product_id = PRODUCTS[name].id, product = PRODUCTS[name]))
+
+def update_line(cart: BaseCart, index: int, quantity: int):
+    cart.line_items[index].quantity = quantity
+
+def remove_line(cart: BaseCart, index: int):
+    cart.line_items.pop(index)
+
+
+MUTATIONS = {
+    "add": lambda cart, names: add_line(cart, names[-1]),
+    "update": lambda cart, names: update_line(cart, 0, 3),
+    "remove": lambda cart, names: remove_line(cart, 0),
+}
+
+PRODUCTS_SETS = {
+    "without_sale": ["plain", "other"],
+    "with_sale": ["sale", "plain", "sale_other"],
+}
+
+COUPONS = {
+    "no_coupon": None,
+    "per_item": (CouponTypeEnum.per_item_discount, 50),
+    "percentage": (CouponTypeEnum.percentage_discount, 10),
+    "per_total": (CouponTypeEnum.per_total_discount, 100),
+    "gift": (CouponTypeEnum.gift, 0),
+}
+
+
+def make_cart(names: List[str], coupon: Optional[tuple], pay_with_bonuses: int) -> BaseCart:
+    cart = BaseCart()
+    for name in names[:-1]:
+        add_line(cart, name)
+    if coupon is not None:
+        coupon_type, amount = coupon
+        coupon_products = GIFTS if coupon_type == CouponTypeEnum.gift else [PRODUCTS[name] for name in names]
+        cart.coupons = [make_coupon(coupon_type, amount, coupon_products)]
+    if pay_with_bonuses:
+        cart.bonuses_used = True
+        cart.pay_with_bonuses = pay_with_bonuses
+    return cart
+
+
+@pytest.mark.parametrize("mutation", MUTATIONS)
+@pytest.mark.parametrize("products_set", PRODUCTS_SETS)
+@pytest.mark.parametrize("coupon", COUPONS)
+@pytest.mark.parametrize("pay_with_bonuses", [0, 150])
+def test_count_amount_equals_full_count(mutation, products_set, coupon, pay_with_bonuses):
+    names = PRODUCTS_SETS[products_set]
+    gift_products = GIFTS if coupon == "gift" else None
+    cart = make_cart(names, COUPONS[coupon], pay_with_bonuses)
+    cart.count_amount(gift_products = gift_products)
+    # total of previous request, bonuses are checked against it
+    cart.total_amount = cart.total_amount or 1000
+
+    cart = reload(cart, PRODUCTS_BY_ID)
+    MUTATIONS[mutation](cart, names)
+    reference = cart.copy(deep = True)
+
+    cart.count_amount(gift_products = gift_products)
+    count_amount_reference(reference, gift_products = gift_products)
+    assert get_amounts(cart) == get_amounts(reference)
+
+    # next request without changes keeps amounts
+    cart = reload(cart, PRODUCTS_BY_ID)
+    reference = cart.copy(deep = True)
+    cart.count_amount(gift_products = gift_products)
+    count_amount_reference(reference, gift_products = gift_products)
+    assert get_amounts(cart) == get_amounts(reference)
+
+
+def test_cart_recounts_only_changed_lines():
+    cart = make_cart(["plain", "sale", "other", "sale_other"], None, 0)
+    cart.count_amount()
+    cart = reload(cart, PRODUCTS_BY_ID)
+    # first count of loaded cart is full
+    cart.count_amount()
+    unchanged = cart._pricing.lines[cart.line_items[1].id]
+
+    update_line(cart, 0, 2)
+    assert cart._pricing.update(cart.line_items) == 1
+    assert cart._pricing.lines[cart.line_items[1].id] is unchanged
+
+    remove_line(cart, 2)
+    assert cart._pricing.update(cart.line_items) == 1
+
+
+def test_loaded_cart_recounts_line_of_changed_product_price():
+    names = ["plain", "sale", "other"]
+    cart = make_cart(names + ["plain"], None, 0)
+    cart.count_amount()
+    products = {product_id: product.copy() for product_id, product in PRODUCTS_BY_ID.items()}
+    products[PRODUCTS["sale"].id].sale_price = 700
+
+    cart = reload(cart, products)
+    reference = cart.copy(deep = True)
+    cart.count_amount()
+    count_amount_reference(reference)
+    assert get_amounts(cart) == get_amounts(reference)
+    assert cart.line_items[1].price == 700
+
+
+def test_stored_cart_is_compact():
+    cart = make_cart(["plain", "sale"], COUPONS["per_item"], 0)
+    cart.count_amount()
+    cart_dict = cart.to_db_dict()
+    coupon = cart.coupons[0]
+    assert cart_dict["coupons"] == [{"_id": coupon.id, "code": coupon.code}]
+    for line_item in cart_dict["line_items"]:
+        assert set(line_item) == {"_id", "product_id", "quantity", "promo_price", "price"}
+
+
+def test_old_cart_is_compacted():
+    cart = make_cart(["plain", "sale", "other"], COUPONS["percentage"], 0)
+    cart.count_amount()
+    # cart, stored before compaction: embedded products and coupons, line items pricing
+    cart_dict = cart.dict(by_alias = True)
+    for line_item in cart_dict["line_items"]:
+        line_item["price"] = None
+        line_item["pricing"] = {"quantity": 1, "base": 1}
+    compact_cart = get_compact_cart(cart_dict)
+    assert compact_cart == {**cart.to_db_dict(), "line_items": compact_cart["line_items"]}
+    assert [line_item["price"] for line_item in compact_cart["line_items"]] == [500, 800]
+    assert all("pricing" not in line_item and "product" not in line_item for line_item in compact_cart["line_items"])
+    # compacted cart is compacted again without changes
+    assert get_compact_cart(compact_cart) == compact_cart
+
+
+def test_missing_coupon_is_removed_on_load():
+    cart = make_cart(["plain", "sale"], COUPONS["per_item"], 0)
+    cart.count_amount()
+    cart = BaseCart.from_db(cart.to_db_dict())
+    cart.set_coupons([None])
+    assert cart.coupons == []
+    assert cart.to_db_dict()["coupons"] == []
+    assert all(line_item.promo_price is None for line_item in cart.line_items)
+
+
+def test_client_line_pricing_is_not_trusted():
+    cart = make_cart(["plain", "other"], None, 0)
+    cart.count_amount()
+    cart = reload(cart, PRODUCTS_BY_ID)
+    line_item = LineItem(
+        product_id = PRODUCTS["other"].id,
+        product = PRODUCTS["other"],
+        pricing = {"quantity": 1, "promo_price": None, "product_price": 320, "product_sale_price": None, "base": 1},
+    )
+    cart.line_items.append(line_item)
+    reference = cart.copy(deep = True)
+    cart.count_amount()
+    count_amount_reference(reference)
+    assert get_amounts(cart) == get_amounts(reference)
@@ -0,0 +1,51 @@
+import uuid
+
+import pytest
+
+from apps.products.catalog import CatalogSnapshot
+from apps.products.models import BaseProduct, BaseProductCategory
+from apps.products.products import get_category_cursor, parse_category_cursor
+from apps.products.product_exceptions import InvalidProductsCursor
+
+
+def make_products(count: int, category_id: uuid.UUID):
+    return [
+        BaseProduct(name = f"product {i}", price = 100 + i, categories = [BaseProductCategory(_id = category_id)])
+        for i in range(count)
+    ]
+
+def get_all_pages(snapshot: CatalogSnapshot, category_id: uuid.UUID, limit: int) -> list:
+    products, cursor = [], None
+    while True:
+        page = snapshot.get_category_products_page(category_id, limit + 1, cursor = cursor)
+        products += [product.id for _, product in page[:limit]]
+        if len(page) <= limit:
+            return products
+        # cursor goes through its string form, as in api
+        cursor = parse_category_cursor(get_category_cursor(page[limit - 1][0]))
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7])
+def test_category_pages_follow_positions(limit):
+    category_id = uuid.uuid4()
+    products = make_products(7, category_id)
+    # custom order, some positions are equal (ordered by product id then)
+    positions = [5, 0, 3, 3, 1, 9, 3]
+    keys = sorted((position, product.id) for position, product in zip(positions, products))
+    snapshot = CatalogSnapshot(1, products, [], {category_id: keys})
+
+    expected = [product.id for product in snapshot.get_category_products(category_id)]
+    assert expected == [product_id for _, product_id in keys]
+    assert get_all_pages(snapshot, category_id, limit) == expected
+
+def test_category_pages_without_mapping():
+    category_id = uuid.uuid4()
+    snapshot = CatalogSnapshot(1, make_products(5, category_id), [])
+    expected = [product.id for product in snapshot.get_category_products(category_id)]
+    assert len(expected) == 5
+    assert get_all_pages(snapshot, category_id, 2) == expected
+
+@pytest.mark.parametrize("cursor", ["abc", "1", "x:" + str(uuid.uuid4()), "1:not-uuid"])
+def test_invalid_category_cursor(cursor):
+    with pytest.raises(InvalidProductsCursor):
+        parse_category_cursor(cursor)
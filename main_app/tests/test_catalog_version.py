@@ -0,0 +1,43 @@
+import asyncio
+
+from apps.products import catalog_version
+from apps.products.catalog_version import bump_catalog_version_async
+
+
+class FakeMetaCollection:
+    def __init__(self):
+        self.version = 0
+
+    async def find_one_and_update(self, query, update, upsert = False, return_document = None):
+        self.version += update["$inc"]["version"]
+        return {"_id": query["_id"], "version": self.version}
+
+class FakeDbProvider:
+    def __init__(self):
+        self.catalog_meta_db = FakeMetaCollection()
+
+
+def test_bump_does_not_wait_for_listeners(monkeypatch):
+    monkeypatch.setattr(catalog_version, "async_db_provider", FakeDbProvider())
+    calls = []
+
+    async def failing_listener(version):
+        calls.append(("failing", version))
+        raise RuntimeError("reload failed")
+
+    async def slow_listener(version):
+        await asyncio.sleep(0.05)
+        calls.append(("slow", version))
+
+    monkeypatch.setattr(catalog_version, "catalog_change_listeners", [failing_listener, slow_listener])
+
+    async def write():
+        version = await bump_catalog_version_async()
+        # write returns before listeners run
+        assert calls == []
+        await asyncio.sleep(0.1)
+        return version
+
+    assert asyncio.run(write()) == 1
+    # failed listener doesn't stop others
+    assert calls == [("failing", 1), ("slow", 1)]
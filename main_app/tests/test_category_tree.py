@@ -0,0 +1,85 @@
+import random
+import uuid
+
+import pytest
+
+from apps.products.category_tree import CategoryTreeIndex, build_category_tree, get_category_signature
+from apps.products.models import BaseCategory
+
+
+def update_index(index: CategoryTreeIndex, categories: dict, category_products: dict) -> int:
+    # same signatures, as for catalog snapshot
+    signatures = {
+        category_id: get_category_signature(category, category_products.get(category_id, []))
+        for category_id, category in categories.items()
+    }
+    return index.update(categories, category_products, signatures)
+
+def make_category(name: str, parent_id = None, menu_order: int = 0) -> BaseCategory:
+    return BaseCategory(name = name, slug = name, parent_id = parent_id, menu_order = menu_order)
+
+
+def test_tree_update_changes_only_changed_branch():
+    root = make_category("root")
+    child = make_category("child", parent_id = root.id)
+    other = make_category("other", menu_order = 1)
+    categories = {c.id: c for c in [root, child, other]}
+    products = [uuid.uuid4() for _ in range(3)]
+    category_products = {root.id: products[:1], child.id: products[1:]}
+    index = CategoryTreeIndex()
+    assert update_index(index, categories, category_products) == 3
+    assert index.tree == build_category_tree(categories, category_products)
+    other_node = index.nodes[other.id]
+
+    category_products[child.id] = products[1:2]
+    assert update_index(index, categories, category_products) == 1
+    assert index.tree == build_category_tree(categories, category_products)
+    assert index.nodes[root.id]["total_products_count"] == 2
+    assert index.nodes[other.id] is other_node
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_tree_updates_equal_full_build(seed):
+    rnd = random.Random(seed)
+    products = [uuid.UUID(int = rnd.getrandbits(128), version = 4) for _ in range(30)]
+    categories = {}
+    category_products = {}
+    index = CategoryTreeIndex()
+
+    def random_parent():
+        if not categories or rnd.random() < 0.2:
+            return None
+        if rnd.random() < 0.05:
+            # parent, that not exists
+            return uuid.UUID(int = rnd.getrandbits(128), version = 4)
+        return rnd.choice(list(categories))
+
+    for step in range(60):
+        action = rnd.random()
+        if action < 0.35 or not categories:
+            category = make_category(f"c{step}", parent_id = random_parent(), menu_order = rnd.randint(0, 3))
+            category.id = uuid.UUID(int = rnd.getrandbits(128), version = 4)
+            categories[category.id] = category
+            category_products[category.id] = rnd.sample(products, rnd.randint(0, 5))
+        elif action < 0.5:
+            category_id = rnd.choice(list(categories))
+            parent_id = categories.pop(category_id).parent_id
+            category_products.pop(category_id, None)
+            if parent_id in categories and rnd.random() < 0.5:
+                # parent is deleted with child in one reload
+                del categories[parent_id]
+                category_products.pop(parent_id, None)
+        elif action < 0.7:
+            # moved (maybe into own subtree, making a cycle)
+            category_id = rnd.choice(list(categories))
+            categories[category_id] = categories[category_id].copy(update = {"parent_id": random_parent()})
+        elif action < 0.85:
+            category_id = rnd.choice(list(categories))
+            categories[category_id] = categories[category_id].copy(update = {
+                "menu_order": rnd.randint(0, 3), "name": f"renamed {step}",
+            })
+        else:
+            category_id = rnd.choice(list(categories))
+            category_products[category_id] = rnd.sample(products, rnd.randint(0, 5))
+        update_index(index, categories, category_products)
+        assert index.tree == build_category_tree(categories, category_products)
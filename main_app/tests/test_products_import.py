@@ -0,0 +1,93 @@
+import uuid
+
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from pymongo.errors import BulkWriteError
+
+from apps.products import products_import
+from apps.products.products_import import ProductsImport, iter_file_rows
+
+
+app = FastAPI()
+
+@app.post("/rows")
+async def read_rows(file: UploadFile = File(...)):
+    # same upload file object, as products import route gets
+    return list(iter_file_rows(file.file, file.filename))
+
+client = TestClient(app)
+
+
+def post_file(content: bytes, filename: str = "products.csv"):
+    return client.post("/rows", files = {"file": (filename, content, "text/csv")})
+
+def test_csv_upload_rows():
+    content = "\ufeffname;price;categories\nЧай;100;tea,green\n\"Кофе; молотый\";250;\n".encode("utf-8")
+    response = post_file(content)
+    assert response.status_code == 200
+    assert response.json() == [
+        ["name", "price", "categories"],
+        ["Чай", "100", "tea,green"],
+        ["Кофе; молотый", "250", ""],
+    ]
+
+def test_csv_upload_spooled_to_disk():
+    # bigger than upload spool size, so file is rolled over to disk
+    rows = [f"product {i},{i}" for i in range(200000)]
+    response = post_file(("name,price\n" + "\r\n".join(rows)).encode("utf-8"))
+    assert response.status_code == 200
+    assert len(response.json()) == 200001
+    assert response.json()[-1] == ["product 199999", "199999"]
+
+def test_csv_upload_not_utf8():
+    response = post_file("name,price\nЧай,100\n".encode("cp1251"))
+    assert response.status_code == 400
+    assert response.json()["detail"]["reason"] == "csv file must be in utf-8"
+
+
+class FakeCollection:
+    def __init__(self, documents = None, write_error = None):
+        self.documents = documents or []
+        self.write_error = write_error
+        self.requests = []
+
+    def find(self, query, projection = None):
+        return list(self.documents)
+
+    def bulk_write(self, requests, ordered = True):
+        self.requests += requests
+        if self.write_error:
+            raise self.write_error
+        class Result:
+            upserted_count = len(requests)
+            matched_count = 0
+        return Result()
+
+class FakeDbProvider:
+    def __init__(self, **collections):
+        self.__dict__.update(collections)
+
+
+def test_category_products_write_error_is_reported(monkeypatch):
+    category = {"_id": uuid.uuid4(), "name": "Tea", "slug": "tea"}
+    # second mapping request: upsert of first product into category
+    write_error = BulkWriteError({
+        "writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key error"}],
+    })
+    db = FakeDbProvider(
+        products_db = FakeCollection(),
+        categories_db = FakeCollection([category]),
+        category_products_db = FakeCollection(write_error = write_error),
+    )
+    monkeypatch.setattr(products_import, "db_provider", db)
+    rows = iter([
+        ["slug", "name", "price", "categories"],
+        ["green-tea", "Green tea", "100", "tea"],
+        ["black-tea", "Black tea", "120", ""],
+    ])
+    report = ProductsImport().run(rows)
+    assert report["created"] == 2
+    assert report["errors"] == [
+        {"row": 2, "errors": ["categories mapping: E11000 duplicate key error"]},
+    ]
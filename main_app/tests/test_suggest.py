@@ -0,0 +1,42 @@
+import asyncio
+
+from apps.products import suggest
+from apps.products.catalog import CatalogSnapshot, catalog
+from apps.products.models import BaseProduct
+from apps.products.suggest import SuggestIndex
+
+
+def test_reload_uses_cached_popularity(monkeypatch):
+    products = [BaseProduct(name = "milk", price = 80), BaseProduct(name = "mint", price = 50)]
+    snapshot = CatalogSnapshot(1, products, [])
+    calls = []
+
+    async def get_products_popularity():
+        calls.append(1)
+        return {products[1].id: 5}
+
+    monkeypatch.setattr(suggest, "get_products_popularity", get_products_popularity)
+    monkeypatch.setattr(catalog, "snapshot", snapshot)
+    index = SuggestIndex()
+
+    asyncio.run(index.refresh_popularity())
+    assert [item["name"] for item in index.suggest("m")] == ["mint", "milk"]
+
+    # catalog reload rebuilds trie without orders aggregation
+    asyncio.run(index.rebuild_from_snapshot(CatalogSnapshot(2, products, [])))
+    assert calls == [1]
+    assert [item["name"] for item in index.suggest("m")] == ["mint", "milk"]
+
+
+def test_failed_refresh_keeps_popularity(monkeypatch):
+    products = [BaseProduct(name = "milk", price = 80), BaseProduct(name = "mint", price = 50)]
+    monkeypatch.setattr(catalog, "snapshot", CatalogSnapshot(1, products, []))
+    index = SuggestIndex()
+    index.popularity = {products[1].id: 5}
+
+    async def get_products_popularity():
+        raise RuntimeError("orders aggregation failed")
+
+    monkeypatch.setattr(suggest, "get_products_popularity", get_products_popularity)
+    asyncio.run(index.refresh_popularity())
+    assert index.popularity == {products[1].id: 5}
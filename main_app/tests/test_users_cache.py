@@ -0,0 +1,43 @@
+import asyncio
+
+from apps.users import models as users_models
+from apps.users import user as users_user
+from apps.users.cache import users_cache
+from apps.users.models import BaseUser, BaseUserDB
+from apps.users.user import get_user_cached
+
+
+class FakeUsersCollection:
+    def __init__(self, user_dict: dict):
+        self.user_dict = user_dict
+
+    async def find_one_and_update(self, query, update, return_document = None):
+        self.user_dict = {**self.user_dict, **update["$set"]}
+        return self.user_dict
+
+class FakeDbProvider:
+    def __init__(self, users_db):
+        self.users_db = users_db
+
+
+def test_cached_user_shows_write_after_update_db_async(monkeypatch):
+    user = BaseUserDB(username = "79000000000", hashed_password = "hash", bonuses = 500, bonuses_rank = 1)
+    users_db = FakeUsersCollection(user.dict(by_alias = True))
+    monkeypatch.setattr(users_models, "async_db_provider", FakeDbProvider(users_db))
+
+    async def get_user_async(username):
+        raise AssertionError("user must be taken from cache")
+
+    users_cache.set(user.username, user)
+    monkeypatch.setattr(users_user, "get_user_async", get_user_async)
+    try:
+        updated = BaseUser(**user.dict())
+        updated.bonuses -= 200
+        updated.bonuses_rank = 2
+        asyncio.run(updated.update_db_async())
+        cached = asyncio.run(get_user_cached(user.username))
+        assert cached.bonuses == 300
+        assert cached.bonuses_rank == 2
+        assert cached.hashed_password == "hash"
+    finally:
+        users_cache.delete(user.username)